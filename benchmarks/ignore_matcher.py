@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Dose GUI for TDD: skip pattern matching benchmark.
+
+Compares the former ``fnmatch`` loop over the skip patterns with the
+compiled ``PatternMatcher`` (a single regular expression), checking
+the paths of a synthetic burst of file system events, like the ones
+from a build writing lots of files. It also measures the skip pattern
+together with the ``GitIgnore`` rules of a sample ``.gitignore`` file.
+Usage::
+
+  python benchmarks/ignore_matcher.py [EVENTS]
+"""
+from __future__ import print_function
+import fnmatch, os, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dose.ignore import (FILENAME_PATTERN_TO_IGNORE, GitIgnore, # NOQA
+                         PatternMatcher)
+
+GITIGNORE = """
+*.o
+*.so
+/build/
+dist/
+*.egg-info/
+.tox/
+node_modules/
+!important.so
+docs/_build/**
+"""
+NAMES = ["module.py", "module.pyc", "lib.o", "lib.so", "README.rst",
+         "data.json", "test_module.py", "notes.txt~", ".coverage"]
+DIRECTORIES = ["", "pkg", os.path.join("pkg", "__pycache__"), "build",
+               os.path.join("src", "core", "deep", "tree"), ".git",
+               os.path.join("docs", "_build", "html")]
+
+
+def fnmatch_loop(skip_pattern):
+    """The former ``DoseWatcher._is_skipped`` implementation."""
+    def is_skipped(path):
+        for pattern in skip_pattern.split(";"):
+            if fnmatch.fnmatch(path, pattern.strip()):
+                return True
+        return False
+    return is_skipped
+
+
+def measure(is_skipped, paths):
+    """Events per second and the number of skipped paths."""
+    start = time.time()
+    skipped = sum(1 for path in paths if is_skipped(path))
+    return len(paths) / (time.time() - start), skipped
+
+
+def main(events=200000):
+    paths = [os.path.join(DIRECTORIES[idx % len(DIRECTORIES)],
+                          "{0}{1}".format(idx, NAMES[idx % len(NAMES)]))
+             for idx in range(events)]
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, ".gitignore"), "w") as gitfile:
+            gitfile.write(GITIGNORE)
+        gitignore = GitIgnore(directory)
+        matcher = PatternMatcher(FILENAME_PATTERN_TO_IGNORE)
+        print("Checking {0} event paths".format(events))
+        for name, is_skipped in [
+            ("fnmatch loop", fnmatch_loop(FILENAME_PATTERN_TO_IGNORE)),
+            ("PatternMatcher", matcher),
+            ("+ GitIgnore", lambda path: matcher(path) or gitignore(path)),
+        ]:
+            rate, skipped = measure(is_skipped, paths)
+            print("{0:>16}: {1:10.0f} events/s, {2} skipped"
+                  .format(name, rate, skipped))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Dose GUI for TDD: stat polling watcher CPU cost benchmark.
+
+Creates a temporary tree with lots of files, polls it for a while with
+the ``PollingObserver`` (default settings, but the CPU share), and shows
+the stats of its whole tree scans and the CPU share used by this process
+meanwhile: from the schedule call, including the first listing, and
+after the first listing. The latter should be within the observer
+``cpu_share`` (there are no hot directories here). The first one gets
+close to it as the time grows, but it's higher when it's not much
+longer than the delay between the scans. Usage::
+
+  python benchmarks/polling_cost.py [FILES [SECONDS [PERCENT]]]
+"""
+from __future__ import division, print_function
+import os, shutil, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dose.polling import PollingObserver # NOQA
+
+FILES_PER_DIRECTORY = 100
+
+
+class NullHandler(object):
+
+    def on_any_event(self, evt):
+        pass
+
+
+def main(files=100000, seconds=120, percent=2):
+    directory = tempfile.mkdtemp()
+    try:
+        print("Creating {0} files".format(files))
+        for idx in range(files):
+            subdir = os.path.join(directory,
+                                  str(idx // FILES_PER_DIRECTORY // 10),
+                                  str(idx // FILES_PER_DIRECTORY))
+            if idx % FILES_PER_DIRECTORY == 0:
+                os.makedirs(subdir)
+            open(os.path.join(subdir, "{0}.py".format(idx)), "w").close()
+
+        print("Polling for {0}s with {1}% of a core".format(seconds,
+                                                          percent))
+        observer = PollingObserver(cpu_share=percent / 100)
+        first = [] # CPU and wall times after the first listing
+
+        def report(stats):
+            if not first:
+                first.extend([sum(os.times()[:2]), time.time()])
+            print("  scan: {files} files, {directories} directories, "
+                  "{wall:.3f}s wall, {cpu:.3f}s CPU, next in {delay:.1f}s"
+                  .format(**stats))
+
+        cpu_start, wall_start = sum(os.times()[:2]), time.time()
+        observer.schedule(NullHandler(), directory, report=report)
+        observer.start()
+        time.sleep(seconds)
+        observer.stop()
+        observer.join()
+        cpu, wall = sum(os.times()[:2]), time.time()
+        print("CPU usage: {0:.2%} of a core, {1:.2%} after the first "
+              "listing".format((cpu - cpu_start) / (wall - wall_start),
+                               (cpu - first[0]) / (wall - first[1])))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(*[cast(arg) for cast, arg in zip([int, float, float],
+                                          sys.argv[1:])])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Dose GUI for TDD: test job output throughput benchmark.
+
+Compares the per-character ``flush_stream_threads`` (one thread per
+stream) with the chunked ``pump_streams`` (single selector thread)
+when pumping the output of a child process that writes lots of data
+to both standard streams. Usage::
+
+  python benchmarks/runner_throughput.py [MEGABYTES]
+"""
+from __future__ import print_function
+import io, os, subprocess, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dose.runner import flush_stream_threads, pump_streams # NOQA
+
+
+CHILD_CODE = """
+import sys, os
+line = (b"." * 79 + b"\\n") * 128
+for idx in range({blocks}):
+    os.write(2 if idx % 8 == 0 else 1, line)
+"""
+
+
+def measure(pump_cm, megabytes):
+    """Wall and CPU (this process) time to pump the child output."""
+    blocks = megabytes * 1024 * 1024 // (80 * 128)
+    code = CHILD_CODE.format(blocks=blocks)
+    null = io.open(os.devnull, "w", encoding="utf-8")
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = null
+    try:
+        cpu_start, wall_start = sum(os.times()[:2]), time.time()
+        process = subprocess.Popen([sys.executable, "-c", code], bufsize=0,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        with pump_cm(process):
+            process.wait()
+        return time.time() - wall_start, sum(os.times()[:2]) - cpu_start
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        null.close()
+
+
+def main(megabytes=4):
+    print("Pumping {0} MiB of child process output".format(megabytes))
+    for name, pump_cm in [("flush_stream_threads", flush_stream_threads),
+                          ("pump_streams", pump_streams)]:
+        wall, cpu = measure(pump_cm, megabytes)
+        print("{0:>20}: {1:8.3f}s wall, {2:8.3f}s CPU, {3:9.2f} MiB/s"
+              .format(name, wall, cpu, megabytes / wall))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
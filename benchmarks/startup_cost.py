@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Dose GUI for TDD: headless mode vs. GUI mode startup cost benchmark.
+
+Measures the wall time and the peak RSS of a fresh interpreter that
+imports everything each mode needs before watching (wxPython and
+docutils for the GUI mode), taking the best of a few runs. The GUI
+mode is also measured without wxPython (i.e. just the docutils part),
+as the whole GUI mode is unavailable when wxPython isn't installed.
+Usage::
+
+  python benchmarks/startup_cost.py [RUNS]
+"""
+from __future__ import division, print_function
+import os, subprocess, sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODES = [
+    ("headless", "import dose.__main__, dose.headless"),
+    ("GUI", "import dose.__main__, dose._legacy, dose.help, wx.html"),
+    ("GUI without wxPython", "import dose.__main__, dose.config, dose.rest, "
+                             "dose.watching, docutils.core, docutils.nodes"),
+]
+
+CHILD_CODE = """
+import resource, sys, time
+start = time.time()
+{imports}
+elapsed = time.time() - start
+scale = 1 if sys.platform == "darwin" else 1024 # Bytes or KiB
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale)
+"""
+
+
+def measure(imports, runs):
+    """Best (wall time, peak RSS) pair of the imports in the runs."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    results = []
+    for unused in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", CHILD_CODE.format(imports=imports)],
+            env=env,
+        )
+        elapsed, rss = output.split()
+        results.append((float(elapsed), int(rss)))
+    return min(results)
+
+
+def main(runs=5):
+    for name, imports in MODES:
+        try:
+            elapsed, rss = measure(imports, runs)
+        except subprocess.CalledProcessError:
+            print("{0:>20} mode: unavailable".format(name))
+            continue
+        print("{0:>20} mode: {1:.3f}s to import, {2:.1f}MiB peak RSS"
+              .format(name, elapsed, rss / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,11 +1,14 @@
 """Dose GUI for TDD: main script / entry point."""
-import sys, colorama
-from dose._legacy import DoseMainWindow
+import argparse, multiprocessing, os, sys, colorama
 from dose.misc import ucamel_method
 from dose.compat import wx, quote
 
 
-def main_wx(test_command=None):
+WINDOW_GAP = 10 # Pixels between the windows of several projects
+
+
+def main_wx(test_command=None, projects=(), max_jobs=1, **options):
+    from dose._legacy import DoseMainWindow
 
     class DoseApp(wx.App):
 
@@ -23,20 +26,295 @@ def main_wx(test_command=None):
     import wx.html as unused # NOQA
 
     app = DoseApp(redirect=False) # Don't redirect sys.stdout / sys.stderr
+    if not projects:
+        app.GetTopWindow().configure(**options)
+        if options["metrics"]:
+            dump_metrics_on_signal([app.GetTopWindow()])
+        if test_command:
+            app.GetTopWindow().auto_start(test_command)
+        app.MainLoop()
+        return
+
+    # Several projects, each one with its own semaphore window
+    from dose.projects import JobScheduler
+    from dose.watcher import SharedObserver
     if test_command:
-        app.GetTopWindow().auto_start(test_command)
-    app.MainLoop()
+        projects = [(os.curdir, test_command)] + list(projects)
+    options["observer"] = SharedObserver(
+        poll=options["poll"], poll_cpu_share=options["poll_cpu_share"],
+    )
+    options["scheduler"] = JobScheduler(max_jobs)
+    windows = open_project_windows(app.GetTopWindow(), projects, options)
+    if options["metrics"]:
+        dump_metrics_on_signal(windows)
+    try:
+        app.MainLoop() # Returns after the last window is closed
+    finally:
+        options["observer"].stop()
+
+
+def open_project_windows(first, projects, options):
+    """
+    Configure and start a semaphore window for each ``(directory,
+    command)`` project, reusing the ``first`` window for the first one.
+    The windows are placed side by side, unless there's a geometry
+    stored for the project.
+    """
+    from dose._legacy import DoseMainWindow
+    x, y = first.Position
+    windows = []
+    for idx, (directory, command) in enumerate(projects):
+        wnd = DoseMainWindow(None) if idx else first
+        windows.append(wnd)
+        wnd.configure(directory=directory,
+                      name=os.path.basename(os.path.abspath(directory)),
+                      **options)
+        if idx:
+            wnd.SetPosition((x + idx * (first.Size[0] + WINDOW_GAP), y))
+            wnd.Show()
+        wnd.use_project_geometry()
+        wnd.auto_start(command)
+    return windows
+
+
+def main_headless(test_command=None, projects=(), max_jobs=1,
+                  title_led=False, **options):
+    """Terminal-only mode, without importing wxPython nor docutils."""
+    from dose.headless import HeadlessWatcher, MainLoop
+    loop = MainLoop()
+    if projects:
+        from dose.projects import JobScheduler
+        from dose.watcher import SharedObserver
+        if test_command:
+            projects = [(os.curdir, test_command)] + list(projects)
+        options["observer"] = SharedObserver(
+            poll=options["poll"], poll_cpu_share=options["poll_cpu_share"],
+        )
+        options["scheduler"] = JobScheduler(max_jobs)
+    else:
+        projects = [(os.curdir, test_command)]
+    watchers = []
+    for directory, command in projects:
+        watcher = HeadlessWatcher(loop, title_led=title_led)
+        watcher.configure(directory=directory, call_string=command,
+                          **options)
+        if len(projects) > 1:
+            watcher.name = os.path.basename(os.path.abspath(directory))
+        watchers.append(watcher)
+    if options["metrics"]:
+        dump_metrics_on_signal(watchers, loop.call_after)
+    for watcher in watchers:
+        watcher.start()
+    try:
+        loop.run(lambda: any(watcher.watching for watcher in watchers))
+    finally:
+        for watcher in watchers:
+            watcher.stop()
+        if "observer" in options:
+            options["observer"].stop()
+
+
+def dump_metrics_on_signal(watchers, call_after=None):
+    """Print the watchers pipeline metrics on SIGUSR1, if possible."""
+    from dose.metrics import dump_hint, on_dump_signal
+    from dose import terminal
+
+    def dump():
+        for watcher in watchers:
+            watcher.print_metrics()
+
+    if call_after is None: # GUI
+        call_after = wx.CallAfter
+
+    if on_dump_signal(lambda: call_after(dump)):
+        terminal.clog.cyan("*** Metrics: run {0} to print them ***"
+                           .format(dump_hint()))
+
+
+def comma_separated(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def grace_period(value):
+    """Pair ``(seconds, percent)`` where one of them is None."""
+    if value.endswith("%"):
+        return None, float(value[:-1])
+    return float(value), None
+
+
+def parse_args(args):
+    """
+    Parse the command line arguments, returning a dictionary with the
+    ``test_command`` string and the ``DoseWatcher`` options. Everything
+    from the first positional argument onwards is the test command.
+    """
+    parser = argparse.ArgumentParser(
+        prog="dose",
+        usage="%(prog)s [options] [--] [TEST_COMMAND ...]",
+        description="Automated semaphore GUI showing the state in TDD.",
+    )
+    parser.add_argument("--preload", metavar="MODULES", action="append",
+                        type=comma_separated, default=[],
+                        help="comma-separated modules to import once in a "
+                             "warm fork server that runs Python test "
+                             "commands like 'python -m pytest'")
+    parser.add_argument("--affected-first", action="store_true",
+                        help="after a Python file changes, run only the "
+                             "test modules that import it (statically, "
+                             "maybe indirectly) before running all tests; "
+                             "their names replace a '{tests}' in the test "
+                             "command, or are appended to it")
+    parser.add_argument("--sharded", dest="shards", action="store_const",
+                        const=multiprocessing.cpu_count(), default=0,
+                        help="split the test modules in shards to be run "
+                             "concurrently, one for each CPU core, passing "
+                             "their names like --affected-first")
+    parser.add_argument("--shards", metavar="N", type=int,
+                        help="same to --sharded, but with N shards")
+    parser.add_argument("--cache", action="store_true",
+                        help="replay the stored result and output when the "
+                             "watched directory contents and the test "
+                             "command were already tested")
+    parser.add_argument("--cache-size", metavar="MiB", type=float,
+                        default=64,
+                        help="the cache size limit (default: 64)")
+    parser.add_argument("--history", action="store_true",
+                        help="store every test job result, duration and "
+                             "resource usage in a SQLite database, warning "
+                             "about duration regressions (see the "
+                             "--history-report option)")
+    parser.add_argument("--history-report", action="store_true",
+                        help="show the duration percentiles and trend of "
+                             "the test commands in the run history, then "
+                             "exit")
+    parser.add_argument("--history-file", metavar="FILE",
+                        help="history SQLite database file for the "
+                             "report (default: ~/.dose_history.sqlite3)")
+    parser.add_argument("--history-limit", metavar="N", type=int,
+                        default=100,
+                        help="number of runs of each test command in the "
+                             "report (default: 100)")
+    parser.add_argument("--policy", choices=["restart", "finish", "grace"],
+                        default="restart",
+                        help="what to do when something changes while a "
+                             "test job is running: kill and restart it "
+                             "(default), let it finish and run again, or "
+                             "restart it only within the --grace period")
+    parser.add_argument("--grace", metavar="X", type=grace_period,
+                        default=(10., None),
+                        help="for the grace policy, the test job is killed "
+                             "only while it's running for less than X "
+                             "seconds (default: 10), or less than X%% of "
+                             "its median duration, when X ends with '%%' "
+                             "(from the past sessions with --history)")
+    parser.add_argument("--skip-unchanged", action="store_true",
+                        help="neglect the file events that didn't change "
+                             "the file contents, like a touch or a save "
+                             "without edits (based on their hashes)")
+    parser.add_argument("--learn-artifacts", action="store_true",
+                        help="remember the files written by several "
+                             "consecutive test jobs (e.g. coverage data, "
+                             "test reports) as artifacts to be always "
+                             "neglected, stored in ~/.dose_artifacts.json")
+    parser.add_argument("--debounce", metavar="SECONDS", type=float,
+                        default=.1,
+                        help="quiet period ending a burst of changes, "
+                             "which triggers a single test job "
+                             "(default: 0.1, zero to disable)")
+    parser.add_argument("--debounce-max", metavar="SECONDS", type=float,
+                        default=1.,
+                        help="longest time to wait for a burst of changes "
+                             "to settle (default: 1)")
+    parser.add_argument("--poll", metavar="SECONDS", type=float,
+                        help="poll the watched directory instead of "
+                             "waiting for file system events, e.g. in "
+                             "network file systems or container bind "
+                             "mounts: the recently changed directories "
+                             "every SECONDS, the whole tree with a CPU "
+                             "share (see --poll-cpu-share)")
+    parser.add_argument("--poll-cpu-share", metavar="PERCENT", type=float,
+                        default=2,
+                        help="CPU share of a core for the whole tree scans "
+                             "when polling, i.e. a change outside the "
+                             "recently changed directories might take "
+                             "(100 / PERCENT - 1) times the scan CPU time "
+                             "to be seen (default: 2, i.e. 49 times)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="measure the latency of each watcher stage "
+                             "(up to the test job spawning) and count the "
+                             "events by the selector decision, printed "
+                             "at exit and on SIGUSR1")
+    parser.add_argument("--direct", action="store_true",
+                        help="run the test command without a shell, "
+                             "unless it has some shell syntax like pipes, "
+                             "redirects, '&&', globs or variables")
+    parser.add_argument("--gitignore", action="store_true",
+                        help="also neglect the changes in files ignored by "
+                             "the .gitignore files and .git/info/exclude")
+    parser.add_argument("--then", metavar="COMMAND", dest="pipeline",
+                        action="append", default=[],
+                        help="another test command (a pipeline stage) to "
+                             "be run after the previous ones have passed, "
+                             "e.g. a slow integration test suite (can be "
+                             "used several times)")
+    parser.add_argument("--headless", action="store_true",
+                        help="terminal-only mode, without the semaphore "
+                             "window (wxPython isn't even imported)")
+    parser.add_argument("--title-led", action="store_true",
+                        help="in the headless mode, also show the state "
+                             "in the terminal title")
+    parser.add_argument("--project", metavar=("DIRECTORY", "COMMAND"),
+                        dest="projects", nargs=2, action="append",
+                        default=[],
+                        help="watch another directory with its own test "
+                             "command and semaphore window (can be used "
+                             "several times), sharing a single watcher")
+    parser.add_argument("--max-jobs", metavar="N", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="maximum number of concurrent test jobs of "
+                             "all projects (default: number of CPU cores)")
+    parser.add_argument("test_command", nargs=argparse.REMAINDER,
+                        help=argparse.SUPPRESS)
+    options = vars(parser.parse_args(args))
+    command = options["test_command"]
+    if command[:1] == ["--"]:
+        command = command[1:]
+    if len(command) > 1:
+        command = map(quote, command)
+    options["test_command"] = " ".join(command)
+    if (options["headless"] and not options["test_command"]
+                            and not options["projects"]):
+        parser.error("the headless mode requires a test command")
+    options["preload"] = sum(options["preload"], [])
+    options["cache_size"] = int(options["cache_size"] * 1024 * 1024)
+    if not 0 < options["poll_cpu_share"] <= 100:
+        parser.error("the CPU share should be in the (0, 100] range")
+    options["poll_cpu_share"] /= 100
+    options["grace_seconds"], options["grace_percent"] = \
+        options.pop("grace")
+    return options
+
+
+def main_history_report(history_file, history_limit, **unused_options):
+    """The ``--history-report`` option."""
+    from dose.history import report
+    print(report(fname=history_file, limit=history_limit))
 
 
 def main(*args):
-    if not args:
-        if len(sys.argv) > 2:
-            args = map(quote, sys.argv[1:])
-        else:
-            args = sys.argv[1:]
+    options = parse_args(list(args or sys.argv[1:]))
+    if options.pop("history_report"):
+        return main_history_report(**options)
+    del options["history_file"], options["history_limit"]
     colorama.init() # Replaces sys.stdout / sys.stderr to
                     # accept ANSI escape codes on Windows
-    main_wx(test_command=" ".join(args))
+    from dose.core import signal_wakeup
+    with signal_wakeup(): # Test job exits (SIGCHLD) in the reactor thread
+        if options.pop("headless"):
+            main_headless(**options)
+        else:
+            del options["title_led"]
+            main_wx(**options)
 
 
 if __name__ == "__main__": # Not a "from dose import __main__"
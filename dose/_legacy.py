@@ -1,13 +1,12 @@
 # -*- coding: utf-8 -*-
-"""Dose - Legacy module with GUI, config file and watcher specifics."""
+"""Dose - Legacy module with GUI and config file specifics."""
 from __future__ import division, print_function, unicode_literals
-import sys, os, json, threading
-from datetime import datetime
-from fnmatch import fnmatch
-from functools import wraps
+import sys, os
 
-from . import terminal
 from .compat import wx
+from .config import config_writer, load_json
+from .misc import lru_cache
+from .watching import DoseWatcher
 
 # Thresholds and other constants
 PI = 3.141592653589793
@@ -18,8 +17,10 @@ FIRST_HEIGHT = 300
 MIN_OPACITY = 0x10 # Color intensity in byte range
 MAX_OPACITY = 0xff
 FIRST_OPACITY = 0x9f
-MOUSE_TIMER_WATCH = 20 # ms
-CONFIG_SAVE_LAG = 200 # ms
+DRAG_FRAME_INTERVAL = 16 # ms, geometry changes per frame while dragging
+BORDER_RATIO = .15 # Border size relative to the LED tile size
+FRAME_CACHE_SIZE = 16 # Rendered semaphore bitmaps kept for painting
+REGION_CACHE_SIZE = 8 # Window shape regions
 LED_OFF = 0x3f3f3f # Color
 LED_RED = 0xff0000
 LED_YELLOW = 0xffff00
@@ -28,18 +29,9 @@ FIRST_LEDS = (LED_RED, LED_YELLOW, LED_GREEN) # Standby colors
 LEDS_RED = (LED_RED, LED_OFF, LED_OFF)
 LEDS_YELLOW = (LED_OFF, LED_YELLOW, LED_OFF)
 LEDS_GREEN = (LED_OFF, LED_OFF, LED_GREEN)
+LEDS_PARTIAL = (LED_OFF, LED_YELLOW, LED_GREEN) # Green so far, still running
 BACKGROUND_COLOR = 0x000000
 BACKGROUND_BORDER_COLOR = 0x3f3f3f
-FILENAME_PATTERN_TO_IGNORE = "; ".join(["*.pyc",
-                                        "*.pyo",
-                                        ".git/*",
-                                        "__pycache__/*",
-                                        "*__pycache__/*",
-                                        "__pycache__",
-                                        ".*",
-                                        "*~",
-                                        "qt_temp.*", # Kate
-                                       ])
 CONFIG_FILE_NAME = ".dose.conf"
 CONFIG_DEFAULT_OPTIONS = {
   "position": (-1, -1), # by default let the win system decide
@@ -47,10 +39,12 @@ CONFIG_DEFAULT_OPTIONS = {
   "opacity": FIRST_OPACITY,
   "flipped": False
 }
+PROJECT_OPTIONS = ["position", "size"] # Stored for each watched directory
 
+@lru_cache(REGION_CACHE_SIZE)
 def rounded_rectangle_region(width, height, radius):
   """
-  Returns a rounded rectangle wx.Region
+  Returns a rounded rectangle wx.Region (cached, it shouldn't be changed)
   """
   bmp = wx.Bitmap.FromRGBA(width, height) # Mask color is #000000
   dc = wx.MemoryDC(bmp)
@@ -72,6 +66,56 @@ def int_to_darkened_color(color_int):
   """
   return int_to_color((color_int >> 1) & 0x7f7f7f) # Divide by 2 every color
 
+def semaphore_tile_size(width, height):
+  """
+  Returns the size of the square tile of each semaphore LED
+  """
+  return min(max(width, height), min(width, height) * 3) / 3
+
+@lru_cache(FRAME_CACHE_SIZE)
+def semaphore_bitmap(width, height, leds, flip):
+  """
+  Returns a wx.Bitmap with the rendered semaphore, where "leds" is a tuple
+  with the 3 led colors (cached, it shouldn't be changed)
+  """
+  rotation = -PI/2 if width > height else 0
+  tile_size = semaphore_tile_size(width, height)
+  border = tile_size * BORDER_RATIO
+  pen_width = border / 4
+  dist_circles = border / 5
+  radius = (tile_size - 2 * pen_width - dist_circles) / 2
+
+  bmp = wx.Bitmap.FromRGBA(width, height)
+  dc = wx.MemoryDC(bmp)
+  gc = wx.GraphicsContext.Create(dc) # Anti-aliasing
+  gc.Translate(width / 2, height / 2) # Center
+
+  # Draw the background
+  gc.SetBrush(wx.Brush(int_to_color(BACKGROUND_BORDER_COLOR)))
+  gc.DrawRectangle(-width / 2, -height / 2, width, height)
+  gc.SetBrush(wx.Brush(int_to_color(BACKGROUND_COLOR)))
+  gc.DrawRoundedRectangle(-width / 2 + border / 6,
+                          -height / 2 + border / 6,
+                          width - border / 3,
+                          height - border / 3,
+                          border)
+
+  # Draw the LEDs
+  gc.Rotate(rotation)
+  if flip:
+    gc.Rotate(PI)
+  gc.Translate(0, -tile_size)
+
+  for led in leds: # The led is an integer with the color
+    gc.SetBrush(wx.Brush(int_to_color(led)))
+    gc.SetPen(wx.Pen(int_to_darkened_color(led), width=int(pen_width)))
+    gc.DrawEllipse(-radius, -radius, 2 * radius, 2 * radius)
+    gc.Translate(0, tile_size)
+
+  del gc # Flushes the drawing to the bitmap
+  dc.SelectObject(wx.NullBitmap)
+  return bmp
+
 
 class DoseGraphicalSemaphore(wx.Frame):
   """
@@ -174,143 +218,153 @@ class DoseGraphicalSemaphore(wx.Frame):
 
   def _update_sizes(self):
     self._paint_width, self._paint_height = self.size
-    self._rotation = -PI/2 if self._paint_width > self._paint_height else 0
-    self._tile_size = min(max(self._paint_width, self._paint_height),
-                          min(self._paint_width, self._paint_height) * 3
-                         ) / 3
-    self._border = self._tile_size * .15
-    self._pen_width = self._border / 4
-    dist_circles = self._border / 5
-    self._radius = (self._tile_size - 2 * self._pen_width - dist_circles) / 2
-    self.SetShape(rounded_rectangle_region(self._paint_width,
-                                           self._paint_height,
-                                           self._border)
-                 )
+    self.SetShape(rounded_rectangle_region(
+      self._paint_width,
+      self._paint_height,
+      semaphore_tile_size(self._paint_width,
+                          self._paint_height) * BORDER_RATIO,
+    ))
 
   def _draw(self):
-    dc = wx.AutoBufferedPaintDCFactory(self)
-    gc = wx.GraphicsContext.Create(dc) # Anti-aliasing
-    gc.Translate(self._paint_width / 2,
-                 self._paint_height / 2) # Center
-
-    # Draw the background
-    gc.SetBrush(wx.Brush(int_to_color(BACKGROUND_BORDER_COLOR)))
-    gc.DrawRectangle(-self._paint_width / 2,
-                     -self._paint_height / 2,
-                     self._paint_width,
-                     self._paint_height)
-    gc.SetBrush(wx.Brush(int_to_color(BACKGROUND_COLOR)))
-    gc.DrawRoundedRectangle(-self._paint_width / 2 + self._border / 6,
-                            -self._paint_height / 2 + self._border / 6,
-                            self._paint_width - self._border / 3,
-                            self._paint_height - self._border / 3,
-                            self._border)
-
-    # Draw the LEDs
-    gc.Rotate(self._rotation)
-    if self.flip:
-      gc.Rotate(PI)
-    gc.Translate(0, -self._tile_size)
-
-    for led in self.leds: # The led is an integer with the color
-      gc.SetBrush(wx.Brush(int_to_color(led)))
-      gc.SetPen(wx.Pen(int_to_darkened_color(led),
-                       width=int(self._pen_width))
-               )
-      gc.DrawEllipse(-self._radius,
-                     -self._radius,
-                     2 * self._radius,
-                     2 * self._radius)
-      gc.Translate(0, self._tile_size)
+    dc = wx.PaintDC(self) # A single blit, no double buffering needed
+    dc.DrawBitmap(semaphore_bitmap(self._paint_width, self._paint_height,
+                                   self.leds, self.flip), 0, 0)
 
 
 class DoseInteractiveSemaphore(DoseGraphicalSemaphore):
   """
-  Just a DojoGraphicalSemaphore, but now responsive to left click
+  Just a DojoGraphicalSemaphore, but now responsive to left click:
+  dragging moves the window, resizes it while Ctrl is down, or changes its
+  opacity while Shift is down
   """
   def __init__(self, parent):
     super(DoseInteractiveSemaphore, self).__init__(parent)
-    self._timer = wx.Timer(self)
+    self._key_state = None
+    self._pending = None # Latest (pos, size, opacity) still not applied
+    self._timer = wx.Timer(self) # One shot per frame while dragging
     self.Bind(wx.EVT_LEFT_DOWN, self.on_left_down)
+    self.Bind(wx.EVT_LEFT_UP, self.on_left_up)
+    self.Bind(wx.EVT_MOTION, self.on_motion)
+    self.Bind(wx.EVT_MOUSE_CAPTURE_LOST, self.on_capture_lost)
     self.Bind(wx.EVT_TIMER, self.on_timer, self._timer)
 
   def on_left_down(self, evt):
+    """
+    Starts dragging, capturing the mouse, since the motion events wouldn't
+    happen once the mouse gets outside the frame
+    """
+    if not self.HasCapture():
+      self.CaptureMouse()
     self._key_state = None # Ensures initialization
-    self.on_timer(evt)
+    self._drag(evt)
+
+  def on_motion(self, evt):
+    if self.HasCapture() and evt.LeftIsDown():
+      self._drag(evt)
+
+  def on_left_up(self, evt):
+    if self.HasCapture():
+      self.ReleaseMouse()
+    self._end_drag()
+
+  def on_capture_lost(self, evt): # Required on MSW
+    self._end_drag()
 
   def on_timer(self, evt):
+    self._apply_geometry()
+
+  def _end_drag(self):
+    self._timer.Stop()
+    self._apply_geometry()
+    self._key_state = None
+
+  def _drag(self, evt):
     """
-    Keep watching the mouse displacement via timer
-    Needed since EVT_MOVE doesn't happen once the mouse gets outside the
-    frame
+    Updates the pending geometry from the mouse position (in screen
+    coordinates, as the window itself might be moving), scheduling it to
+    be applied in the next frame, so a burst of motion events (e.g. while
+    a test job is loading the machine) results in a single change
     """
-    ctrl_is_down = wx.GetKeyState(wx.WXK_CONTROL)
-    shift_is_down = wx.GetKeyState(wx.WXK_SHIFT)
-    ms = wx.GetMouseState()
-    new_pos = None
+    key_state = evt.ControlDown(), evt.ShiftDown()
+    mouse_x, mouse_y = wx.GetMousePosition()
 
     # New initialization when keys pressed change
-    if self._key_state != (ctrl_is_down, shift_is_down):
-      self._key_state = (ctrl_is_down, shift_is_down)
+    if self._key_state != key_state:
+      self._apply_geometry() # Starts from the current geometry
+      self._key_state = key_state
 
       # Keep state at click
-      self._click_ms_x, self._click_ms_y = ms.x, ms.y
+      self._click_ms_x, self._click_ms_y = mouse_x, mouse_y
       self._click_frame_x, self._click_frame_y = self.pos
       self._click_frame_width, self._click_frame_height = self.size
       self._click_opacity = self.opacity
 
-      # Avoids refresh when there's no move (stores last mouse state)
-      self._last_ms = ms.x, ms.y
-
       # Quadrant at click (need to know how to resize)
       width, height = self.size
       self._quad_signal_x = 1 if (self._click_ms_x -
                                   self._click_frame_x) / width > .5 else -1
       self._quad_signal_y = 1 if (self._click_ms_y -
                                   self._click_frame_y) / height > .5 else -1
+      return
+
+    self._pending = self._drag_geometry(mouse_x - self._click_ms_x,
+                                        mouse_y - self._click_ms_y)
+    if not self._timer.IsRunning():
+      self._timer.Start(DRAG_FRAME_INTERVAL, True)
 
-    # "Polling watcher" for mouse left button while it's kept down
-    if (wx.__version__ >= "3" and ms.leftIsDown) or \
-       (wx.__version__ <  "3" and ms.leftDown):
-      if self._last_ms != (ms.x, ms.y): # Moved?
-        self._last_ms = (ms.x, ms.y)
-        delta_x = ms.x - self._click_ms_x
-        delta_y = ms.y - self._click_ms_y
-
-        # Change transparency / opacity
-        if shift_is_down:
-          self.opacity = max(MIN_OPACITY,
-                             min(MAX_OPACITY, self._click_opacity - delta_y)
-                            )
-
-        # Resize
-        if ctrl_is_down:
-          # New size
-          new_w = max(MIN_WIDTH, self._click_frame_width +
-                                 2 * delta_x * self._quad_signal_x
-                     )
-          new_h = max(MIN_HEIGHT, self._click_frame_height +
-                                  2 * delta_y * self._quad_signal_y
-                     )
-          self.size = new_w, new_h
-
-          # Center should be kept
-          center_x = self._click_frame_x + self._click_frame_width / 2
-          center_y = self._click_frame_y + self._click_frame_height / 2
-          new_pos = (center_x - new_w / 2,
-                     center_y - new_h / 2)
-
-        # Move the window
-        if not (ctrl_is_down or shift_is_down):
-          new_pos = (self._click_frame_x + delta_x,
-                     self._click_frame_y + delta_y)
-
-      if new_pos is not None:
-        self.pos = new_pos
-
-      # Since left button is kept down, there should be another one shot
-      # timer event again, without creating many timers like wx.CallLater
-      self._timer.Start(MOUSE_TIMER_WATCH, True)
+  def _drag_geometry(self, delta_x, delta_y):
+    """
+    Returns the (pos, size, opacity) triple for the mouse displacement since
+    the click, where None means "unchanged"
+    """
+    ctrl_is_down, shift_is_down = self._key_state
+    new_pos = new_size = new_opacity = None
+
+    # Change transparency / opacity
+    if shift_is_down:
+      new_opacity = max(MIN_OPACITY,
+                        min(MAX_OPACITY, self._click_opacity - delta_y)
+                       )
+
+    # Resize
+    if ctrl_is_down:
+      # New size
+      new_w = max(MIN_WIDTH, self._click_frame_width +
+                             2 * delta_x * self._quad_signal_x
+                 )
+      new_h = max(MIN_HEIGHT, self._click_frame_height +
+                              2 * delta_y * self._quad_signal_y
+                 )
+      new_size = new_w, new_h
+
+      # Center should be kept
+      center_x = self._click_frame_x + self._click_frame_width / 2
+      center_y = self._click_frame_y + self._click_frame_height / 2
+      new_pos = (int(round(center_x - new_w / 2)),
+                 int(round(center_y - new_h / 2)))
+
+    # Move the window
+    if not (ctrl_is_down or shift_is_down):
+      new_pos = (self._click_frame_x + delta_x,
+                 self._click_frame_y + delta_y)
+
+    return new_pos, new_size, new_opacity
+
+  def _apply_geometry(self):
+    """
+    Applies only the latest pending geometry, if any and if it changes
+    something
+    """
+    if self._pending is None:
+      return
+    new_pos, new_size, new_opacity = self._pending
+    self._pending = None
+    if new_opacity is not None and new_opacity != self.opacity:
+      self.opacity = new_opacity
+    if new_size is not None and new_size != tuple(self.size):
+      self.size = new_size
+    if new_pos is not None and new_pos != tuple(self.pos):
+      self.pos = new_pos
 
 
 class DosePopupMenu(wx.Menu):
@@ -358,140 +412,6 @@ class DosePopupMenu(wx.Menu):
         self.Bind(wx.EVT_MENU, callback, item)
 
 
-class DoseWatcher(object):
-  """
-  A class to watch
-  """
-  def __init__(self):
-    self.directory = os.path.curdir # Default directory
-    self.call_string = ""
-    self.skip_pattern = FILENAME_PATTERN_TO_IGNORE
-    self._watching = False
-
-  @property
-  def watching(self):
-    return self._watching
-
-  def has_call_string(self):
-    return len(self.call_string.strip()) > 0
-
-  def _end_callback(self, result):
-    if self._runner.killed:
-      if self._runner.spawned:
-        terminal.clog.magenta("*** Killed! ***")
-    elif result == 0:
-      self.on_green()
-      self._last_fnames = []
-    else:
-      self.on_red()
-      self._last_fnames = []
-
-  def _exc_callback(self, exc_type, exc_value, traceback):
-    from traceback import format_exception
-    self.stop() # Watching no more
-    terminal.hr.red("=")
-    terminal.clog.red("[Dose] Error while trying to run the test job")
-    terminal.hr.red("=")
-    for line in format_exception(exc_type, exc_value, traceback):
-      terminal.log.magenta(line.rstrip())
-    terminal.hr.red("=")
-    self.on_stop(exc_value)
-
-  def _emit_end(self, result):
-    wx.CallAfter(self._end_callback, result)
-
-  def _emit_exc(self, exc_type, exc_value, traceback):
-    wx.CallAfter(self._exc_callback, exc_type, exc_value, traceback)
-
-  def _print_timestamp(self):
-    timestamp = datetime.now()
-    terminal.terminal_size.retrieve_width() # Useful if there's no SIGWINCH
-    terminal.hr.yellow("=")
-    terminal.clog.yellow("[Dose] {0}".format(timestamp))
-    terminal.hr.yellow("=")
-
-  def _print_header(self, evt=None):
-    if evt is None:
-      terminal.clog.cyan("*** First call ***")
-    else:
-      terminal.clog.cyan("*** {item} {event}: {path} ***".format(
-        item = "Directory" if evt.is_directory else "File",
-        event = evt.event_type,
-        path = evt.path,
-      ))
-
-  def _run_subprocess(self):
-    if self.watching:
-      from .runner import RunnerThreadCallback
-      self._print_header(self._evts.pop())
-      if not self._evts: # Multiple events at once, only the last should run
-        self.on_yellow() # State changed: "waiting" for a subprocess to finish
-        self._runner = RunnerThreadCallback(test_command=self.call_string,
-                                            work_dir=self.directory,
-                                            before=self._print_timestamp,
-                                            after=self._emit_end,
-                                            exception=self._emit_exc)
-
-  def _watchdog_handler(self, evt):
-    self._last_fnames.append(evt.path)
-    self._runner.kill() # Triggers end/exception callback
-    self._evts.append(evt)
-    wx.CallAfter(self._run_subprocess) # After the runner callbacks
-
-  def start(self):
-    """Starts watching the path and running the test jobs."""
-    assert not self.watching
-
-    def selector(evt):
-      if (evt.is_directory or
-          evt.event_type not in ["created", "deleted", "modified"]):
-        return False
-      path = evt.path
-      if path in self._last_fnames: # Detected a "killing cycle"
-        return False
-      for pattern in self.skip_pattern.split(";"):
-        if fnmatch(path, pattern.strip()):
-          return False
-      return True
-
-    def watchdog_handler(evt):
-      wx.CallAfter(self._watchdog_handler, evt)
-
-    # Force a first event
-    self._watching = True
-    self._last_fnames = []
-    self._evts = [None]
-    self._run_subprocess()
-
-    # Starts the watchdog observer
-    from .watcher import watcher
-    self._watcher = watcher(path=self.directory,
-                            selector=selector, handler=watchdog_handler)
-    self._watcher.__enter__() # Returns a started watchdog.observers.Observer
-
-  def stop(self):
-    if self.watching:
-      self._watcher.__exit__(None, None, None)
-      self._runner.kill()
-      self._watching = False
-
-
-def call_after(lag):
-  """
-  Parametrized decorator for calling a function after a time ``lag`` given
-  in milliseconds. This cancels simultaneous calls.
-  """
-  def decorator(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-      wrapper.timer.cancel() # Debounce
-      wrapper.timer = threading.Timer(lag, func, args=args, kwargs=kwargs)
-      wrapper.timer.start()
-    wrapper.timer = threading.Timer(0, lambda: None) # timer.cancel now exists
-    return wrapper
-  return decorator
-
-
 class DoseConfig(dict):
   """
   Handle load and storage of configuration options.
@@ -504,37 +424,51 @@ class DoseConfig(dict):
 
   If none of these files are present, dose fallback to default values.
   Configuration changes automatically schedules its storage/saving process to
-  the configuration file after a few milliseconds.
+  the configuration file after a few milliseconds, in a single thread shared
+  by every instance, storing only the changed options (merged with the ones
+  currently in the file, which might come from another Dose instance).
+
+  When there's a "project" (the absolute path of the watched directory),
+  the PROJECT_OPTIONS (window geometry) are stored for that project alone,
+  as several windows for distinct projects might be opened at once.
   """
   path = os.path.join(os.path.expanduser("~"), CONFIG_FILE_NAME)
+  project = None
+
+  def project_key(self, k):
+    """
+    Key in the file for the given option, e.g. "size /home/user/project"
+    """
+    if self.project is None or k not in PROJECT_OPTIONS:
+      return k
+    return " ".join([k, self.project])
 
   def __missing__(self, key): # This allows saving ONLY what changes
-    return CONFIG_DEFAULT_OPTIONS[key]
+    option = key.split(" ", 1)[0]
+    if option != key and option in self: # Not stored for the project
+      return super(DoseConfig, self).__getitem__(option)
+    return CONFIG_DEFAULT_OPTIONS[option]
 
-  def __setitem__(self, k, v):
-    super(DoseConfig, self).__setitem__(k, v)
-    self.store_options()
+  def __getitem__(self, k):
+    return super(DoseConfig, self).__getitem__(self.project_key(k))
 
-  @call_after(CONFIG_SAVE_LAG * 1e-3)
-  def store_options(self):
-    with open(self.path, "w") as config_file:
-      json.dump(self, config_file, indent=4, separators=(',',': '))
+  def __setitem__(self, k, v):
+    key = self.project_key(k)
+    super(DoseConfig, self).__setitem__(key, v)
+    config_writer.update(self.path, {key: v})
 
   def __init__(self):
-    if os.path.exists(DoseConfig.path):
-      with open(DoseConfig.path, "r") as config_file:
-        self.update(json.load(config_file))
+    self.update(load_json(DoseConfig.path))
     if os.path.exists(CONFIG_FILE_NAME):
       self.path = os.path.abspath(CONFIG_FILE_NAME)
-      with open(self.path, "r") as config_file:
-        self.update(json.load(config_file))
+      self.update(load_json(self.path))
 
 
 class DoseMainWindow(DoseInteractiveSemaphore, DoseWatcher):
 
   def __init__(self, parent):
     DoseInteractiveSemaphore.__init__(self, parent)
-    DoseWatcher.__init__(self)
+    DoseWatcher.__init__(self, wx.CallAfter)
     self.SetTitle("Dose") # Seen by the window manager
     self.popmenu = {k:DosePopupMenu(self, k) for k in (True, False)}
 
@@ -546,6 +480,19 @@ class DoseMainWindow(DoseInteractiveSemaphore, DoseWatcher):
     self.call_string = test_command
     self.on_start()
 
+  def use_project_geometry(self):
+    """
+    Store the window position and size for the watched directory from
+    now on, restoring the ones previously stored for it, if any
+    """
+    config = self._config
+    config.project = os.path.abspath(self.directory)
+    if config.project_key("position") in config:
+      self.Position = config["position"]
+    if config.project_key("size") in config:
+      self.ClientSize = config["size"]
+      self.SendSizeEvent() # Needed for wxGTK
+
   def on_right_down(self, evt):
     self.PopupMenu(self.popmenu[self.watching], evt.Position)
 
@@ -567,6 +514,9 @@ class DoseMainWindow(DoseInteractiveSemaphore, DoseWatcher):
   def on_green(self, evt=None):
     self.leds = LEDS_GREEN
 
+  def on_partial(self, evt=None):
+    self.leds = LEDS_PARTIAL
+
   def on_start(self, evt=None):
     if not self.has_call_string():
       self.on_define_call_string()
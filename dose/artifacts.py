@@ -0,0 +1,113 @@
+"""Dose GUI for TDD: suppression of the files written by the test jobs."""
+import io, json, os, threading, time
+from .misc import atomic_write
+
+SETTLE_SECONDS = .5 # Delay of the events after the test job ends
+LEARN_CYCLES = 3 # Consecutive test job windows writing an artifact
+ARTIFACTS_FILE_NAME = ".dose_artifacts.json"
+
+
+class SelfWriteTracker(object):
+    """
+    Neglect the files written by the test jobs themselves (coverage
+    data, test reports, snapshots, databases, etc.), based on the
+    paths of the events in the test job time windows, from the test
+    job start to ``settle`` seconds after its end.
+
+    An event in a window is a self-write when its path had an event in
+    the previous window without being the reason for killing that
+    test job (that's probably a change made by the user), or when it's
+    a known ``artifacts`` path. With ``learn_cycles``, a path with
+    events in that many consecutive windows becomes an artifact, and
+    ``on_learn(paths)`` is called.
+
+    Outside the windows, nothing is neglected.
+    """
+    def __init__(self, settle=SETTLE_SECONDS, artifacts=(),
+                 learn_cycles=None, on_learn=lambda paths: None):
+        self.settle = settle
+        self.artifacts = set(artifacts)
+        self.learn_cycles = learn_cycles
+        self.on_learn = on_learn
+        self._previous = set() # Self-writes of the previous window
+        self._current = set()
+        self._killers = set() # Paths that killed the current test job
+        self._counts = {} # {path: number of consecutive windows}
+        self._start = self._end = None
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Start the window of a new test job."""
+        with self._lock:
+            learned = self._rotate()
+            self._start, self._end = time.time(), None
+        if learned:
+            self.on_learn(learned)
+
+    def end(self):
+        """The test job had finished, its window ends after settling."""
+        with self._lock:
+            self._end = time.time()
+
+    def killed_by(self, paths):
+        """These changes were made by the user, not by the test job."""
+        with self._lock:
+            self._killers.update(paths)
+
+    def observe(self, path):
+        """Register an event, returning whether it's a self-write."""
+        now = time.time()
+        with self._lock:
+            if self._start is None or (self._end is not None and
+                                       now > self._end + self.settle):
+                return False
+            self._current.add(path)
+            return path in self._previous or path in self.artifacts
+
+    def _rotate(self):
+        """Finish the current window, returning the learned artifacts."""
+        learned = []
+        current = self._current - self._killers # Killers aren't artifacts
+        if self.learn_cycles:
+            self._counts = {path: self._counts.get(path, 0) + 1
+                            for path in current}
+            learned = sorted(path for path, count in self._counts.items()
+                             if count >= self.learn_cycles and
+                                path not in self.artifacts)
+            self.artifacts.update(learned)
+        self._previous = current
+        self._current, self._killers = set(), set()
+        return learned
+
+
+class ArtifactStore(object):
+    """
+    Persistent learned artifacts of each project, stored in a single
+    JSON file (in the home directory, by default) as a dictionary of
+    lists, whose keys are the projects absolute directories.
+    """
+    def __init__(self, fname=None):
+        if fname is None:
+            fname = os.path.join(os.path.expanduser("~"), ARTIFACTS_FILE_NAME)
+        self.fname = fname
+        self._lock = threading.Lock()
+
+    def _load_all(self):
+        try:
+            with io.open(self.fname, "r", encoding="utf-8") as json_file:
+                return json.load(json_file)
+        except (IOError, OSError, ValueError): # Missing or invalid
+            return {}
+
+    def load(self, directory):
+        return self._load_all().get(os.path.abspath(directory), [])
+
+    def add(self, directory, paths):
+        """Store more artifacts, merged with the ones in the file."""
+        key = os.path.abspath(directory)
+        with self._lock:
+            data = self._load_all()
+            data[key] = sorted(set(data.get(key, [])).union(paths))
+            atomic_write(self.fname, json.dumps(data, indent=2,
+                                                sort_keys=True)
+                                         .encode("utf-8"))
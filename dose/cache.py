@@ -0,0 +1,254 @@
+"""Dose GUI for TDD: content-addressed test job result cache."""
+import errno, hashlib, io, json, os, threading, traceback
+from .misc import atomic_write
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+CACHE_DIR_NAME = ".dose_cache"
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+DIGEST_MODULUS = 1 << 160 # SHA-1 digests are 160 bits long
+
+
+def file_digest(fname, chunk_size=65536):
+    """SHA-1 hex digest of the file contents."""
+    sha1 = hashlib.sha1()
+    with open(fname, "rb") as fobj:
+        for chunk in iter(lambda: fobj.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def entry_digest(path, digest):
+    """Integer digest of a single (path, file digest) tree entry."""
+    data = "\0".join([path, digest]).encode("utf-8")
+    return int(hashlib.sha1(data).hexdigest(), 16)
+
+
+class TreeState(object):
+    """
+    Incremental hash of the files in a directory, where ``skip`` tells
+    which (relative) paths should be ignored.
+
+    The tree digest is the sum of the digests of every (path, file
+    contents digest) entry, so that updating a single file doesn't
+    require hashing the whole tree again. The ``scan`` method hashes
+    every file, it can be called in another thread, and the ``digest``
+    is None until it finishes. Afterwards, ``update`` should be called
+    for each changed path.
+    """
+    def __init__(self, directory, skip=lambda path: False):
+        self.directory = directory
+        self.skip = skip
+        self._files = {} # {path: file digest}
+        self._sum = 0
+        self._lock = threading.Lock()
+        self._scanned = False
+
+    def scan(self, top=""):
+        """Hash every file in the directory (or in its ``top`` subdir)."""
+        for root, dirs, files in os.walk(os.path.join(self.directory, top)):
+            rel_root = os.path.relpath(root, self.directory)
+            if rel_root == os.curdir:
+                rel_root = ""
+            dirs[:] = [name for name in dirs
+                       if not self.skip(os.path.join(rel_root, name))]
+            for name in files:
+                path = os.path.join(rel_root, name)
+                if not self.skip(path) and path not in self._files:
+                    self.update(path)
+        if not top:
+            self._scanned = True
+
+    def update_directory(self, path):
+        """Forget and hash again every file in a changed directory."""
+        prefix = os.path.join(path, "")
+        with self._lock:
+            for fname in [fname for fname in self._files
+                                if fname.startswith(prefix)]:
+                self._sum -= entry_digest(fname, self._files.pop(fname))
+            self._sum %= DIGEST_MODULUS
+        if os.path.isdir(os.path.join(self.directory, path)):
+            self.scan(path)
+
+    def update(self, path):
+        """Hash again (or remove) the given path after a change."""
+        if self.skip(path):
+            return
+        try:
+            digest = file_digest(os.path.join(self.directory, path))
+        except (IOError, OSError): # Removed, a directory or unreadable
+            digest = None
+        with self._lock:
+            old_digest = self._files.pop(path, None)
+            if old_digest is not None:
+                self._sum -= entry_digest(path, old_digest)
+            if digest is not None:
+                self._files[path] = digest
+                self._sum += entry_digest(path, digest)
+            self._sum %= DIGEST_MODULUS
+
+    @property
+    def digest(self):
+        """Hex digest of the whole tree, None while scanning."""
+        if self._scanned:
+            return "{0:040x}".format(self._sum)
+
+
+def stat_key(stat):
+    """Modification time, size and inode, telling when to hash again."""
+    return (getattr(stat, "st_mtime_ns", stat.st_mtime), stat.st_size,
+            stat.st_ino)
+
+
+class ContentIndex(object):
+    """
+    In-memory index of the files in a directory with their stat key
+    (see ``stat_key``) and contents digest, telling which file events
+    actually changed something.
+
+    Files are hashed only when their stat key changes, e.g. a touch or a
+    save without edits, which are detected as no change afterwards. The
+    index is built lazily by the ``changed`` calls, nothing is hashed
+    beforehand, so the first event of each file is always a change. The
+    ``check`` method calls it in a worker thread.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {} # {path: (stat key, file digest)}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def check(self, paths, callback):
+        """
+        Enqueue the paths to be checked by ``changed`` in the worker
+        thread (started on the first call), which calls
+        ``callback(changes)`` with the list of results, in order.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put((paths, callback))
+
+    def close(self):
+        """Stop the worker after the enqueued checks."""
+        self._queue.put(None)
+
+    def _worker(self):
+        for paths, callback in iter(self._queue.get, None):
+            try:
+                callback([self.changed(path) for path in paths])
+            except Exception:
+                traceback.print_exc() # The worker should never stop
+
+    def _entry(self, path, key=None):
+        """
+        Pair with the stat key and the digest of the file, or None when
+        it's missing or when it was changed while being hashed.
+        """
+        fname = os.path.join(self.directory, path)
+        try:
+            if key is None:
+                key = stat_key(os.stat(fname))
+            digest = file_digest(fname)
+            if stat_key(os.stat(fname)) != key:
+                return None
+        except (IOError, OSError): # Removed, a directory or unreadable
+            return None
+        return key, digest
+
+    def changed(self, path):
+        """
+        Whether the file contents changed since the last time it was
+        indexed (a new, unknown or removed file is a change), updating
+        the index.
+        """
+        try:
+            key = stat_key(os.stat(os.path.join(self.directory, path)))
+        except OSError: # Removed
+            key = None
+        with self._lock:
+            old_entry = self._files.get(path)
+        if old_entry is not None and old_entry[0] == key:
+            return False # Fast path, without hashing
+        entry = None if key is None else self._entry(path, key)
+        with self._lock:
+            if entry is None:
+                self._files.pop(path, None)
+            else:
+                self._files[path] = entry
+        return entry is None or old_entry is None or \
+               old_entry[1] != entry[1]
+
+
+class RunCache(object):
+    """
+    Persistent cache of test job results, where each entry is a JSON
+    file in the cache ``directory`` with the return code and the
+    captured output, whose name is the hash of the key (the tree
+    digest and the test command, for example). The least recently used
+    entries are removed when the whole cache gets bigger than
+    ``max_bytes``.
+    """
+    def __init__(self, directory=None, max_bytes=CACHE_MAX_BYTES):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), CACHE_DIR_NAME)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def _fname(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Cached entry dictionary (or None), marking it as used."""
+        fname = self._fname(key)
+        try:
+            with io.open(fname, encoding="utf-8") as entry_file:
+                entry = json.load(entry_file)
+            os.utime(fname, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, returncode, output):
+        """
+        Store the result, where the output is a list of
+        ``(fd, text)`` pairs (``fd`` is 1 for stdout, 2 for stderr).
+        """
+        try:
+            os.makedirs(self.directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        data = json.dumps({"returncode": returncode, "output": output})
+        atomic_write(self._fname(key), data.encode("ascii"))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries exceeding the limit."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for unused, size, unused in entries)
+        for unused, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
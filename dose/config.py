@@ -0,0 +1,119 @@
+"""
+Dose GUI for TDD: configuration file persistence.
+
+Several Dose instances might share the same configuration file (e.g.
+``~/.dose.conf``), so each one writes only the options it had changed,
+merged with the current file contents while holding a lock (on POSIX),
+renaming a temporary file to avoid corrupting it on crashes.
+"""
+import atexit, contextlib, io, json, threading, time
+from .misc import atomic_write
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+WRITE_LAG = .2 # Seconds without changes before writing them
+WRITE_MAX_LAG = 1. # Seconds since the first pending change
+
+
+def load_json(fname):
+    """Dictionary from a JSON file, empty if missing or invalid."""
+    try:
+        with io.open(fname, "r", encoding="utf-8") as json_file:
+            data = json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+@contextlib.contextmanager
+def file_lock(fname):
+    """Exclusive lock on a ``fname + ".lock"`` file, if possible."""
+    if fcntl is None:
+        yield
+        return
+    with open(fname + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def merge_json(fname, changes):
+    """Update the JSON file dictionary with the given changes."""
+    with file_lock(fname):
+        data = load_json(fname)
+        data.update(changes)
+        atomic_write(fname, json.dumps(data, indent=4, sort_keys=True,
+                                       separators=(",", ": "))
+                                .encode("utf-8"))
+
+
+class ConfigWriter(object):
+    """
+    Single long-lived thread writing the changed options of JSON files
+    (see ``merge_json``), coalescing the changes until there's none
+    for ``lag`` seconds, or for at most ``max_lag`` seconds since the
+    first pending change (e.g. while dragging the window). The thread
+    starts on the first change, and the pending changes are written
+    at exit.
+    """
+    def __init__(self, lag=WRITE_LAG, max_lag=WRITE_MAX_LAG):
+        self.lag = lag
+        self.max_lag = max_lag
+        self._pending = {} # {file name: {key: value}}
+        self._first = self._last = None # Timestamps of the changes
+        self._changed = threading.Condition()
+        self._write_lock = threading.Lock() # Keeps the writing order
+        self._thread = None
+
+    def update(self, fname, changes):
+        """Schedule writing the changes to the file."""
+        with self._changed:
+            self._pending.setdefault(fname, {}).update(changes)
+            self._last = time.time()
+            if self._first is None:
+                self._first = self._last
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.flush)
+            self._changed.notify()
+
+    def flush(self):
+        """Write the pending changes right now."""
+        with self._write_lock:
+            with self._changed:
+                pending, self._pending = self._pending, {}
+                self._first = None
+            for fname, changes in pending.items():
+                merge_json(fname, changes)
+
+    def _wait(self):
+        """Wait until there are pending changes ready to be written."""
+        with self._changed:
+            while True:
+                if self._first is None:
+                    self._changed.wait()
+                    continue
+                remaining = min(self._last + self.lag,
+                                self._first + self.max_lag) - time.time()
+                if remaining <= 0:
+                    return
+                self._changed.wait(remaining)
+
+    def _run(self):
+        while True:
+            self._wait()
+            try:
+                self.flush()
+            except Exception:
+                import traceback
+                traceback.print_exc() # The writer should never stop
+
+
+config_writer = ConfigWriter() # Shared by every DoseConfig instance
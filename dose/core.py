@@ -0,0 +1,535 @@
+"""
+Dose GUI for TDD: single thread event loop core for the test jobs.
+
+A single ``Reactor`` thread spawns every test job, streams their
+output, waits for them to finish and runs the timers, while the GUI
+and the terminal just consume the job callbacks.
+"""
+import collections, contextlib, functools, heapq, itertools, os, signal, \
+       sys, threading, time, traceback
+from .proctree import REAP_TIMEOUT, group_members, signal_tree
+from .runner import (CHUNK_SIZE, PRE_SPAWN_DELAY, eintr_retry,
+                     pumped_streams, replay, report_orphans, selectors,
+                     spawn)
+from .usage import ResourceUsage, returncode, wait_usage
+
+# Durations in seconds
+EXIT_POLLING_DELAY = .05 # Without a pidfd nor a SIGCHLD wakeup (Windows)
+
+SIGCHLD = getattr(signal, "SIGCHLD", None) # Not on Windows
+
+
+def _ignore_signal(signum, frame):
+    """Signal handler just for writing the signal in the wakeup fd."""
+
+
+class Timer(object):
+    """Scheduled call handle returned by ``Reactor.call_later``."""
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Reactor(object):
+    """
+    Single thread event loop calling the registered callbacks when a
+    file descriptor is readable, or when a timer expires, based on a
+    selector (``select.select`` on Python 2.7 / 3.3). The ``call_soon``
+    and ``call_later`` methods are thread-safe, everything else should
+    be called in the reactor thread, i.e., from some callback.
+
+    On Windows, where pipes can't be selected, there are no readers,
+    and each stream from ``add_stream`` has a thread of its own.
+    """
+    def __init__(self):
+        self._readers = {} # {fd: callback}
+        self._signal_callbacks = {} # {signal number: list of callbacks}
+        self._saved_handlers = {} # {signal number: previous handler}
+        self._saved_wakeup_fd = None
+        self._timers = [] # Heap with (when, sequence number, timer)
+        self._counter = itertools.count()
+        self._calls = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+        if sys.platform == "win32":
+            self._wakeup_event = threading.Event()
+        else:
+            import fcntl
+            self._wakeup_r, self._wakeup_w = os.pipe()
+            for fd in [self._wakeup_r, self._wakeup_w]:
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._selector = None if selectors is None else \
+                             selectors.DefaultSelector()
+            self.add_reader(self._wakeup_r, self._drain_wakeup)
+
+    def start(self):
+        """Start the reactor thread (a daemon)."""
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def in_reactor_thread(self):
+        return threading.current_thread() is self._thread
+
+    def wakeup_on_signals(self, signums):
+        """
+        Wake the reactor up whenever the process gets one of the signals,
+        calling their ``add_signal_callback`` callbacks. The reactor
+        becomes the signal wakeup fd of the process, which requires the
+        main thread and Python 3.4+ (where the fd gets the signal number)
+        on POSIX. A signal whose handler isn't from Python (e.g. a C
+        library handler) is neglected. Returns whether every signal
+        wakes the reactor up. That changes the signal handlers and the
+        wakeup fd of the whole process, until ``restore_signals``.
+        """
+        main_thread = getattr(threading, "main_thread", None)
+        if sys.platform == "win32" or main_thread is None or \
+           threading.current_thread() is not main_thread():
+            return False
+        if sys.version_info >= (3, 7):
+            wakeup_fd = signal.set_wakeup_fd(self._wakeup_w,
+                                             warn_on_full_buffer=False)
+        else:
+            wakeup_fd = signal.set_wakeup_fd(self._wakeup_w)
+        if self._saved_wakeup_fd is None:
+            self._saved_wakeup_fd = wakeup_fd
+        result = True
+        for signum in signums:
+            handler = signal.getsignal(signum)
+            if handler is None: # Can't be restored
+                result = False
+                continue
+            self._saved_handlers.setdefault(signum, handler)
+            if handler in [signal.SIG_DFL, signal.SIG_IGN]:
+                signal.signal(signum, _ignore_signal)
+            signal.siginterrupt(signum, False) # Restart the system calls
+            self._signal_callbacks.setdefault(signum, [])
+        return result
+
+    def restore_signals(self):
+        """
+        Restore the signal handlers and the wakeup fd replaced by
+        ``wakeup_on_signals`` (from the main thread), so the signals
+        don't wake the reactor up anymore.
+        """
+        for signum, handler in self._saved_handlers.items():
+            signal.signal(signum, handler) # Also undoes the siginterrupt
+            self._signal_callbacks.pop(signum, None)
+        self._saved_handlers.clear()
+        if self._saved_wakeup_fd is not None:
+            signal.set_wakeup_fd(self._saved_wakeup_fd)
+            self._saved_wakeup_fd = None
+
+    def add_signal_callback(self, signum, callback):
+        """
+        Call ``callback()`` whenever the process gets the signal, returning
+        False when the signal doesn't wake the reactor up.
+        """
+        if signum not in self._signal_callbacks:
+            return False
+        self._signal_callbacks[signum].append(callback)
+        return True
+
+    def remove_signal_callback(self, signum, callback):
+        callbacks = self._signal_callbacks.get(signum, [])
+        if callback in callbacks: # Not restored meanwhile
+            callbacks.remove(callback)
+
+    def call_soon(self, func, *args):
+        """Call ``func(*args)`` in the reactor thread."""
+        with self._lock:
+            self._calls.append((func, args))
+        self._wakeup()
+
+    def call_later(self, delay, func, *args):
+        """Call ``func(*args)`` in the reactor thread after a delay."""
+        timer = Timer(time.time() + delay, func, args)
+        with self._lock:
+            heapq.heappush(self._timers, (timer.when, next(self._counter),
+                                          timer))
+        self._wakeup()
+        return timer
+
+    def add_reader(self, fd, callback):
+        """Call ``callback()`` whenever the fd is readable (POSIX only)."""
+        self._readers[fd] = callback
+        if self._selector is not None:
+            self._selector.register(fd, selectors.EVENT_READ)
+
+    def remove_reader(self, fd):
+        del self._readers[fd]
+        if self._selector is not None:
+            self._selector.unregister(fd)
+
+    def add_stream(self, fd, callback, size=CHUNK_SIZE):
+        """
+        Call ``callback(data)`` with each chunk read from the fd, up to
+        ``size`` bytes, including the final empty one (EOF).
+        """
+        if sys.platform == "win32":
+            def pump():
+                while True:
+                    data = eintr_retry(os.read, fd, size)
+                    self.call_soon(callback, data)
+                    if not data:
+                        break
+            thread = threading.Thread(target=pump)
+            thread.daemon = True
+            thread.start()
+            return
+
+        def read():
+            data = eintr_retry(os.read, fd, size)
+            if not data:
+                self.remove_reader(fd)
+            callback(data)
+
+        self.add_reader(fd, read)
+
+    def _wakeup(self):
+        if sys.platform == "win32":
+            self._wakeup_event.set()
+        elif not self.in_reactor_thread():
+            try:
+                os.write(self._wakeup_w, b"\0")
+            except OSError: # The pipe is full, it's already awake
+                pass
+
+    def _drain_wakeup(self):
+        """Read the wakeup fd, with the numbers of the received signals."""
+        data = bytearray()
+        try:
+            while True:
+                chunk = os.read(self._wakeup_r, CHUNK_SIZE)
+                if not chunk:
+                    break
+                data.extend(chunk)
+        except OSError: # EAGAIN, it's empty
+            pass
+        for signum in set(data).intersection(self._signal_callbacks):
+            for callback in list(self._signal_callbacks[signum]):
+                self._safe_call(callback)
+
+    def _wait(self, timeout):
+        """Wait for events, running the readers callbacks."""
+        if sys.platform == "win32":
+            self._wakeup_event.wait(timeout)
+            self._wakeup_event.clear()
+            return
+        if self._selector is None:
+            import select
+            fds = eintr_retry(select.select, list(self._readers), [], [],
+                              timeout)[0]
+        else:
+            fds = [key.fd for key, unused in self._selector.select(timeout)]
+        for fd in fds:
+            callback = self._readers.get(fd)
+            if callback is not None: # Not removed by a previous callback
+                self._safe_call(callback)
+
+    def _next_timeout(self):
+        with self._lock:
+            if self._calls:
+                return 0
+            if self._timers:
+                return max(0, self._timers[0][0] - time.time())
+        return None
+
+    def _run_pending(self):
+        now = time.time()
+        with self._lock:
+            calls = list(self._calls)
+            self._calls.clear()
+            while self._timers and self._timers[0][0] <= now:
+                timer = heapq.heappop(self._timers)[-1]
+                if not timer.cancelled:
+                    calls.append((timer.func, timer.args))
+        for func, args in calls:
+            self._safe_call(func, *args)
+
+    @staticmethod
+    def _safe_call(func, *args):
+        try:
+            func(*args)
+        except Exception:
+            traceback.print_exc() # The loop should never stop
+
+    def _run(self):
+        while True:
+            self._wait(self._next_timeout())
+            self._run_pending()
+
+
+_reactor = None
+_reactor_lock = threading.Lock()
+
+
+def get_reactor():
+    """The shared ``Reactor`` instance, started on the first call."""
+    global _reactor
+    with _reactor_lock:
+        if _reactor is None:
+            _reactor = Reactor()
+            _reactor.start()
+    return _reactor
+
+
+@contextlib.contextmanager
+def signal_wakeup(signums=() if SIGCHLD is None else (SIGCHLD,)):
+    """
+    Context manager (for the main thread) where the signals wake the
+    shared reactor up (see ``Reactor.wakeup_on_signals``), yielding it.
+    By default, the test job exits are waited with a SIGCHLD wakeup
+    when there's no pidfd. Leaving it restores the signal handlers and
+    the wakeup fd, including the ones changed by other calls to the
+    ``wakeup_on_signals`` method meanwhile.
+    """
+    reactor = get_reactor()
+    reactor.wakeup_on_signals(signums)
+    try:
+        yield reactor
+    finally:
+        reactor.restore_signals()
+
+
+class Job(object):
+    """
+    Test job handled by the ``Reactor``, without threads of its own.
+
+    It has the same constructor, callbacks and attributes of the
+    ``RunnerThreadCallback`` (``killed``, ``spawned``, ``processes``,
+    ``usage``, ``output``), but the ``test_command`` can be either a
+    string or a list of test commands to be run concurrently as shards,
+    whose result is the first non-zero return code, or zero. After
+    finishing, the ``durations`` attribute has the wall duration of
+    each shard.
+
+    When ``direct`` is True, the test commands are executed without a
+    shell when possible (see ``dose.runner.spawn``).
+
+    The callbacks are called in the reactor thread. The ``kill`` and
+    ``join`` methods block until the ``after`` (or ``exception``)
+    callback returns, so they shouldn't be called from a callback.
+    """
+    def __init__(self, test_command, work_dir=None,
+                 before=None, after=None, exception=None, capture=False,
+                 direct=False, reactor=None):
+        self.test_command = test_command
+        self.work_dir = work_dir
+        self.direct = direct
+        self.output = [] if capture else None
+        if before is not None:
+            self.before = before
+        if after is not None:
+            self.after = after
+        if exception is not None:
+            self.exception = exception
+        self.killed = False
+        self.usage = None
+        self.durations = None
+        self.reactor = get_reactor() if reactor is None else reactor
+        self._processes = []
+        self._started = False
+        self._done = threading.Event()
+        # Avoids spawning some subprocesses fated to be killed
+        self._timer = self.reactor.call_later(PRE_SPAWN_DELAY, self._start)
+
+    @property
+    def spawned(self):
+        return bool(self._processes)
+
+    @property
+    def processes(self):
+        return list(self._processes)
+
+    def is_alive(self):
+        return not self._done.is_set()
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+    def kill(self, sig=signal.SIGTERM):
+        """
+        Terminate the test job, killing the process groups if they were
+        spawned, aborting the spawning otherwise, then join.
+        """
+        if self.is_alive():
+            self.killed = True
+            self.reactor.call_soon(self._kill, sig)
+        self.join()
+
+    def _kill(self, sig):
+        if self._done.is_set():
+            return
+        if not self._started:
+            self._timer.cancel()
+            self._finish(None)
+            return
+        for process in self._processes:
+            if process.returncode is None:
+                signal_tree(process, sig)
+
+    def _start(self):
+        self._started = True
+        try:
+            self.before()
+            commands = self.test_command
+            if not isinstance(commands, list):
+                commands = [commands]
+            self._start_time = time.time()
+            for idx, command in enumerate(commands):
+                process = spawn(command, self.work_dir, self.direct)
+                self._processes.append(process)
+                self._watch(process, line_prefix=None if len(commands) == 1
+                  else "[{0}/{1}] ".format(idx + 1, len(commands)))
+        except Exception:
+            for process in self._processes:
+                signal_tree(process, signal.SIGKILL)
+            self._fail()
+
+    def _watch(self, process, line_prefix):
+        process.usage = process.eof_time = None
+        process.orphans = []
+        process.streams = pumped_streams(process, line_prefix=line_prefix,
+                                         capture=self.output)
+        for stream in process.streams:
+            self.reactor.add_stream(stream.fd, functools.partial(
+              self._on_data, process, stream,
+            ))
+        self._watch_exit(process)
+
+    def _watch_exit(self, process):
+        """
+        Call ``_poll_exit`` when the process might have finished, i.e.,
+        when its pidfd (Python 3.9+ on Linux 5.3+) gets readable, else on
+        every SIGCHLD, polling only when neither is available.
+        """
+        process.poll_exit = functools.partial(self._poll_exit, process)
+        process.pidfd = None
+        process.exit_polling = False
+        try:
+            process.pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError): # Unavailable
+            if not self.reactor.add_signal_callback(SIGCHLD,
+                                                    process.poll_exit):
+                process.exit_polling = True
+                self.reactor.call_later(EXIT_POLLING_DELAY,
+                                        process.poll_exit)
+        else:
+            self.reactor.add_reader(process.pidfd, process.poll_exit)
+
+    def _unwatch_exit(self, process):
+        if process.pidfd is not None:
+            self.reactor.remove_reader(process.pidfd)
+            os.close(process.pidfd)
+        elif not process.exit_polling:
+            self.reactor.remove_signal_callback(SIGCHLD, process.poll_exit)
+
+    def _on_data(self, process, stream, data):
+        if not stream.feed(data): # EOF
+            self._check_finished(process)
+
+    def _poll_exit(self, process):
+        if process.returncode is not None: # A late SIGCHLD callback
+            return
+        if sys.platform == "win32":
+            if process.poll() is None:
+                self.reactor.call_later(EXIT_POLLING_DELAY,
+                                        process.poll_exit)
+                return
+            process.usage = ResourceUsage()
+        else:
+            status_usage = wait_usage(process.pid, block=False)
+            if status_usage is None: # Still running
+                if process.exit_polling:
+                    self.reactor.call_later(EXIT_POLLING_DELAY,
+                                            process.poll_exit)
+                return
+            status, process.usage = status_usage
+            process.returncode = returncode(status)
+            self._unwatch_exit(process)
+            self._reap_orphans(process)
+        self._check_finished(process)
+
+    def _reap_orphans(self, process):
+        """Terminate what's left in the process group (see proctree)."""
+        process.orphans = group_members(process.pid)
+        if process.orphans:
+            signal_tree(process, signal.SIGTERM)
+            self.reactor.call_later(REAP_TIMEOUT, self._kill_orphans, process)
+
+    def _kill_orphans(self, process):
+        if group_members(process.pid):
+            signal_tree(process, signal.SIGKILL)
+
+    def _check_finished(self, process):
+        if process.returncode is None or process.eof_time is not None or \
+           any(stream.eof_time is None for stream in process.streams):
+            return
+        process.eof_time = max(stream.eof_time for stream in process.streams)
+        for stream in [process.stdout, process.stderr]:
+            stream.close()
+        if not self.killed: # Otherwise they might be still finishing
+            report_orphans(process.orphans)
+        if all(proc.eof_time is not None for proc in self._processes):
+            self._complete()
+
+    def _complete(self):
+        if self._done.is_set(): # Failed while spawning the shards
+            return
+        self.durations = [process.eof_time - self._start_time
+                          for process in self._processes]
+        self.usage = ResourceUsage.combine(process.usage
+                                           for process in self._processes)
+        self.usage.wall = time.time() - self._start_time
+        self._finish(next((process.returncode
+                           for process in self._processes
+                           if process.returncode != 0), 0))
+
+    def _finish(self, result):
+        try:
+            self.after(result)
+        except Exception:
+            self._fail()
+        finally:
+            self._done.set()
+
+    def _fail(self):
+        try:
+            self.exception(*sys.exc_info())
+        except Exception:
+            Job.exception(*sys.exc_info())
+        finally:
+            self._done.set()
+
+    # Default callbacks
+    before = staticmethod(lambda: None)
+    after = staticmethod(lambda result: None)
+    exception = staticmethod(traceback.print_exception)
+
+
+class CachedJob(Job):
+    """
+    Same to ``Job``, but nothing is spawned, the cached result ``entry``
+    (from ``RunCache.get``) is replayed instead, and there's no resource
+    ``usage``.
+    """
+    def __init__(self, entry, *args, **kwargs):
+        self.entry = entry # Required before the reactor starts it
+        super(CachedJob, self).__init__(*args, **kwargs)
+
+    def _start(self):
+        self._started = True
+        try:
+            self.before()
+            replay(self.entry["output"])
+        except Exception:
+            self._fail()
+        else:
+            self._finish(self.entry["returncode"])
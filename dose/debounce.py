@@ -0,0 +1,67 @@
+"""Dose GUI for TDD: file system event burst coalescing."""
+import threading, time
+from .core import get_reactor
+
+
+class Debouncer(object):
+    """
+    Coalesce bursts of items (e.g. file system events) added from any
+    thread, calling ``callback(items)`` once the burst settles, i.e.,
+    after ``quiet`` seconds without new items, or ``max_wait`` seconds
+    after the first item of the burst, whatever comes first. The
+    callback is called from the ``reactor`` thread (the shared one by
+    default, see ``dose.core``), or right away by ``add`` when ``quiet``
+    isn't positive (no debouncing).
+
+    There's a single pending reactor timer for each burst, whose
+    deadline is moved by every new item instead of restarting it.
+    """
+    def __init__(self, callback, quiet=.1, max_wait=1., reactor=None):
+        self.callback = callback
+        self.quiet = quiet
+        self.max_wait = max_wait
+        self.reactor = get_reactor() if reactor is None else reactor
+        self._items = []
+        self._first = self._deadline = None
+        self._timer = None
+        self._generation = 0 # Avoids stale timer calls after a cancel
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        if self.quiet <= 0:
+            self.callback([item])
+            return
+        with self._lock:
+            now = time.time()
+            if not self._items:
+                self._first = now
+            self._items.append(item)
+            self._deadline = min(now + self.quiet,
+                                 self._first + self.max_wait)
+            if self._timer is None:
+                self._start_timer(self._deadline - now)
+
+    def cancel(self):
+        """Neglect the pending items."""
+        with self._lock:
+            self._items = []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+                self._generation += 1
+
+    def _start_timer(self, delay):
+        self._timer = self.reactor.call_later(delay, self._expire,
+                                              self._generation)
+
+    def _expire(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            remaining = self._deadline - time.time()
+            if remaining > 0: # Moved by some item added meanwhile
+                self._start_timer(remaining)
+                return
+            items, self._items = self._items, []
+            self._timer = None
+        self.callback(items)
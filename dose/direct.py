@@ -0,0 +1,72 @@
+"""Dose GUI for TDD: shell-less (direct exec) test command parsing."""
+import os, re, shlex, sys, threading
+
+# Anything the shell would expand or interpret, quoted or not
+SHELL_SYNTAX_REGEX = re.compile(r"[|&;<>()$`\\*?[\]{}~#!\n]")
+ASSIGNMENT_REGEX = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=") # E.g. "X=1 cmd"
+
+
+def which(name, path=None):
+    """
+    Full path of the executable file with the given name in the
+    ``PATH`` (or in the given path string), or None when it's missing.
+    """
+    if path is None:
+        path = os.environ.get("PATH", os.defpath)
+    for directory in path.split(os.pathsep):
+        fname = os.path.join(directory, name)
+        if os.path.isfile(fname) and os.access(fname, os.X_OK):
+            return fname
+    return None
+
+
+class ExecutableCache(object):
+    """
+    Memoized ``which``, keyed by the executable name and the ``PATH``,
+    so the lookup isn't repeated for every test job. A cached path is
+    found again only when it's not an executable file anymore.
+    """
+    def __init__(self):
+        self._paths = {} # {(name, PATH): full path}
+        self._lock = threading.Lock()
+
+    def resolve(self, name):
+        key = name, os.environ.get("PATH", os.defpath)
+        with self._lock:
+            fname = self._paths.get(key)
+        if fname is None or not os.access(fname, os.X_OK):
+            fname = which(name, key[1])
+            with self._lock:
+                if fname is None:
+                    self._paths.pop(key, None)
+                else:
+                    self._paths[key] = fname
+        return fname
+
+
+executable_cache = ExecutableCache()
+
+
+def direct_argv(test_command, cache=executable_cache):
+    """
+    Arguments to run the test command directly, without a shell, where
+    the first one is the executable full path (unless it's a relative
+    path like ``./run_tests``). Returns None when the shell is required:
+    the command has some shell syntax (pipes, redirects, ``&&``, globs,
+    variables, etc.), it begins with a variable assignment, it's not in
+    the ``PATH`` (e.g. it's a shell builtin), or it's Windows.
+    """
+    if sys.platform == "win32" or SHELL_SYNTAX_REGEX.search(test_command):
+        return None
+    try:
+        argv = shlex.split(test_command)
+    except ValueError: # E.g. unbalanced quotes
+        return None
+    if not argv or ASSIGNMENT_REGEX.match(argv[0]):
+        return None
+    if os.path.dirname(argv[0]):
+        return argv
+    executable = cache.resolve(argv[0])
+    if executable is None:
+        return None
+    return [executable] + argv[1:]
@@ -0,0 +1,249 @@
+"""Dose GUI for TDD: warm fork server test job runner backend."""
+import functools, os, re, shlex, socket, subprocess, sys, threading, time
+from . import zygote
+from .core import Job
+from .proctree import signal_tree
+from .usage import ResourceUsage
+
+PYTHON_EXECUTABLE_REGEX = re.compile(r"^python[\d.]*(\.exe)?$")
+
+
+def parse_python_command(test_command):
+    """
+    Get the interpreter arguments from a test command like
+    ``python -m pytest -x`` or ``python3 script.py arg``, i.e.,
+    ``["-m", "pytest", "-x"]`` or ``["script.py", "arg"]``, as that's
+    what the zygote can run. Returns None for other commands,
+    including those with interpreter options or shell syntax.
+    """
+    try:
+        tokens = shlex.split(test_command)
+    except ValueError: # E.g. unbalanced quotes
+        return None
+    if len(tokens) < 2 or not (
+        tokens[0] == sys.executable or
+        PYTHON_EXECUTABLE_REGEX.match(os.path.basename(tokens[0]))
+    ):
+        return None
+    argv = tokens[1:]
+    if argv[0] == "-m":
+        if len(argv) < 2:
+            return None
+    elif argv[0].startswith("-"):
+        return None
+    if any(re.search(r"[|&;<>()$`\\]", token) for token in tokens):
+        return None # Shell syntax, possibly quoted by shlex
+    return argv
+
+
+class ForkedProcess(object):
+    """
+    Job forked by the zygote, quacking like a ``subprocess.Popen``
+    instance regarding what the ``dose.core.Job`` uses. Its ``pid`` is
+    None until the zygote tells it, and it's ``finished`` when it exits,
+    before being reaped, which is when its ``returncode`` gets known.
+    """
+    def __init__(self, stdout, stderr):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.pid = None
+        self.finished = False
+        self.returncode = None
+        self.usage = None
+
+    def poll(self):
+        return self.returncode
+
+
+class ForkServer(object):
+    """
+    Warm "zygote" process that imports the ``preload`` modules once,
+    forking a fresh child from it for each test job. It's restarted
+    by ``spawn`` when the source file of some module it had imported
+    changes (or when some of the preloading imports had failed), or
+    when it's dead.
+
+    The zygote serves a single test job at a time, the next request
+    is read only after the previous job is reaped. The shards (see
+    ``dose.core.Job``) never use it. Nothing here blocks waiting for
+    the zygote, its messages in the ``sock`` are handled by the
+    ``ForkServerJob``.
+
+    Requires a POSIX system where ``socket.sendmsg`` is available
+    (Python 3.3+), as the job pipes are sent to the zygote.
+    """
+    def __init__(self, preload, work_dir=None):
+        self.preload = list(preload)
+        self.work_dir = work_dir
+        self._lock = threading.Lock()
+        self._process = None
+
+    @staticmethod
+    def is_supported():
+        return hasattr(socket, "AF_UNIX") and hasattr(socket.socket,
+                                                      "sendmsg")
+
+    def start(self):
+        """
+        Spawn the zygote, without waiting for it to finish preloading,
+        which it tells in its first message (see ``preloaded``).
+        """
+        sock, zygote_sock = socket.socketpair(socket.AF_UNIX,
+                                              socket.SOCK_STREAM)
+        fd = zygote_sock.fileno()
+        try:
+            self._process = subprocess.Popen(
+                [sys.executable, "-m", "dose.zygote", str(fd)] + self.preload,
+                cwd=self.work_dir,
+                pass_fds=[fd],
+            )
+        finally:
+            zygote_sock.close()
+        self.sock = sock
+        self._mtimes = None
+
+    def preloaded(self, message):
+        """Store the preloading result from the first zygote message."""
+        self._success = message["success"]
+        self._mtimes = {fname: self._mtime(fname)
+                        for fname in message["files"]}
+
+    @property
+    def ready(self):
+        """Whether the zygote had finished preloading."""
+        return self._mtimes is not None
+
+    def abort(self):
+        """Terminate the zygote, e.g. to avoid waiting for preloading."""
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+
+    def stop(self):
+        """Stop the zygote (it quits when the socket gets closed)."""
+        if self._process is not None:
+            self.sock.close()
+            self._process.wait()
+            self._process = None
+
+    @staticmethod
+    def _mtime(fname):
+        try:
+            return os.stat(fname).st_mtime
+        except OSError:
+            return None
+
+    @property
+    def stale(self):
+        """Whether the zygote should be restarted before forking."""
+        return self._process is None or self._process.poll() is not None \
+               or self.ready and (not self._success or any(
+            self._mtime(fname) != mtime for fname, mtime
+                                        in self._mtimes.items()
+        ))
+
+    def spawn(self, argv, work_dir=None):
+        """
+        Request a child from the zygote to run ``python ARGV`` in the
+        given working directory, returning a ``ForkedProcess``.
+        """
+        with self._lock:
+            if self.stale:
+                self.stop()
+                self.start()
+            out_read, out_write = os.pipe()
+            err_read, err_write = os.pipe()
+            try:
+                zygote.send_message(self.sock, {
+                    "argv": argv,
+                    "cwd": os.path.abspath(work_dir or self.work_dir
+                                                    or os.curdir),
+                    "env": dict(os.environ),
+                }, fds=[out_write, err_write])
+            finally:
+                os.close(out_write)
+                os.close(err_write)
+            return ForkedProcess(stdout=os.fdopen(out_read, "rb", 0),
+                                 stderr=os.fdopen(err_read, "rb", 0))
+
+
+class ForkServerJob(Job):
+    """
+    Same to ``dose.core.Job``, but the test job is forked from the
+    given ``ForkServer`` (the ``server`` parameter) instead of being
+    called in a shell, and its exit is known from the zygote messages.
+    The test command should be a single string parseable by
+    ``parse_python_command``.
+    """
+    def __init__(self, server, *args, **kwargs):
+        self.server = server # Required before the reactor starts it
+        self._pending_signal = None
+        super(ForkServerJob, self).__init__(*args, **kwargs)
+
+    def _start(self):
+        self._started = True
+        try:
+            self.before()
+            self._start_time = time.time()
+            process = self.server.spawn(
+                parse_python_command(self.test_command), self.work_dir,
+            )
+            self._processes.append(process)
+            self._watch(process, line_prefix=None)
+        except Exception:
+            self._fail()
+
+    def _watch_exit(self, process):
+        process.poll_exit = functools.partial(self._on_message, process)
+        process.sock_fd = self.server.sock.fileno()
+        self.reactor.add_reader(process.sock_fd, process.poll_exit)
+
+    def _unwatch_exit(self, process):
+        self.reactor.remove_reader(process.sock_fd)
+
+    def _on_message(self, process):
+        """Handle a message from the zygote about the process."""
+        try:
+            message = zygote.recv_message(self.server.sock)[0]
+        except (EOFError, OSError): # The zygote died
+            self._unwatch_exit(process)
+            self._abort(process)
+            return
+        if "files" in message:
+            self.server.preloaded(message)
+        elif "pid" in message: # Forked
+            process.pid = message["pid"]
+            if self._pending_signal is not None:
+                signal_tree(process, self._pending_signal)
+        elif "finished" in message: # Exited, but its pgid is still taken
+            process.finished = True
+            self._reap_orphans(process)
+            zygote.send_message(self.server.sock, {"reap": True})
+        else: # Reaped
+            process.returncode = message["returncode"]
+            process.usage = ResourceUsage(**message["usage"])
+            self._unwatch_exit(process)
+            self._check_finished(process)
+
+    def _abort(self, process):
+        """Stop handling the process streams, as the zygote died."""
+        for stream in process.streams:
+            if stream.eof_time is None:
+                self.reactor.remove_reader(stream.fd)
+        for stream in [process.stdout, process.stderr]:
+            stream.close()
+        if self.killed:
+            self._finish(None)
+        else:
+            self._fail()
+
+    def _kill(self, sig):
+        if self._done.is_set() or not self._processes:
+            super(ForkServerJob, self)._kill(sig)
+            return
+        process = self._processes[0]
+        if process.pid is None: # Not forked yet
+            self._pending_signal = sig
+            if not self.server.ready: # Don't wait for the preloading
+                self.server.abort()
+        elif not process.finished: # Otherwise its pgid might be reused
+            signal_tree(process, sig)
@@ -0,0 +1,102 @@
+"""
+Dose GUI for TDD: headless (terminal-only) mode.
+
+The watchers run with an event loop in the main thread instead of the
+wxPython one, showing their state with the terminal colors and,
+optionally, in the terminal title. Neither wxPython nor docutils get
+imported, which makes this mode usable in containers and through SSH,
+with a faster startup and a smaller memory footprint.
+"""
+from __future__ import print_function, unicode_literals
+import os, sys
+from . import terminal
+from .watching import DoseWatcher
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+LOOP_TIMEOUT = .2 # Seconds, for handling KeyboardInterrupt on Python 2
+TITLE_LEDS = {
+    "red": "\U0001F534",
+    "yellow": "\U0001F7E1",
+    "green": "\U0001F7E2",
+    "partial": "\U0001F7E1\U0001F7E2",
+}
+TITLE_TEMPLATE = "\033]0;{0}\007" # Operating System Command (OSC) 0
+
+
+def set_title(title, stream=None):
+    """Set the terminal title, falling back to ASCII."""
+    stream = sys.stdout if stream is None else stream
+    if not stream.isatty(): # No title, and colorama would strip it badly
+        return
+    try:
+        stream.write(TITLE_TEMPLATE.format(title))
+    except UnicodeEncodeError:
+        stream.write(TITLE_TEMPLATE.format(
+            title.encode("ascii", "ignore").decode("ascii").strip()
+        ))
+    stream.flush()
+
+
+class MainLoop(object):
+    """
+    Event loop for the calls from other threads (e.g. the watcher and
+    the runner threads), replacing the GUI event loop.
+    """
+    def __init__(self):
+        self._calls = queue.Queue()
+
+    def call_after(self, func, *args):
+        """Call the function from the main loop, later."""
+        self._calls.put((func, args))
+
+    def run(self, running):
+        """Run the calls while ``running()``, or until a Ctrl+C."""
+        try:
+            while running():
+                try:
+                    func, args = self._calls.get(timeout=LOOP_TIMEOUT)
+                except queue.Empty:
+                    continue
+                func(*args)
+        except KeyboardInterrupt:
+            print()
+
+
+class HeadlessWatcher(DoseWatcher):
+    """
+    Watcher whose state is shown in the terminal, where ``loop`` is
+    the shared ``MainLoop`` instance. With ``title_led``, the state is
+    also shown in the terminal title as a colored circle (emoji).
+    """
+    def __init__(self, loop, title_led=False):
+        DoseWatcher.__init__(self, loop.call_after)
+        self.loop = loop
+        self.title_led = title_led
+
+    def _show_state(self, state, log=None):
+        name = self.name or os.path.basename(os.path.abspath(self.directory))
+        if log is not None:
+            log("[Dose] {0} - {1}".format(state.capitalize(), name))
+        if self.title_led:
+            set_title("{0} Dose - {1}".format(TITLE_LEDS[state], name))
+
+    def on_red(self):
+        self._show_state("red", terminal.clog.red)
+
+    def on_yellow(self):
+        self._show_state("yellow") # The test job header is enough
+
+    def on_green(self):
+        self._show_state("green", terminal.clog.green)
+
+    def on_partial(self):
+        self._show_state("partial", terminal.clog.green)
+
+    def stop(self):
+        DoseWatcher.stop(self)
+        if self.title_led:
+            set_title("Dose")
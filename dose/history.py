@@ -0,0 +1,226 @@
+"""Dose GUI for TDD: persistent test job run history."""
+from __future__ import division
+import os, sqlite3, threading, time
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+HISTORY_FILE_NAME = ".dose_history.sqlite3"
+BASELINE_SIZE = 20 # Number of previous passing runs in the baseline
+MIN_BASELINE_SIZE = 5
+REGRESSION_THRESHOLD = 3. # Number of (scaled) MADs above the median
+MIN_RELATIVE_SPREAD = .05 # Spread lower bound, relative to the median
+MAD_SCALE = 1.4826 # Makes the MAD comparable to a standard deviation
+
+USAGE_COLUMNS = ["wall", "user", "system", "max_rss",
+                 "read_bytes", "write_bytes"]
+COLUMNS = ["timestamp", "directory", "command", "path",
+           "returncode"] + USAGE_COLUMNS
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+  id INTEGER PRIMARY KEY,
+  timestamp REAL NOT NULL,
+  directory TEXT NOT NULL,
+  command TEXT NOT NULL,
+  path TEXT,
+  returncode INTEGER NOT NULL,
+  wall REAL,
+  user REAL,
+  system REAL,
+  max_rss INTEGER,
+  read_bytes INTEGER,
+  write_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_command ON runs (command, directory, id);
+"""
+
+
+def default_history_file():
+    return os.path.join(os.path.expanduser("~"), HISTORY_FILE_NAME)
+
+
+def connect(fname):
+    connection = sqlite3.connect(fname)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def median(values):
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) / 2
+
+
+def percentile(values, fraction):
+    """Linearly interpolated percentile, ``fraction`` in [0; 1]."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def regression(duration, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Median and spread (scaled median absolute deviation) of the
+    baseline durations when the given duration is a regression, i.e.,
+    when it's more than ``threshold`` spreads above the median, or
+    None otherwise (including when the baseline is too small).
+    """
+    if len(baseline) < MIN_BASELINE_SIZE:
+        return None
+    center = median(baseline)
+    mad = median([abs(value - center) for value in baseline])
+    spread = max(MAD_SCALE * mad, MIN_RELATIVE_SPREAD * center)
+    if duration > center + threshold * spread:
+        return center, spread
+    return None
+
+
+class RunHistory(object):
+    """
+    SQLite run history with one row for each finished test job. The
+    rows are written by a single worker thread (as ``record`` is called
+    by the GUI thread), which also compares the wall duration of each
+    passing run with the previous passing runs of the same command,
+    calling ``on_regression(run, median, spread)`` when it's slower.
+    A database error (e.g. a locked database or a full disk) drops the
+    run, calling ``on_error(exc)``, and the next run opens it again.
+    Both callbacks are called by the worker thread, as well as the
+    ``load_durations`` one.
+    """
+    def __init__(self, fname=None, on_regression=lambda *args: None,
+                                   on_error=lambda exc: None):
+        self.fname = default_history_file() if fname is None else fname
+        self.on_regression = on_regression
+        self.on_error = on_error
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, **run):
+        """Enqueue a run (the ``COLUMNS`` keys) to be stored."""
+        run.setdefault("timestamp", time.time())
+        self._queue.put(run)
+
+    def load_durations(self, directory, callback, limit=BASELINE_SIZE):
+        """
+        Enqueue a query for the wall durations of the last ``limit``
+        passing runs of each test command in the directory, calling
+        ``callback({command: durations})`` with them (oldest first).
+        """
+        self._queue.put((directory, callback, limit))
+
+    def close(self):
+        """Store everything that was enqueued and stop the worker."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _worker(self):
+        connection = None
+        try:
+            for run in iter(self._queue.get, None):
+                try:
+                    if connection is None:
+                        connection = connect(self.fname)
+                    if isinstance(run, tuple): # From load_durations
+                        self._load(connection, *run)
+                        continue
+                    self._check(connection, run)
+                    self._store(connection, run)
+                except sqlite3.Error as exc:
+                    self.on_error(exc)
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _store(self, connection, run):
+        with connection: # Commits
+            connection.execute(
+                "INSERT INTO runs ({0}) VALUES ({1})".format(
+                    ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))
+                ),
+                [run.get(column) for column in COLUMNS],
+            )
+
+    def _load(self, connection, directory, callback, limit):
+        durations = {}
+        for command, wall in connection.execute(
+            "SELECT command, wall FROM runs WHERE directory = ? AND "
+            "returncode = 0 AND wall IS NOT NULL ORDER BY id DESC",
+            [directory],
+        ):
+            command_durations = durations.setdefault(command, [])
+            if len(command_durations) < limit:
+                command_durations.insert(0, wall)
+        callback(durations)
+
+    def _check(self, connection, run):
+        if run["returncode"] != 0 or run.get("wall") is None:
+            return
+        baseline = [row[0] for row in connection.execute(
+            "SELECT wall FROM runs WHERE command = ? AND directory = ? AND "
+            "returncode = 0 AND wall IS NOT NULL ORDER BY id DESC LIMIT ?",
+            [run["command"], run["directory"], BASELINE_SIZE],
+        )]
+        result = regression(run["wall"], baseline)
+        if result is not None:
+            self.on_regression(run, *result)
+
+
+def trend(durations, windows=5):
+    """Median durations of up to ``windows`` consecutive chunks."""
+    size = max(1, -(-len(durations) // windows)) # Ceil division
+    return [median(durations[idx:idx + size])
+            for idx in range(0, len(durations), size)]
+
+
+def report(fname=None, limit=100):
+    """
+    Text report with the duration percentiles and trend for the last
+    ``limit`` runs of each test command in the history.
+    """
+    fname = default_history_file() if fname is None else fname
+    if not os.path.exists(fname):
+        return "No history in {0}".format(fname)
+    connection = connect(fname)
+    try:
+        groups = connection.execute(
+            "SELECT directory, command, COUNT(*), MAX(timestamp) FROM runs "
+            "GROUP BY directory, command ORDER BY MAX(timestamp) DESC"
+        ).fetchall()
+        lines = []
+        for directory, command, count, last in groups:
+            rows = connection.execute(
+                "SELECT returncode, wall FROM runs WHERE directory = ? AND "
+                "command = ? ORDER BY id DESC LIMIT ?",
+                [directory, command, limit],
+            ).fetchall()[::-1]
+            durations = [wall for returncode, wall in rows
+                              if returncode == 0 and wall is not None]
+            lines.append("{0} $ {1}".format(directory, command))
+            lines.append("  {0} run(s), {1} passing in the last {2}, "
+                         "last at {3}".format(
+                count, len(durations), len(rows),
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(last)),
+            ))
+            if durations:
+                lines.append("  duration p50 {0:.2f}s, p90 {1:.2f}s, "
+                             "p99 {2:.2f}s, max {3:.2f}s".format(
+                    percentile(durations, .5), percentile(durations, .9),
+                    percentile(durations, .99), max(durations),
+                ))
+                lines.append("  trend " + " -> ".join(
+                    "{0:.2f}s".format(value) for value in trend(durations)
+                ))
+        return "\n".join(lines) if lines else "Empty history"
+    finally:
+        connection.close()
@@ -0,0 +1,234 @@
+"""Dose GUI for TDD: compiled file name skip patterns and git ignores."""
+import os, re
+
+GITIGNORE_FILE_NAME = ".gitignore"
+GIT_EXCLUDE_PATH = os.path.join(".git", "info", "exclude")
+DIRECTORY_CACHE_SIZE = 4096 # Number of directories ignore status to keep
+MAX_REGEX_GROUPS = 99 # Python < 3.5 can't compile more than 100 groups
+FILENAME_PATTERN_TO_IGNORE = "; ".join(["*.pyc",
+                                        "*.pyo",
+                                        ".git/*",
+                                        "__pycache__/*",
+                                        "*__pycache__/*",
+                                        "__pycache__",
+                                        ".*",
+                                        "*~",
+                                        "qt_temp.*", # Kate
+                                       ])
+
+
+def _char_class(pattern, idx):
+    """
+    Pair with the regular expression source of the ``[...]`` character
+    class starting at ``pattern[idx - 1]`` and the index after it.
+    """
+    end = idx
+    if pattern[end:end + 1] == "!":
+        end += 1
+    if pattern[end:end + 1] == "]":
+        end += 1
+    end = pattern.find("]", end)
+    if end < 0: # Not a character class
+        return "\\[", idx
+    chars = pattern[idx:end].replace("\\", "\\\\")
+    if chars.startswith("!"):
+        chars = "^" + chars[1:]
+    elif chars.startswith("^"):
+        chars = "\\" + chars
+    return "[" + chars + "]", end + 1
+
+
+def glob_regex(pattern, git=False):
+    """
+    Regular expression source for a glob pattern, without anchors nor
+    capturing groups. The default follows ``fnmatch``, where ``*`` and
+    ``?`` match any character, including ``/``. With ``git``, the
+    wildcards match just within a path segment (consecutive asterisks
+    are like a single one) and the backslash escapes the next character.
+    """
+    result = []
+    idx, size = 0, len(pattern)
+    while idx < size:
+        char = pattern[idx]
+        idx += 1
+        if char == "*":
+            while git and pattern[idx:idx + 1] == "*":
+                idx += 1
+            result.append("[^/]*" if git else ".*")
+        elif char == "?":
+            result.append("[^/]" if git else ".")
+        elif char == "\\" and git and idx < size:
+            result.append(re.escape(pattern[idx]))
+            idx += 1
+        elif char == "[":
+            source, idx = _char_class(pattern, idx)
+            result.append(source)
+        else:
+            result.append(re.escape(char))
+    return "".join(result)
+
+
+class PatternMatcher(object):
+    """
+    The ``fnmatch`` patterns separated by ``;`` of the dose skip pattern
+    compiled as a single regular expression, so a path is checked with
+    a single call instead of a Python loop over the patterns. Like
+    ``fnmatch``, the comparison is case insensitive on Windows.
+    """
+    def __init__(self, skip_pattern):
+        self.skip_pattern = skip_pattern
+        self._regex = re.compile("|".join(
+            "(?:{0})\\Z".format(glob_regex(os.path.normcase(pattern.strip())))
+            for pattern in skip_pattern.split(";")
+        ), re.DOTALL)
+
+    def __call__(self, path):
+        return self._regex.match(os.path.normcase(path)) is not None
+
+
+def gitignore_rule(base, line):
+    """
+    Pair with a regular expression source for a ``.gitignore`` line
+    whose directory is ``base`` (a relative path with ``/``, or empty)
+    and a (negated, dir_only) pair, or None for blank/comment lines.
+    """
+    line = line.rstrip("\r\n")
+    pattern = line.rstrip(" ")
+    if pattern.endswith("\\") and len(pattern) < len(line): # Escaped
+        pattern += " "
+    if not pattern or pattern.startswith("#"):
+        return None
+    negated = pattern.startswith("!")
+    if negated:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    anchored = "/" in pattern
+    segments = pattern.lstrip("/").split("/")
+    parts = [re.escape(base + "/") if base else ""]
+    if not anchored:
+        parts.append("(?:.*/)?")
+    for idx, segment in enumerate(segments):
+        last = idx == len(segments) - 1
+        if segment == "**":
+            parts.append(".+" if last else "(?:.*/)?")
+        else:
+            parts.append(glob_regex(segment, git=True) + ("" if last else "/"))
+    return "".join(parts), (negated, dir_only)
+
+
+def regex_chunks(rules):
+    """
+    List of ``(regex, negated)`` pairs for the given ``gitignore_rule``
+    results, in order, each regex matching up to ``MAX_REGEX_GROUPS``
+    rules as alternatives with a capturing group for each, so the
+    ``lastindex`` of the match is the first matching rule, whose
+    ``negated`` value is in the list (the second item of the pair).
+    """
+    return [(re.compile("|".join("({0})\\Z".format(source)
+                                 for source, unused in chunk), re.DOTALL),
+             [negated for unused, (negated, dir_only) in chunk])
+            for chunk in (rules[idx:idx + MAX_REGEX_GROUPS]
+                          for idx in range(0, len(rules), MAX_REGEX_GROUPS))]
+
+
+class GitIgnore(object):
+    """
+    Ignore rules from the ``.gitignore`` files in a directory tree and
+    from its ``.git/info/exclude``, with the git precedence: the last
+    matching rule wins, the rules in deeper ``.gitignore`` files win
+    over the ones in their parent directories, which win over the
+    exclude file, and nothing inside an ignored directory can be
+    re-included (negated). The rules are compiled as a few regular
+    expressions (see ``regex_chunks``) whose alternatives are in the
+    reverse precedence order, so the first match is the winning rule.
+
+    Paths are relative to the ``directory``, like in the watchdog
+    events. The ``.gitignore`` files inside ignored directories are
+    neglected, as git does. Call ``load`` again to reload the rules.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.load()
+
+    def load(self):
+        rules = self._read("", GIT_EXCLUDE_PATH) # Lowest precedence first
+        self._compile(rules)
+        for root, dirs, files in os.walk(self.directory):
+            rel_root = os.path.relpath(root, self.directory)
+            rel_root = "" if rel_root == os.curdir else rel_root
+            if GITIGNORE_FILE_NAME in files:
+                new_rules = self._read(
+                    rel_root.replace(os.sep, "/"),
+                    os.path.join(rel_root, GITIGNORE_FILE_NAME),
+                )
+                rules.extend(new_rules)
+                self._compile(new_rules, extend=True) # Just the new ones
+            dirs[:] = [name for name in dirs if name != ".git" and
+                       not self(os.path.join(rel_root, name), is_dir=True)]
+        self._compile(rules) # Fewer regexes than a chunk for each file
+
+    def _read(self, base, fname):
+        try:
+            with open(os.path.join(self.directory, fname), "rb") as ifile:
+                lines = ifile.read().decode("utf-8", "replace").splitlines()
+        except (IOError, OSError): # Missing
+            return []
+        rules = (gitignore_rule(base, line) for line in lines)
+        return [rule for rule in rules if rule is not None]
+
+    def _compile(self, rules, extend=False):
+        """
+        Compile the rules (the lowest precedence first), replacing the
+        current ones or, with ``extend``, adding them with the highest
+        precedence, without compiling the current ones again.
+        """
+        rules = rules[::-1] # Highest precedence first
+        file_chunks = regex_chunks([rule for rule in rules
+                                    if not rule[1][1]])
+        dir_chunks = regex_chunks(rules)
+        if extend and self._state is not None:
+            file_chunks.extend(self._state[0])
+            dir_chunks.extend(self._state[1])
+        # Replaced at once, as it's used by the watchdog thread
+        self._state = None if not dir_chunks else (
+            file_chunks,
+            dir_chunks, # Every rule applies to directories
+            {}, # Cache, {directory path: whether it's ignored}
+        )
+
+    @staticmethod
+    def _match(state, path, is_dir):
+        for regex, negated in state[1] if is_dir else state[0]:
+            match = regex.match(path)
+            if match is not None:
+                return not negated[match.lastindex - 1]
+        return False
+
+    def _is_dir_ignored(self, state, path):
+        dirs = state[-1]
+        result = dirs.get(path)
+        if result is None:
+            if len(dirs) >= DIRECTORY_CACHE_SIZE:
+                dirs.clear()
+            result = dirs[path] = self._match(state, path, is_dir=True)
+        return result
+
+    def __call__(self, path, is_dir=False):
+        """Whether git ignores the path."""
+        state = self._state
+        if state is None:
+            return False
+        parts = path.replace(os.sep, "/").split("/")
+        for idx in range(1, len(parts)):
+            if self._is_dir_ignored(state, "/".join(parts[:idx])):
+                return True
+        return self._match(state, "/".join(parts), is_dir)
+
+
+def is_ignore_file(path):
+    """Whether the path is a file with git ignore rules."""
+    return os.path.basename(path) == GITIGNORE_FILE_NAME or \
+           os.path.normpath(path) == GIT_EXCLUDE_PATH
@@ -0,0 +1,196 @@
+"""Dose GUI for TDD: static import graph for affected test selection."""
+import ast, os, threading
+from collections import defaultdict
+from fnmatch import fnmatch
+from .compat import quote
+
+TEST_FILE_PATTERNS = ["test_*.py", "*_test.py"]
+TESTS_PLACEHOLDER = "{tests}"
+
+
+def is_test_file(path):
+    """Whether the given path looks like a test module file name."""
+    fname = os.path.basename(path)
+    return any(fnmatch(fname, pattern) for pattern in TEST_FILE_PATTERNS)
+
+
+def imported_names(source, package=None):
+    """
+    Set of absolute module names that might be imported by the given
+    Python source code (bytes), including the parent packages and the
+    ``from ... import name`` possible submodules. The ``package`` is
+    needed for resolving the relative imports.
+    """
+    result = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                if package is None:
+                    continue
+                parts = package.split(".")
+                if node.level > len(parts): # Beyond the top-level package
+                    continue
+                parts = parts[:len(parts) - node.level + 1]
+                base = ".".join([part for part in parts + [base] if part])
+            names = [base] if base else []
+            names.extend(".".join([base, alias.name]).lstrip(".")
+                         for alias in node.names if alias.name != "*")
+        else:
+            continue
+        for name in names:
+            parts = name.split(".")
+            result.update(".".join(parts[:idx + 1])
+                          for idx in range(len(parts)))
+    return result
+
+
+class ImportGraph(object):
+    """
+    Static import graph of the Python files in a directory, for finding
+    the test modules that transitively import some changed file.
+
+    Paths are relative to the ``directory``, and the ``skip`` function
+    tells which paths (files and directories) shouldn't be parsed. A
+    file might be known by several module names, one for each of its
+    ancestor directories from the outermost package up to the root,
+    e.g. ``src/pkg/mod.py`` is both ``pkg.mod`` and ``src.pkg.mod``
+    when there's a ``src/pkg/__init__.py``.
+
+    The ``scan`` method walks the whole directory, it can be called in
+    another thread, and there are no affected tests until it finishes.
+    The graph should be kept updated by calling ``update`` for each
+    changed path, which can be done at any time from any thread, as the
+    changed files are parsed only when required by some query.
+    """
+    def __init__(self, directory, skip=lambda path: False):
+        self.directory = directory
+        self.skip = skip
+        self._imports = {} # {path: set of imported module names}
+        self._importers = None # {module name: set of paths}, built lazily
+        self._pending = set() # Changed paths, parsed on the next query
+        self._lock = threading.Lock()
+        self._scanned = threading.Event()
+
+    @property
+    def scanned(self):
+        """Whether the scan had finished, i.e., the graph can be queried."""
+        return self._scanned.is_set()
+
+    def scan(self):
+        """Parse every Python file in the directory."""
+        for root, dirs, files in os.walk(self.directory):
+            rel_root = os.path.relpath(root, self.directory)
+            if rel_root == os.curdir:
+                rel_root = ""
+            dirs[:] = [name for name in dirs
+                       if not self.skip(os.path.join(rel_root, name))]
+            for name in files:
+                path = os.path.join(rel_root, name)
+                if name.endswith(".py") and not self.skip(path):
+                    self._parse(path)
+        self._scanned.set()
+
+    def _module_names(self, path):
+        """Module names of the file in the given relative path."""
+        parts = os.path.splitext(path)[0].split(os.sep)
+        if parts[-1] == "__init__":
+            parts.pop()
+        top = len(parts) - 1 # Index of the outermost package/module
+        while top > 0 and os.path.exists(os.path.join(
+            self.directory, os.sep.join(parts[:top]), "__init__.py"
+        )):
+            top -= 1
+        return [".".join(parts[idx:]) for idx in range(top + 1)]
+
+    def _parse(self, path):
+        names = self._module_names(path)
+        is_package = os.path.basename(path) == "__init__.py"
+        package = names[0] if is_package else names[0].rpartition(".")[0]
+        try:
+            with open(os.path.join(self.directory, path), "rb") as pyfile:
+                imports = imported_names(pyfile.read(), package or None)
+        except (IOError, OSError): # Removed/unreadable file
+            return self._remove(path)
+        except (SyntaxError, ValueError): # Keep what it had imported
+            imports = self._imports.get(path, set())
+        self._imports[path] = imports
+        self._importers = None
+
+    def _remove(self, path):
+        if self._imports.pop(path, None) is not None:
+            self._importers = None
+
+    def update(self, *paths):
+        """
+        Queue the given paths (e.g. both paths of a moved file) to be
+        parsed again (or removed) before the next query. This never
+        blocks, even while scanning.
+        """
+        with self._lock:
+            self._pending.update(paths)
+
+    def _parse_pending(self):
+        with self._lock:
+            paths, self._pending = self._pending, set()
+        for path in paths:
+            if not path.endswith(".py") or self.skip(path):
+                continue
+            if os.path.isfile(os.path.join(self.directory, path)):
+                self._parse(path)
+            else:
+                self._remove(path)
+
+    def dependents(self, path):
+        """
+        Set of paths that import the given one directly. The path
+        doesn't need to exist, e.g. it might have just been removed.
+        It should be called only after the scan had finished.
+        """
+        self._parse_pending()
+        if self._importers is None:
+            self._importers = defaultdict(set)
+            for importer, names in self._imports.items():
+                for name in names:
+                    self._importers[name].add(importer)
+        return set().union(*[self._importers.get(name, ())
+                             for name in self._module_names(path)])
+
+    def affected_tests(self, paths):
+        """
+        Sorted list of test modules that transitively import any of
+        the given paths (including the paths that are test modules).
+        Returns None when some path isn't a Python file, as then there's
+        no way to know which tests are affected, and while the directory
+        is still being scanned.
+        """
+        if not self.scanned or \
+           not all(path.endswith(".py") for path in paths):
+            return None
+        visited = set(paths)
+        pending = list(paths)
+        while pending:
+            for importer in self.dependents(pending.pop()):
+                if importer not in visited:
+                    visited.add(importer)
+                    pending.append(importer)
+        return sorted(path for path in visited if is_test_file(path))
+
+
+def selected_tests_command(test_command, tests):
+    """
+    Test command that runs only the given test files. They replace
+    the ``{tests}`` placeholder in the test command if there's one,
+    else they're appended to it.
+    """
+    args = " ".join(map(quote, tests))
+    if TESTS_PLACEHOLDER in test_command:
+        return test_command.replace(TESTS_PLACEHOLDER, args)
+    return " ".join([test_command, args])
+
+
+def full_tests_command(test_command):
+    """Test command without the ``{tests}`` placeholder."""
+    return test_command.replace(TESTS_PLACEHOLDER, "")
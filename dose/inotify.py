@@ -0,0 +1,330 @@
+"""
+Dose GUI for TDD: Linux inotify watcher pruning the skipped directories.
+
+Unlike the recursive watchdog observer, the skipped directories (e.g.
+``.git``, ``node_modules``, virtualenvs and build trees) never get an
+inotify watch, saving the ``max_user_watches`` kernel limit, memory
+and startup time. Watches are added/removed as directories are
+created, moved or deleted.
+"""
+import ctypes, ctypes.util, errno, os, select, struct, sys, threading, \
+       traceback
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW |
+              IN_EXCL_UNLINK)
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+BUFFER_SIZE = 64 * 1024
+
+_libc = []
+_libc_lock = threading.Lock()
+
+
+def get_libc():
+    """The C library with the inotify functions, or None."""
+    with _libc_lock:
+        if not _libc:
+            _libc.append(None)
+            if sys.platform.startswith("linux"):
+                try:
+                    libc = ctypes.CDLL(ctypes.util.find_library("c") or
+                                       "libc.so.6", use_errno=True)
+                    libc.inotify_add_watch.argtypes = [
+                        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32,
+                    ]
+                    libc.inotify_init1
+                    libc.inotify_rm_watch
+                except (OSError, AttributeError): # Unavailable
+                    pass
+                else:
+                    _libc[0] = libc
+    return _libc[0]
+
+
+def is_supported():
+    return get_libc() is not None
+
+
+def _encode(path):
+    if isinstance(path, bytes):
+        return path
+    if hasattr(os, "fsencode"): # Python 3
+        return os.fsencode(path)
+    return path.encode(sys.getfilesystemencoding())
+
+
+def _decode(path):
+    if hasattr(os, "fsdecode"): # Python 3
+        return os.fsdecode(path)
+    return path.decode(sys.getfilesystemencoding(), "replace")
+
+
+def _raise_errno(path):
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code), path)
+
+
+def list_directory(path):
+    """Pair with the subdirectories and the other entries names."""
+    dirs, others = [], []
+    if hasattr(os, "scandir"): # Python 3.5+, no stat calls on Linux
+        for entry in os.scandir(path):
+            is_dir = entry.is_dir(follow_symlinks=False)
+            (dirs if is_dir else others).append(entry.name)
+    else:
+        for name in os.listdir(path):
+            child = os.path.join(path, name)
+            is_dir = os.path.isdir(child) and not os.path.islink(child)
+            (dirs if is_dir else others).append(name)
+    return dirs, others
+
+
+class FileSystemEvent(object):
+    """Event given to the handlers, like the watchdog ones."""
+    def __init__(self, event_type, src_path, is_directory, dest_path=""):
+        self.event_type = event_type
+        self.src_path = src_path
+        self.is_directory = is_directory
+        self.dest_path = dest_path
+
+
+class Watch(object):
+    """
+    Watched directory tree, where ``skip_dir(path)`` tells whether a
+    directory path relative to the watched one should be pruned.
+    """
+    def __init__(self, handler, path, skip_dir):
+        self.handler = handler
+        self.path = os.path.abspath(path)
+        self.root = _encode(self.path)
+        self.skip_dir = skip_dir
+
+    def skipped(self, path):
+        return self.skip_dir(os.path.relpath(_decode(path), self.path))
+
+
+class InotifyObserver(object):
+    """
+    Single thread observer for several watched trees (see ``Watch``),
+    with the ``schedule``, ``unschedule``, ``start``, ``stop`` and
+    ``join`` methods of the watchdog observers. The events of each
+    tree are sent to the ``on_any_event`` method of its handler, from
+    the observer thread.
+    """
+    def __init__(self):
+        self._libc = get_libc()
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self._fd < 0:
+            _raise_errno(None)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._dirs = {} # {wd: {watch: directory path}}
+        self._wds = {} # {(watch, directory path): wd}
+        self._moves = {} # {(cookie, watch): (path, is_dir)}, moved from
+        self._lock = threading.RLock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def schedule(self, handler, path, skip_dir=lambda path: False):
+        """Start watching the tree, returning the watch to unschedule."""
+        watch = Watch(handler, path, skip_dir)
+        with self._lock:
+            self._add_tree(watch, watch.root)
+        return watch
+
+    def unschedule(self, watch):
+        with self._lock:
+            self._remove_tree(watch, watch.root)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        os.write(self._wakeup_w, b"\0")
+
+    def join(self):
+        self._thread.join()
+        for fd in [self._fd, self._wakeup_r, self._wakeup_w]:
+            os.close(fd)
+
+    def _add_watch(self, watch, path):
+        """Watch a single directory, returning False if it's missing."""
+        wd = self._libc.inotify_add_watch(self._fd, path, WATCH_MASK)
+        if wd < 0:
+            if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            _raise_errno(_decode(path))
+        previous = self._dirs.setdefault(wd, {}).get(watch)
+        if previous is not None: # Same directory, but moved
+            self._wds.pop((watch, previous), None)
+        self._dirs[wd][watch] = path
+        self._wds[watch, path] = wd
+        return True
+
+    def _add_tree(self, watch, top, emit=None):
+        """
+        Watch the top directory and its subdirectories, but the skipped
+        ones. Each directory is watched before being listed, so nothing
+        created meanwhile is missed. With an ``emit`` event type, there's
+        an event for everything found, e.g. "created" as the tree is new.
+        """
+        pending = [top]
+        while pending:
+            path = pending.pop()
+            if not self._add_watch(watch, path):
+                continue
+            try:
+                dirs, others = list_directory(path)
+            except OSError: # Removed meanwhile
+                continue
+            dirs = [os.path.join(path, name) for name in dirs]
+            pending.extend(child for child in dirs
+                                 if not watch.skipped(child))
+            if emit:
+                for child in dirs:
+                    self._dispatch(watch, emit, child, True)
+                for name in others:
+                    self._dispatch(watch, emit,
+                                   os.path.join(path, name), False)
+
+    def _remove_tree(self, watch, top):
+        prefix = os.path.join(top, b"")
+        for (item_watch, path), wd in list(self._wds.items()):
+            if item_watch is watch and (path == top or
+                                        path.startswith(prefix)):
+                del self._wds[watch, path]
+                dirs = self._dirs.get(wd, {})
+                dirs.pop(watch, None)
+                if not dirs:
+                    self._dirs.pop(wd, None)
+                    self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _forget(self, wd):
+        """Neglect a watch removed by the kernel (e.g. deleted)."""
+        for watch, path in self._dirs.pop(wd, {}).items():
+            self._wds.pop((watch, path), None)
+
+    def _dispatch(self, watch, event_type, path, is_dir, dest=None):
+        watch.handler.on_any_event(FileSystemEvent(
+            event_type, _decode(path), is_dir,
+            "" if dest is None else _decode(dest),
+        ))
+
+    def _created(self, watch, path, is_dir):
+        if is_dir and not watch.skipped(path):
+            self._add_tree(watch, path, emit="created")
+        self._dispatch(watch, "created", path, is_dir)
+
+    def _deleted(self, watch, path, is_dir):
+        if is_dir: # Moved out, its watches would still be active
+            self._remove_tree(watch, path)
+        self._dispatch(watch, "deleted", path, is_dir)
+
+    def _moved(self, watch, src, dest, is_dir):
+        if is_dir:
+            self._remove_tree(watch, src)
+            if not watch.skipped(dest):
+                self._add_tree(watch, dest)
+        self._dispatch(watch, "moved", src, is_dir, dest)
+
+    def _overflow(self):
+        """
+        Some events were lost by the kernel, so everything in the
+        watched trees is dirty: the trees are watched again (nothing
+        happens to the directories already watched) with a "modified"
+        event for every entry found.
+        """
+        for watch in set(watch for watch, path in self._wds):
+            self._add_tree(watch, watch.root, emit="modified")
+
+    def _handle(self, wd, mask, cookie, name):
+        if mask & IN_IGNORED:
+            self._forget(wd)
+            return
+        is_dir = bool(mask & IN_ISDIR)
+        for watch, directory in list(self._dirs.get(wd, {}).items()):
+            path = os.path.join(directory, name)
+            if mask & IN_MOVED_FROM:
+                self._moves[cookie, watch] = path, is_dir
+            elif mask & IN_MOVED_TO:
+                src = self._moves.pop((cookie, watch), None)
+                if src is None: # Moved from outside the tree
+                    self._created(watch, path, is_dir)
+                else:
+                    self._moved(watch, src[0], path, is_dir)
+            elif mask & IN_CREATE:
+                self._created(watch, path, is_dir)
+            elif mask & IN_DELETE:
+                self._dispatch(watch, "deleted", path, is_dir)
+            elif mask & (IN_MODIFY | IN_ATTRIB):
+                self._dispatch(watch, "modified", path, is_dir)
+
+    def _process(self, data, more=False):
+        """
+        Handle the events read, where ``more`` tells whether there are
+        more events already waiting to be read, as a moved from event
+        might be the last one of the data whose moved to event is
+        still unread.
+        """
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, size = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + size].rstrip(b"\0")
+            offset += size
+            if mask & IN_Q_OVERFLOW: # With wd = -1
+                self._safe_call(self._overflow)
+            else:
+                self._safe_call(self._handle, wd, mask, cookie, name)
+        if more:
+            return
+        # The moved to event comes right after its moved from event
+        moves, self._moves = self._moves, {}
+        for (cookie, watch), (path, is_dir) in moves.items():
+            self._safe_call(self._deleted, watch, path, is_dir)
+
+    @staticmethod
+    def _safe_call(func, *args):
+        try:
+            func(*args)
+        except Exception:
+            traceback.print_exc() # The observer should never stop
+
+    def _read(self):
+        try:
+            return os.read(self._fd, BUFFER_SIZE)
+        except OSError as exc:
+            if exc.errno in (errno.EAGAIN, errno.EINTR):
+                return b""
+            raise
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                ready = select.select([self._fd, self._wakeup_r], [], [])[0]
+            except (OSError, select.error) as exc: # Python 2 select.error
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            if self._fd in ready:
+                data = self._read()
+                more = self._fd in select.select([self._fd], [], [], 0)[0]
+                with self._lock:
+                    self._process(data, more)
@@ -0,0 +1,172 @@
+"""
+Dose GUI for TDD: watcher pipeline metrics.
+
+Each event is timestamped at every stage it goes through, from the
+observer callback to the test job spawning, and the time spent in each
+stage is added to a histogram, together with the events counts by the
+selector decision (accepted or the rejection reason) and the event
+rates. The stages are:
+
+- selector: from the observer callback to the selector decision;
+- debounce: from the selector decision to the end of the event burst;
+- queue: from the end of the burst to the GUI thread handler;
+- spawn: from the GUI thread handler to the test job spawning, which
+  includes the ``PRE_SPAWN_DELAY`` and waiting for the previous test
+  job to finish (with the "finish" and "grace" scheduling policies).
+
+There's also the "reaction" histogram, with the time from the last
+event of the burst that triggered a test job to its spawning.
+"""
+from __future__ import division
+import os, signal, threading, time
+from collections import Counter, OrderedDict
+
+STAGES = ["selector", "debounce", "queue", "spawn", "reaction"]
+BUCKETS = [1e-4 * 2 ** idx for idx in range(20)] # Upper bounds, seconds
+PERCENTILES = [.5, .9, .99]
+
+
+def format_seconds(value):
+    if value < 1:
+        return "{0:.1f}ms".format(value * 1e3)
+    return "{0:.2f}s".format(value)
+
+
+class Histogram(object):
+    """
+    Latency histogram with geometric buckets (see ``BUCKETS``), whose
+    percentiles are the upper bounds of the buckets.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # The last one is unbounded
+        self.count = 0
+        self.total = 0.
+        self.maximum = 0.
+
+    def add(self, value):
+        idx = 0
+        while idx < len(BUCKETS) and value > BUCKETS[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, fraction):
+        """Upper bound of the percentile, ``fraction`` in [0; 1]."""
+        rank = fraction * self.count
+        accumulated = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            accumulated += count
+            if accumulated >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def __str__(self):
+        if not self.count:
+            return "no samples"
+        return ", ".join(
+            ["{0} samples".format(self.count),
+             "mean {0}".format(format_seconds(self.total / self.count))] +
+            ["p{0:g} {1}".format(fraction * 100,
+                                 format_seconds(self.percentile(fraction)))
+             for fraction in PERCENTILES] +
+            ["max {0}".format(format_seconds(self.maximum))]
+        )
+
+
+class PipelineMetrics(object):
+    """
+    Thread-safe metrics of the watcher pipeline. The events get a
+    ``stamps`` dictionary with the timestamp of each stage.
+    """
+    def __init__(self):
+        self.histograms = OrderedDict((stage, Histogram())
+                                      for stage in STAGES)
+        self.decisions = Counter() # {"accepted" or reason: count}
+        self.start = time.time()
+        self.peak_rate = 0 # Events in a single second
+        self._second, self._second_count = None, 0
+        self._lock = threading.Lock()
+
+    def observe(self, evt):
+        """Timestamp an event from the observer callback."""
+        now = time.time()
+        evt.stamps = {"observed": now}
+        with self._lock:
+            second = int(now)
+            if second != self._second:
+                self._second, self._second_count = second, 0
+            self._second_count += 1
+            self.peak_rate = max(self.peak_rate, self._second_count)
+
+    def decide(self, evt, reason):
+        """Selector decision, the reason is None for accepted events."""
+        with self._lock:
+            self.decisions[reason or "accepted"] += 1
+        self.stamp([evt], "selector")
+
+    def reject(self, evts, reason):
+        """Accepted events rejected afterwards, e.g. without changes."""
+        with self._lock:
+            self.decisions["accepted"] -= len(evts)
+            self.decisions[reason] += len(evts)
+
+    def stamp(self, evts, stage):
+        """Add the time each event spent in the stage ending now."""
+        now = time.time()
+        observed = []
+        with self._lock:
+            for evt in evts:
+                stamps = getattr(evt, "stamps", None)
+                if stamps is None: # Observed before the metrics
+                    continue
+                observed.append(stamps["observed"])
+                self.histograms[stage].add(now - max(stamps.values()))
+                stamps[stage] = now
+            if stage == "spawn" and observed:
+                self.histograms["reaction"].add(now - max(observed))
+
+    def report(self):
+        """List of lines describing the metrics."""
+        with self._lock:
+            elapsed = time.time() - self.start
+            total = sum(self.decisions.values())
+            lines = ["Events: {0} in {1:.0f}s ({2:.2f}/s, peak {3}/s)"
+                     .format(total, elapsed, total / max(elapsed, 1e-9),
+                             self.peak_rate)]
+            lines.extend("  {0}: {1} ({2:.1%})".format(reason, count,
+                                                      count / total)
+                         for reason, count in self.decisions.most_common())
+            lines.append("Latencies:")
+            lines.extend("  {0}: {1}".format(stage, histogram)
+                         for stage, histogram in self.histograms.items())
+        return lines
+
+
+def on_dump_signal(callback):
+    """
+    Call the callback on SIGUSR1, returning False when that's not
+    possible (e.g. on Windows). The signal wakes the shared reactor
+    up, whose thread calls the callback, as the Python signal handlers
+    only run when the main thread runs some Python code, which might
+    never happen while a GUI event loop is idle. Without that wakeup
+    (i.e. Python 2), the callback is called by the signal handler.
+    """
+    signum = getattr(signal, "SIGUSR1", None) # There's no SIGUSR1 in Windows
+    if signum is None:
+        return False
+    from .core import get_reactor
+    reactor = get_reactor()
+    if reactor.wakeup_on_signals([signum]) and \
+       reactor.add_signal_callback(signum, callback):
+        return True
+    try:
+        signal.signal(signum, lambda signum, frame: callback())
+    except ValueError: # Not in the main thread
+        return False
+    return True
+
+
+def dump_hint():
+    return "kill -USR1 {0}".format(os.getpid())
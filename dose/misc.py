@@ -1,5 +1,6 @@
 """Dose GUI for TDD: miscellaneous functions."""
-import inspect, string, itertools, functools, io
+import inspect, string, itertools, functools, io, os, sys, tempfile, \
+       collections
 
 # Be careful: this file is imported by setup.py!
 
@@ -111,6 +112,32 @@ def kw_map(**kws):
     return decorator
 
 
+def lru_cache(maxsize):
+    """
+    Decorator to cache the results of a function with hashable
+    positional arguments, keeping up to ``maxsize`` results (the least
+    recently used is discarded). The ``cache`` attribute of the
+    resulting function is the ``OrderedDict`` with the results.
+    Unlike ``functools.lru_cache``, this is not thread-safe.
+    """
+    def decorator(func):
+        cache = collections.OrderedDict()
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            try:
+                result = cache.pop(args)
+            except KeyError:
+                result = func(*args)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[args] = result # The most recently used is the last
+            return result
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
 def read_plain_text(fname, encoding="utf-8"):
     """Reads a file as a list of strings."""
     with io.open(fname, encoding=encoding) as f:
@@ -122,3 +149,25 @@ def read_plain_text(fname, encoding="utf-8"):
             result[-1] += "\n"
         return [line[:-1] for line in result]
     return []
+
+
+def atomic_write(fname, data):
+    """
+    Write the given bytes to a file by renaming a temporary file, so
+    that the file never gets partially written.
+    """
+    fd, temp_fname = tempfile.mkstemp(dir=os.path.dirname(fname) or ".",
+                                      prefix=".tmp", suffix="~")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        if hasattr(os, "replace"): # Python 3.3+
+            os.replace(temp_fname, fname)
+        else:
+            if sys.platform == "win32" and os.path.exists(fname):
+                os.remove(fname) # Not atomic
+            os.rename(temp_fname, fname)
+    except:
+        if os.path.exists(temp_fname):
+            os.remove(temp_fname)
+        raise
@@ -0,0 +1,254 @@
+"""
+Dose GUI for TDD: stat polling watcher, for file systems without events.
+
+Bind mounts in containers and network file systems might never deliver
+inotify events. This watcher compares listings of the watched trees
+instead, pruning the skipped directories, and it keeps its CPU usage
+bounded by scanning the whole tree only as often as a CPU share allows,
+while the directories with recent changes are polled every interval.
+"""
+from __future__ import division
+import collections, os, threading, time, traceback
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+POLL_INTERVAL = 1. # Seconds
+POLL_WORKERS = 4 # Threads listing directories in parallel
+CPU_SHARE = .02 # Of a single core, for the whole tree scans
+HOT_SIZE = 64 # Number of recently changed directories polled every time
+DIRECTORY = (True, None, None) # Key of every subdirectory entry
+
+
+def _cpu_time():
+    """CPU time of this process (every thread), in seconds."""
+    return sum(os.times()[:2])
+
+
+def list_directory(path):
+    """
+    Dictionary with the ``(is_dir, mtime, size)`` key of each entry
+    name in the directory (``DIRECTORY`` for the subdirectories).
+    """
+    entries = {}
+    if hasattr(os, "scandir"): # Python 3.5+, no stat for subdirectories
+        for entry in os.scandir(path):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    entries[entry.name] = DIRECTORY
+                else:
+                    stat = entry.stat(follow_symlinks=False)
+                    entries[entry.name] = (False, stat.st_mtime_ns,
+                                           stat.st_size)
+            except OSError: # Removed meanwhile
+                pass
+        return entries
+    import stat as stat_module
+    for name in os.listdir(path):
+        try:
+            stat = os.lstat(os.path.join(path, name))
+        except OSError: # Removed meanwhile
+            continue
+        entries[name] = DIRECTORY if stat_module.S_ISDIR(stat.st_mode) \
+                        else (False, stat.st_mtime, stat.st_size)
+    return entries
+
+
+class FileSystemEvent(object):
+    """Event given to the handlers, like the watchdog ones."""
+    def __init__(self, event_type, src_path, is_directory):
+        self.event_type = event_type
+        self.src_path = src_path
+        self.is_directory = is_directory
+
+
+class PolledTree(object):
+    """
+    Watched directory tree, where ``skip_dir(path)`` tells whether a
+    directory path relative to the watched one should be pruned, and
+    ``report(stats)`` is called after every whole tree scan.
+    """
+    def __init__(self, handler, path, skip_dir, report):
+        self.handler = handler
+        self.path = os.path.abspath(path)
+        self.skip_dir = skip_dir
+        self.report = report
+        self.listing = None # {relative directory: entries}
+        self.hot = collections.OrderedDict() # Recently changed directories
+        self.next_scan = 0 # Timestamp
+
+
+class PollingObserver(object):
+    """
+    Single thread observer polling several watched trees (see
+    ``PolledTree``), with the ``schedule``, ``unschedule``, ``start``,
+    ``stop`` and ``join`` methods of the watchdog observers.
+
+    The whole tree is scanned with a pool of ``workers`` threads
+    listing directories in parallel (which helps on network file
+    systems), and its next scan is delayed so that these scans use no
+    more than ``cpu_share`` of a core, but at least ``interval`` seconds
+    apart. Meanwhile, the directories with the most recent changes are
+    polled every ``interval`` seconds. That means a change elsewhere
+    might take ``(1 / cpu_share - 1)`` times the scan CPU time to be
+    seen, e.g. 49 times with the default 2% (the "delay" stats).
+    """
+    def __init__(self, interval=POLL_INTERVAL, workers=POLL_WORKERS,
+                 cpu_share=CPU_SHARE):
+        self.interval = interval
+        self.workers = workers
+        self.cpu_share = cpu_share
+        self._trees = []
+        self._tasks = queue.Queue() # Directories to list, for the pool
+        self._pool = [] # Worker threads, started with the first scan
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock() # A single scan at a time
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event() # For new trees and stopping
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def schedule(self, handler, path, skip_dir=lambda path: False,
+                 report=lambda stats: None):
+        """
+        Start polling the tree, returning it to unschedule. Its first
+        listing, the one compared with the next scans, happens right
+        away in the observer thread (not in the caller thread), while
+        the other trees keep their own scan schedule. The changes made
+        before that first listing finishes aren't seen.
+        """
+        tree = PolledTree(handler, path, skip_dir, report)
+        with self._lock:
+            self._trees.append(tree)
+        self._wakeup.set()
+        return tree
+
+    def unschedule(self, tree):
+        with self._lock:
+            self._trees.remove(tree)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def join(self):
+        self._thread.join()
+        for thread in self._pool:
+            self._tasks.put(None)
+        for thread in self._pool:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                trees = list(self._trees)
+            for tree in trees:
+                try:
+                    self._poll(tree)
+                except Exception:
+                    traceback.print_exc() # The observer should never stop
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+
+    def _poll(self, tree):
+        if time.time() >= tree.next_scan: # Including the first listing
+            self._scan(tree)
+            return
+        for rel_dir in list(tree.hot):
+            try:
+                entries = list_directory(os.path.join(tree.path, rel_dir))
+            except OSError: # Removed, the next scan should tell
+                del tree.hot[rel_dir]
+                continue
+            old_entries = tree.listing.get(rel_dir)
+            if old_entries is not None and entries != old_entries:
+                self._dispatch_changes(tree, rel_dir, old_entries, entries)
+                tree.listing[rel_dir] = entries
+
+    def _scan(self, tree):
+        cpu_start, wall_start = _cpu_time(), time.time()
+        listing = self._list_tree(tree)
+        if tree.listing is not None:
+            for rel_dir in set(tree.listing).union(listing):
+                old_entries = tree.listing.get(rel_dir, {})
+                entries = listing.get(rel_dir, {})
+                if entries != old_entries:
+                    self._dispatch_changes(tree, rel_dir,
+                                           old_entries, entries)
+        tree.listing = listing
+        cpu = _cpu_time() - cpu_start
+        delay = max(self.interval, cpu / self.cpu_share - cpu)
+        tree.next_scan = time.time() + delay
+        tree.report({
+            "files": sum(1 for entries in listing.values()
+                           for key in entries.values() if key != DIRECTORY),
+            "directories": len(listing),
+            "wall": time.time() - wall_start,
+            "cpu": cpu,
+            "delay": delay,
+        })
+
+    def _list_tree(self, tree):
+        """Listing with the entries of each non-skipped directory."""
+        listing = {}
+        with self._scan_lock:
+            while len(self._pool) < self.workers:
+                thread = threading.Thread(target=self._worker,
+                                          args=(self._tasks,))
+                thread.daemon = True
+                thread.start()
+                self._pool.append(thread)
+            self._tasks.put((tree, listing, ""))
+            self._tasks.join()
+        return listing
+
+    @staticmethod
+    def _worker(tasks):
+        """
+        Pool thread listing the directories from the tasks queue, adding
+        their non-skipped subdirectories to the same queue.
+        """
+        for tree, listing, rel_dir in iter(tasks.get, None):
+            try:
+                entries = list_directory(os.path.join(tree.path, rel_dir))
+                listing[rel_dir] = entries
+                for name, key in entries.items():
+                    child = os.path.join(rel_dir, name)
+                    if key == DIRECTORY and not tree.skip_dir(child):
+                        tasks.put((tree, listing, child))
+            except OSError: # Removed meanwhile
+                pass
+            except Exception:
+                traceback.print_exc()
+            finally:
+                tasks.task_done()
+
+    def _dispatch_changes(self, tree, rel_dir, old_entries, entries):
+        tree.hot.pop(rel_dir, None)
+        tree.hot[rel_dir] = True # The most recent one is the last
+        while len(tree.hot) > HOT_SIZE:
+            tree.hot.popitem(last=False)
+        changes = [("deleted", name, key) for name, key in old_entries.items()
+                   if name not in entries]
+        for name, key in entries.items():
+            old_key = old_entries.get(name)
+            if old_key is None:
+                changes.append(("created", name, key))
+            elif old_key != key:
+                if (old_key == DIRECTORY) != (key == DIRECTORY):
+                    changes.append(("deleted", name, old_key))
+                    changes.append(("created", name, key))
+                else:
+                    changes.append(("modified", name, key))
+        for event_type, name, key in changes:
+            tree.handler.on_any_event(FileSystemEvent(
+                event_type, os.path.join(tree.path, rel_dir, name),
+                key == DIRECTORY,
+            ))
@@ -0,0 +1,165 @@
+"""Dose GUI for TDD: test job process tree (process group) handling."""
+import errno, os, select, signal, subprocess, sys, time
+
+# Durations in seconds
+REAP_TIMEOUT = 1. # Time for the group to finish before a SIGKILL
+
+
+def new_group_kwargs():
+    """
+    Keyword arguments for ``subprocess.Popen`` to start the process as
+    the leader of a new session (a new process group on Windows), so
+    that its whole process tree can be signaled at once.
+    """
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    if sys.version_info >= (3, 2):
+        return {"start_new_session": True}
+    return {"preexec_fn": os.setsid}
+
+
+def signal_tree(process, sig=signal.SIGTERM):
+    """
+    Send the signal to every process in the group led by the given
+    process. On Windows, the process tree is always killed by
+    ``taskkill``, as long as the process is still running.
+    """
+    if sys.platform == "win32":
+        if process.poll() is None:
+            with open(os.devnull, "wb") as devnull:
+                subprocess.call(["taskkill", "/F", "/T",
+                                 "/PID", str(process.pid)],
+                                stdout=devnull, stderr=devnull)
+        return
+    try:
+        os.killpg(process.pid, sig)
+    except OSError as exc:
+        if exc.errno not in [errno.ESRCH, errno.EPERM]: # EPERM happens on
+            raise                                       # OSX for zombies
+
+
+def _proc_group_members(pgid):
+    result = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", name, "stat"), "rb") as stat_file:
+                stat = stat_file.read().decode("utf-8", "replace")
+        except (IOError, OSError): # It has just finished
+            continue
+        comm, fields = stat[stat.index("(") + 1:].rsplit(")", 1)
+        state, unused, pgrp = fields.split()[:3]
+        if int(pgrp) == pgid and state != "Z":
+            result.append((int(name), comm))
+    return result
+
+
+def _ps_group_members(pgid):
+    try:
+        output = subprocess.check_output(["ps", "-A", "-o",
+                                          "pid=,pgid=,stat=,comm="])
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    result = []
+    for line in output.decode("utf-8", "replace").splitlines():
+        fields = line.split(None, 3)
+        if (len(fields) == 4 and int(fields[1]) == pgid and
+                not fields[2].startswith("Z")):
+            result.append((int(fields[0]), fields[3]))
+    return result
+
+
+def group_members(pgid):
+    """
+    Sorted list of ``(pid, name)`` pairs of the running (not zombie)
+    processes in the given process group, from ``/proc`` when it's
+    available (Linux), else from ``ps``.
+    """
+    if os.path.isdir("/proc/self"):
+        return sorted(_proc_group_members(pgid))
+    return sorted(_ps_group_members(pgid))
+
+
+def _poll_pidfds(pidfds, timeout):
+    poller = select.poll()
+    for pidfd in pidfds:
+        poller.register(pidfd, select.POLLIN)
+    deadline = time.time() + timeout
+    pending = len(pidfds)
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        for pidfd, unused in poller.poll(remaining * 1000):
+            poller.unregister(pidfd) # It's readable since it had finished
+            pending -= 1
+    return True
+
+
+def wait_pids(pids, timeout):
+    """
+    Wait up to ``timeout`` seconds for the given processes to finish,
+    even when they aren't children of this process, with a pidfd for
+    each of them. Returns whether all of them had finished, or None
+    when there's no pidfd (it requires Python 3.9+ on Linux 5.3+).
+    """
+    pidfd_open = getattr(os, "pidfd_open", None)
+    if pidfd_open is None:
+        return None
+    pidfds = []
+    try:
+        for pid in pids:
+            try:
+                pidfds.append(pidfd_open(pid))
+            except OSError as exc:
+                if exc.errno != errno.ESRCH: # It hasn't already finished
+                    return None
+        return _poll_pidfds(pidfds, timeout)
+    finally:
+        for pidfd in pidfds:
+            os.close(pidfd)
+
+
+def _wait_without_pidfd(process, orphans, timeout):
+    """
+    Wait for the terminated group without a pidfd, where only the
+    leader can be waited (as a child process with a timeout), otherwise
+    it sleeps for the whole timeout.
+    """
+    if not orphans and isinstance(process, subprocess.Popen) and \
+       sys.version_info >= (3, 3):
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            pass
+    else:
+        time.sleep(timeout)
+
+
+def terminate_tree(process, timeout=REAP_TIMEOUT):
+    """
+    Terminate the process and everything left in its process group,
+    killing with SIGKILL whatever survives a SIGTERM for ``timeout``
+    seconds. Returns the list of ``(pid, name)`` pairs of the other
+    processes in the group that had to be terminated (the orphans),
+    which is always empty on Windows.
+
+    The terminated processes are waited (see ``wait_pids``) instead of
+    polled, and the group members are read again only after that.
+    """
+    if sys.platform == "win32":
+        signal_tree(process)
+        return []
+    orphans = [member for member in group_members(process.pid)
+                      if member[0] != process.pid]
+    if process.poll() is None or orphans:
+        signal_tree(process, signal.SIGTERM)
+        pids = [pid for pid, name in orphans]
+        if process.poll() is None:
+            pids.append(process.pid)
+        if wait_pids(pids, timeout) is None:
+            _wait_without_pidfd(process, orphans, timeout)
+        if group_members(process.pid): # E.g. ignoring SIGTERM
+            signal_tree(process, signal.SIGKILL)
+    return orphans
@@ -0,0 +1,141 @@
+"""Dose GUI for TDD: test job scheduling shared by several projects."""
+import collections, itertools, threading
+
+WAITING_JOB_ATTRIBUTES = {
+  "spawned": False,
+  "processes": [],
+  "usage": None,
+  "output": None,
+  "durations": None,
+}
+
+
+class ScheduledJob(object):
+    """
+    Test job waiting for a slot in a ``JobScheduler``, quacking like
+    the runner (e.g. ``dose.core.Job``) it becomes when started, which
+    is ``cls(**kwargs)``. Killing it while it's waiting just removes it
+    from the queue, without calling the ``after`` callback.
+    """
+    def __init__(self, scheduler, owner, cls, kwargs):
+        self.scheduler = scheduler
+        self.owner = owner
+        self.cls = cls
+        self.kwargs = kwargs
+        self.job = None
+        self.killed = False
+        self._cancelled = threading.Event()
+        self._started = threading.Event()
+        after = kwargs.get("after", cls.after)
+        exception = kwargs.get("exception", cls.exception)
+
+        def after_wrapper(result):
+            scheduler.release(self)
+            after(result)
+
+        def exception_wrapper(*exc_info):
+            scheduler.release(self)
+            exception(*exc_info)
+
+        kwargs["after"] = after_wrapper
+        kwargs["exception"] = exception_wrapper
+
+    def start(self):
+        try:
+            self.job = self.cls(**self.kwargs)
+        finally:
+            self._started.set()
+
+    def __getattr__(self, name): # Everything else from the started job
+        job = self.__dict__.get("job")
+        if job is not None:
+            return getattr(job, name)
+        if name in WAITING_JOB_ATTRIBUTES:
+            return WAITING_JOB_ATTRIBUTES[name]
+        raise AttributeError(name)
+
+    def is_alive(self):
+        if self.job is None:
+            return not self._cancelled.is_set()
+        return self.job.is_alive()
+
+    def kill(self, *args, **kwargs):
+        self.killed = True
+        if not self.scheduler.cancel(self):
+            self._started.wait() # It might be still being started
+            if self.job is not None:
+                self.job.kill(*args, **kwargs)
+
+
+class JobScheduler(object):
+    """
+    Global cap on the number of concurrent test jobs (``max_jobs``) of
+    several projects (owners). The waiting jobs are started in a fair
+    order, giving priority to the owners with fewer running jobs, and
+    then to the least recently served ones, so a project with many
+    changes can't starve the others. The shards of a job count as one.
+    """
+    def __init__(self, max_jobs=1):
+        self.max_jobs = max_jobs
+        self._queues = {} # {owner: deque of waiting jobs}
+        self._running = set()
+        self._served = {} # {owner: when its last job was started}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, owner, cls, **kwargs):
+        """
+        Enqueue a job (see ``ScheduledJob``), starting it right away
+        when there's a free slot.
+        """
+        job = ScheduledJob(self, owner, cls, kwargs)
+        with self._lock:
+            self._queues.setdefault(owner, collections.deque()).append(job)
+        self._dispatch()
+        return job
+
+    def cancel(self, job):
+        """Remove a waiting job, returning False if it was started."""
+        with self._lock:
+            queue = self._queues.get(job.owner, ())
+            if job not in queue:
+                return False
+            queue.remove(job)
+            job._cancelled.set()
+            return True
+
+    def release(self, job):
+        """Free the slot of a finished job, starting the next one."""
+        with self._lock:
+            self._running.discard(job)
+        self._dispatch()
+
+    def _next_job(self):
+        """
+        Pop the next waiting job from the owner with the fewest running
+        jobs, and, among these, the one that had waited for the longest.
+        """
+        running = collections.Counter(job.owner for job in self._running)
+        owners = [owner for owner, queue in self._queues.items() if queue]
+        if not owners:
+            return None
+        owner = min(owners, key=lambda owner: (running[owner],
+                                               self._served.get(owner, -1)))
+        self._served[owner] = next(self._counter)
+        return self._queues[owner].popleft()
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if len(self._running) >= self.max_jobs:
+                    return
+                job = self._next_job()
+                if job is None:
+                    return
+                self._running.add(job)
+            try: # Outside the lock, as the job might call release
+                job.start()
+            except Exception:
+                with self._lock:
+                    self._running.discard(job)
+                raise
@@ -1,12 +1,19 @@
 """Dose GUI for TDD: test job runner."""
-import os, subprocess, threading, sys, contextlib, time, codecs, traceback
-import signal
+import os, subprocess, threading, sys, contextlib, codecs, traceback
+import errno, select, signal, time
 from . import terminal
+from .proctree import new_group_kwargs, signal_tree, terminate_tree
+from .usage import ResourceUsage, returncode, wait_exit, wait_usage
+
+try:
+    import selectors
+except ImportError: # Python 2.7 and 3.3
+    selectors = None
 
 # Durations in seconds
-POLLING_DELAY = 0.001 # Sleep duration on non-blocking polling loops
 PRE_SPAWN_DELAY = 0.01 # Avoids spawning some subprocesses fated to be killed
-KILL_DELAY = 0.05 # Minimum duration between spawning and killing a process
+
+CHUNK_SIZE = 65536 # Maximum number of bytes read at once from a pipe
 
 
 class FlushStreamThread(threading.Thread):
@@ -64,38 +71,247 @@ def flush_stream_threads(process, out_formatter=None,
     err.join()
 
 
+class PumpedStream(object):
+    """
+    Incremental decoding/formatting state of a single piped standard
+    stream. Each chunk of bytes fed to it gets decoded and written
+    (and flushed) to the ``stream_out`` as soon as possible, so
+    partial lines are seen without waiting for a line break.
+
+    When there's a ``line_prefix``, the output is line buffered instead,
+    and each line gets the prefix, so that several processes can share
+    the same output stream. The ``eof_time`` is the ``time.time()``
+    when the EOF was found, or None while it's open.
+
+    The ``capture`` list, if given, gets ``(capture_fd, text)`` pairs
+    with the output text before the formatting.
+    """
+    def __init__(self, stream_in, stream_out, formatter=None,
+                 line_prefix=None, capture=None, capture_fd=None):
+        self.fd = stream_in.fileno()
+        self.stream_out = stream_out
+        self.formatter = formatter
+        self.line_prefix = line_prefix
+        self.capture = capture
+        self.capture_fd = capture_fd
+        self.eof_time = None
+        self._partial_line = ""
+        encoding = getattr(stream_out, "encoding", None) or "utf-8"
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+
+    def _prefix_lines(self, text, final):
+        lines = (self._partial_line + text).split("\n")
+        self._partial_line = "" if final else lines.pop()
+        if final and not lines[-1]:
+            lines.pop()
+        return "".join(self.line_prefix + line + "\n" for line in lines)
+
+    def feed(self, data):
+        """Write the given chunk, returning False on EOF (empty data)."""
+        text = self.decoder.decode(data, final=not data)
+        if self.line_prefix is not None:
+            text = self._prefix_lines(text, final=not data)
+        if not data:
+            self.eof_time = time.time()
+        if text: # Avoid undesired spurious coloring in Windows
+            if self.capture is not None:
+                self.capture.append((self.capture_fd, text))
+            if self.formatter is not None:
+                text = self.formatter(text)
+            self.stream_out.write(text)
+            self.stream_out.flush()
+        return bool(data)
+
+
+def eintr_retry(func, *args):
+    """Call ``func(*args)`` again when interrupted by a signal (Python 2)."""
+    while True:
+        try:
+            return func(*args)
+        except (OSError, IOError, select.error) as exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+
+
+def _pump_select(pending, size):
+    """Python 2.7 / 3.3 ``pump_selecting`` (no ``selectors``) fallback."""
+    while pending:
+        for fd in eintr_retry(select.select, list(pending), [], [])[0]:
+            if not pending[fd].feed(eintr_retry(os.read, fd, size)):
+                del pending[fd]
+
+
+def pump_selecting(pumped_streams, size=CHUNK_SIZE):
+    """
+    Pump several ``PumpedStream`` instances in the caller thread,
+    blocking on a selector until some of them has data to be read,
+    reading it in chunks up to ``size`` bytes. Returns on EOF.
+    This doesn't work on Windows, where pipes can't be selected.
+    """
+    pending = {ps.fd: ps for ps in pumped_streams}
+    if selectors is None:
+        return _pump_select(pending, size)
+    selector = selectors.DefaultSelector()
+    try:
+        for fd in pending:
+            selector.register(fd, selectors.EVENT_READ)
+        while pending:
+            for key, unused in selector.select():
+                if not pending[key.fd].feed(os.read(key.fd, size)):
+                    selector.unregister(key.fd)
+                    del pending[key.fd]
+    finally:
+        selector.close()
+
+
+def pump_blocking(pumped_stream, size=CHUNK_SIZE):
+    """
+    Pump a single ``PumpedStream`` instance in the caller thread with
+    blocking reads up to ``size`` bytes. Returns on EOF.
+    """
+    while pumped_stream.feed(eintr_retry(os.read, pumped_stream.fd, size)):
+        pass
+
+
+def pumped_streams(process, out_formatter=None,
+                            err_formatter=terminal.fg.red, line_prefix=None,
+                            capture=None):
+    """
+    List with the ``PumpedStream`` instances for both standard streams
+    (stdout/stderr) of the given process, to be written in the
+    respective ``sys`` stream. The formatters are callables that
+    manipulates the data, e.g. coloring it before writing it. The
+    ``capture`` list gets ``(fd, text)`` pairs, where ``fd`` is either
+    1 (stdout) or 2 (stderr).
+    """
+    return [PumpedStream(process.stdout, sys.stdout, out_formatter,
+                         line_prefix=line_prefix,
+                         capture=capture, capture_fd=1),
+            PumpedStream(process.stderr, sys.stderr, err_formatter,
+                         line_prefix=line_prefix,
+                         capture=capture, capture_fd=2)]
+
+
 @contextlib.contextmanager
-def runner(test_command, work_dir=None):
+def pumping(streams, size=CHUNK_SIZE):
+    """
+    Context manager that creates a single thread to flush in realtime
+    the given ``PumpedStream`` instances, reading chunks up to ``size``
+    bytes as soon as they are available. On Windows, where pipes can't
+    be waited with a selector, there's one thread for each stream
+    instead. Leaving it joins the threads, i.e., it waits for the EOF.
+    """
+    if sys.platform == "win32":
+        threads = [threading.Thread(target=pump_blocking, args=(ps, size))
+                   for ps in streams]
+    else:
+        threads = [threading.Thread(target=pump_selecting,
+                                    args=(streams, size))]
+    for thread in threads:
+        thread.start()
+    yield threads
+    for thread in threads:
+        thread.join()
+
+
+@contextlib.contextmanager
+def pump_streams(process, out_formatter=None,
+                          err_formatter=terminal.fg.red, size=CHUNK_SIZE,
+                          capture=None):
+    """
+    Context manager that flushes both standard streams of the given
+    process in realtime (see ``pumped_streams`` and ``pumping``).
+    """
+    with pumping(pumped_streams(process, out_formatter, err_formatter,
+                                capture=capture),
+                 size=size) as threads:
+        yield threads
+
+
+def spawn(test_command, work_dir=None, direct=False):
+    """
+    Spawn the test command in a shell with piped stdout/stderr, as the
+    leader of a new process group (see ``dose.proctree``). When
+    ``direct`` is True, the command is executed without a shell,
+    unless it requires one (see ``dose.direct.direct_argv``).
+    """
+    argv = None
+    if direct:
+        from .direct import direct_argv
+        argv = direct_argv(test_command)
+    return subprocess.Popen(test_command if argv is None else argv,
+                            bufsize=0, shell=argv is None, cwd=work_dir,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            **new_group_kwargs())
+
+
+def wait_with_usage(process, lock=None):
+    """
+    Same to ``process.wait()`` for a ``subprocess.Popen`` instance, but
+    it also stores the ``ResourceUsage`` of the process tree (without
+    the wall time) in ``process.usage``, which is empty on Windows.
+
+    With a ``lock``, the finished process is reaped (and its
+    ``returncode`` is set) while holding it, so that another thread
+    holding the same lock can signal its process group when its
+    ``returncode`` is None, as its pgid can't be reused meanwhile.
+    That requires ``os.waitid`` (Python 3.3+), the lock is neglected
+    otherwise.
+    """
+    if process.returncode is None and hasattr(os, "wait4"):
+        if lock is None or not wait_exit(process.pid):
+            lock = threading.Lock() # Neglected
+        with lock:
+            status, process.usage = wait_usage(process.pid)
+            process.returncode = returncode(status)
+    else:
+        process.wait()
+        process.usage = ResourceUsage()
+    return process.returncode
+
+
+def report_orphans(orphans):
+    """Show the ``(pid, name)`` of the reaped orphan processes."""
+    if orphans:
+        terminal.clog.magenta("*** Reaped {0} orphan process{1} ***".format(
+          len(orphans), "" if len(orphans) == 1 else "es"))
+        for pid, name in orphans:
+            terminal.log.magenta("[Dose] Orphan {0}: {1}".format(pid, name))
+
+
+@contextlib.contextmanager
+def runner(test_command, work_dir=None, capture=None, direct=False):
     """
     Internal test job runner context manager.
 
-    Run the test_command in a subprocess and instantiates 2
-    FlushStreamThread, one for each standard stream (output/stdout
-    and error/stderr).
+    Run the test_command in a subprocess whose standard streams
+    (output/stdout and error/stderr) are flushed by ``pump_streams``.
 
     It yields the subprocess.Popen instance that was spawned to
     run the given test command in the given working directory.
 
     Leaving the context manager kills the process and joins the
-    flushing threads. Use the ``process.wait`` method to avoid that.
+    pumping thread. Use the ``process.wait`` method to avoid that.
+    Every other process left in its process group is killed as well,
+    and reported as an orphan. The ``capture`` list gets the output
+    (see ``pumped_streams``), and ``direct`` avoids the shell (see
+    ``spawn``).
     """
-    process = subprocess.Popen(test_command, bufsize=0, shell=True,
-                               cwd=work_dir,
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    with flush_stream_threads(process):
+    process = spawn(test_command, work_dir, direct)
+    with pump_streams(process, capture=capture):
         try:
             yield process
         finally:
-            if process.poll() is None:
-                process.terminate()
+            orphans = terminate_tree(process)
+    report_orphans(orphans)
 
 
 class RunnerThreadCallback(threading.Thread):
     """
-    Test job runner as 3 threads + 1 subprocess.
+    Test job runner as 2 threads + 1 subprocess.
 
-    This is the main test job runner thread, the other 2 are for the
-    standard output/error flushing (one for each stream).
+    This is the main test job runner thread, the other one pumps the
+    standard output/error data (see ``pump_streams``).
 
     You can use 3 callback functions for this thread.
 
@@ -113,12 +329,21 @@ class RunnerThreadCallback(threading.Thread):
     For these callbacks, you should use thread-safe functions or some
     event sender/emitter that would delegate the handling action to
     other thread.
+
+    When ``capture`` is True, the ``output`` attribute gets the list of
+    ``(fd, text)`` pairs written by the test job (see
+    ``pumped_streams``), else it's None. When ``direct`` is True, the
+    test command is executed without a shell when possible (see
+    ``spawn``).
     """
 
     def __init__(self, test_command, work_dir=None,
-                 before=None, after=None, exception=None):
+                 before=None, after=None, exception=None, capture=False,
+                 direct=False):
         self.test_command = test_command
         self.work_dir = work_dir
+        self.direct = direct
+        self.output = [] if capture else None
         if before is not None:
             self.before = before
         if after is not None:
@@ -126,6 +351,11 @@ class RunnerThreadCallback(threading.Thread):
         if exception is not None:
             self.exception = exception
         self.killed = False
+        self.usage = None # ResourceUsage of the finished test job
+        self._kill_event = threading.Event()
+        self._reap_lock = threading.Lock() # Signal only what's not reaped
+        self._spawn_event = threading.Event() # Set when spawned, aborted
+                                              # or after an exception
         super(RunnerThreadCallback, self).__init__()
         self.start()
 
@@ -135,9 +365,10 @@ class RunnerThreadCallback(threading.Thread):
 
         Kill the subprocess if it was spawned, abort the spawning
         process otherwise. This information can be collected afterwards
-        by reading the self.killed and self.spawned flags.
+        by reading the self.killed and self.spawned flags. The signal
+        is sent to the whole process group of the subprocess.
 
-        Also join the 3 related threads to the caller thread. This can
+        Also join the related threads to the caller thread. This can
         be safely called from any thread.
 
         This method behaves as self.join() when the thread isn't alive,
@@ -146,55 +377,83 @@ class RunnerThreadCallback(threading.Thread):
         The ``sig`` parameter should be either:
 
         * ``signal.SIGKILL`` (``9``), on Linux or OSX;
-        * ``signal.SIGTERM`` (``15``), the default value. On Windows
-          this one calls the ``TerminateProcess`` Win32 API function.
+        * ``signal.SIGTERM`` (``15``), the default value.
+
+        On Windows, the process tree is always killed by ``taskkill``.
         """
-        while self.is_alive():
+        if self.is_alive():
             self.killed = True
-            time.sleep(POLLING_DELAY) # "Was a process spawned?" polling
-            if not self.spawned:
-                continue # Either self.run returns or runner yields
-            if self.process.poll() is None: # It's running
-                self.process.send_signal(sig)
-                try: # There's no os.WNOHANG in Windows
-                    os.waitpid(self.process.pid, getattr(os, "WNOHANG", 1))
-                except OSError: # Ignore "No child processes" error
-                    pass
-            break # We already either killed or finished it
+            self._kill_event.set()
+            self._spawn_event.wait() # Either self.run returns or runner yields
+            with self._reap_lock: # The runner thread reaps holding it
+                for process in self.processes:
+                    if process.returncode is None:
+                        signal_tree(process, sig) # With its process group
         self.join()
 
     @property
     def spawned(self):
         return hasattr(self, "process")
 
+    @property
+    def processes(self):
+        """List of the spawned test job processes."""
+        return [self.process] if self.spawned else []
+
     @property
     def runner_kwargs(self):
         return {
           "test_command" : self.test_command,
           "work_dir": self.work_dir,
+          "capture": self.output,
+          "direct": self.direct,
         }
 
     def run(self):
         try:
             # Waits PRE_SPAWN_DELAY, but self might get killed before that
-            start = time.time()
-            while time.time() < start + PRE_SPAWN_DELAY:
-                time.sleep(POLLING_DELAY)
-                if self.killed:
-                    break
-            else: # Avoids an unrequired spawning
+            # (it avoids spawning a subprocess that would be killed)
+            result = None
+            if not self._kill_event.wait(PRE_SPAWN_DELAY):
                 self.before()
-                with runner(**self.runner_kwargs) as self.process:
-                    time.sleep(KILL_DELAY)
-                    self.process.wait()
-            self.after(self.process.returncode if self.spawned else None)
+                result = self.run_job()
+            self._spawn_event.set()
+            self.after(result)
         except:
+            self._spawn_event.set()
             try:
                 self.exception(*sys.exc_info())
             except:
                 RunnerThreadCallback.exception(*sys.exc_info())
 
+    def run_job(self):
+        """
+        Spawn the test job and wait for it, returning its result.
+        Afterwards, ``self.usage`` is its ``ResourceUsage``.
+        """
+        start = time.time()
+        with self.runner(**self.runner_kwargs) as self.process:
+            self._spawn_event.set()
+            self.wait(self.process, self._reap_lock)
+        self.usage = self.process.usage
+        self.usage.wall = time.time() - start
+        return self.process.returncode
+
+    runner = staticmethod(runner) # Test job context manager
+    wait = staticmethod(wait_with_usage) # Process waiting function
+
     # Default callbacks
     before = staticmethod(lambda: None)
     after = staticmethod(lambda result: None)
     exception = staticmethod(traceback.print_exception)
+
+
+def replay(output):
+    """Write the captured output to the ``sys`` streams again."""
+    for fd, text in output:
+        if fd == 1:
+            sys.stdout.write(text)
+        else:
+            sys.stderr.write(terminal.fg.red(text))
+    sys.stdout.flush()
+    sys.stderr.flush()
@@ -0,0 +1,69 @@
+"""Dose GUI for TDD: test set splitting for concurrent shards."""
+import os
+from .imports import is_test_file
+
+
+def find_test_files(directory, skip=lambda path: False):
+    """
+    Set of test module files (relative paths) in the directory, where
+    ``skip`` tells which files and directories should be ignored.
+    """
+    result = set()
+    for root, dirs, files in os.walk(directory):
+        rel_root = os.path.relpath(root, directory)
+        if rel_root == os.curdir:
+            rel_root = ""
+        dirs[:] = [name for name in dirs
+                   if not skip(os.path.join(rel_root, name))]
+        result.update(path for path in (os.path.join(rel_root, name)
+                                        for name in files)
+                           if is_test_file(path) and not skip(path))
+    return result
+
+
+class ShardPlanner(object):
+    """
+    Split a set of test files into shards, balancing them by the
+    historical duration of each test file when that's known (longest
+    processing time first), else by their sorted file names (round
+    robin). The durations are estimated from the wall duration of the
+    shards where the test files had been run (see ``record``).
+    """
+    def __init__(self):
+        self.durations = {} # {test file path: estimated duration}
+
+    def split(self, tests, count):
+        """List with up to ``count`` non-empty lists of test files."""
+        tests = sorted(tests)
+        known = [self.durations[test] for test in tests
+                                      if test in self.durations]
+        if not known:
+            shards = [tests[idx::count] for idx in range(count)]
+            return [shard for shard in shards if shard]
+        default = sorted(known)[len(known) // 2] # Median
+
+        def weight(test):
+            return self.durations.get(test, default)
+
+        shards = [[] for unused in range(min(count, len(tests)))]
+        loads = [0.] * len(shards)
+        for test in sorted(tests, key=weight, reverse=True):
+            idx = loads.index(min(loads))
+            shards[idx].append(test)
+            loads[idx] += weight(test)
+        return [sorted(shard) for shard in shards]
+
+    def record(self, shards, durations):
+        """
+        Update the estimated duration of each test file given the wall
+        duration of each shard, splitting a shard duration among its
+        test files proportionally to their previous estimates.
+        """
+        for shard, duration in zip(shards, durations):
+            known = [self.durations[test] for test in shard
+                                          if test in self.durations]
+            default = sum(known) / len(known) if known else 1.
+            weights = [self.durations.get(test, default) for test in shard]
+            total = sum(weights) or 1.
+            for test, weight in zip(shard, weights):
+                self.durations[test] = duration * weight / total
@@ -25,7 +25,8 @@ class TerminalSize(object):
     Several strategies for getting the terminal width are combined
     in this class, all of them are tried until a width is found. When
     a strategy returns ``0`` or ``None``, it means it wasn't able to
-    collect the console width.
+    collect the console width, and the same applies when it raises
+    an ``OSError``/``IOError`` (e.g. a stream that isn't a terminal).
 
     Note: The ``terminal_size`` object should have been created in the
     main thread of execution.
@@ -71,7 +72,10 @@ class TerminalSize(object):
         """
         for method_name, args in self.strategies:
             method = getattr(self, "from_" + method_name)
-            width = method(*args)
+            try:
+                width = method(*args)
+            except (IOError, OSError): # Not a terminal, e.g. no TTY
+                continue
             if width and width > 0:
                 self.width = width
                 break # Found!
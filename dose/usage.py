@@ -0,0 +1,138 @@
+"""Dose GUI for TDD: test job resource usage accounting."""
+import errno, os, sys
+
+# Be careful: this file is imported by the zygote process, it should
+# import nothing else than the standard library
+
+FIELDS = ["wall", "user", "system", "max_rss", "read_bytes", "write_bytes"]
+
+
+def _total(values, func=sum):
+    known = [value for value in values if value is not None]
+    return func(known) if known else None
+
+
+def _format_bytes(value):
+    for unit in ["B", "KiB", "MiB"]:
+        if value < 1024:
+            return "{0:.1f}{1}".format(value, unit)
+        value /= 1024.
+    return "{0:.1f}GiB".format(value)
+
+
+class ResourceUsage(object):
+    """
+    Resources used by a test job process tree: the ``wall``, ``user``
+    CPU and ``system`` CPU times (seconds), the peak resident set size
+    of its largest process (``max_rss``, bytes), and the number of
+    bytes read from / written to the storage (``read_bytes`` and
+    ``write_bytes``). The CPU time and the I/O include the descendant
+    processes, as long as they were waited for. Unknown values are
+    None, like the I/O counts without ``/proc``, or everything but the
+    wall time on Windows.
+    """
+    def __init__(self, **kwargs):
+        for field in FIELDS:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError("Unknown fields: " + ", ".join(kwargs))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    @classmethod
+    def combine(cls, usages):
+        """Usage of concurrent jobs, e.g. shards, as a single job."""
+        usages = list(usages)
+
+        def total(field, func=sum):
+            return _total([getattr(usage, field) for usage in usages], func)
+
+        return cls(wall=total("wall", max),
+                   user=total("user"),
+                   system=total("system"),
+                   max_rss=total("max_rss", max),
+                   read_bytes=total("read_bytes"),
+                   write_bytes=total("write_bytes"))
+
+    def __str__(self):
+        items = []
+        for name, value in [("wall", self.wall), ("user", self.user),
+                            ("sys", self.system)]:
+            if value is not None:
+                items.append("{0} {1:.2f}s".format(name, value))
+        for name, value in [("peak RSS", self.max_rss),
+                            ("read", self.read_bytes),
+                            ("written", self.write_bytes)]:
+            if value is not None:
+                items.append("{0} {1}".format(name, _format_bytes(value)))
+        return " | ".join(items)
+
+
+def returncode(status):
+    """Return code from a ``os.waitpid`` status, like in Popen."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def read_proc_io(pid):
+    """
+    Pair with the ``read_bytes`` and ``write_bytes`` of the process
+    from ``/proc/PID/io``, including the descendants it had waited for
+    (Nones when that's not available).
+    """
+    values = {}
+    try:
+        with open("/proc/{0}/io".format(pid), "rb") as io_file:
+            for line in io_file:
+                key, unused, value = line.decode("ascii").partition(":")
+                values[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return values.get("read_bytes"), values.get("write_bytes")
+
+
+def _retry(func, *args):
+    while True: # Python 3.5+ does this on its own (PEP 475)
+        try:
+            return func(*args)
+        except OSError as exc:
+            if exc.errno != errno.EINTR:
+                raise
+
+
+def wait_exit(pid):
+    """
+    Wait for the child process to finish without reaping it (POSIX
+    only), returning False when that's not possible (Python 2.7).
+    """
+    if not hasattr(os, "waitid"): # Python 3.3+
+        return False
+    _retry(os.waitid, os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    return True
+
+
+def wait_usage(pid, block=True):
+    """
+    Wait for the child process (POSIX only), returning its status and
+    its ``ResourceUsage`` (without the wall time). The I/O counts are
+    read from ``/proc`` before reaping the finished (zombie) process.
+    When not blocking, returns None if the process is still running.
+    """
+    options = 0 if block else os.WNOHANG
+    read_bytes = write_bytes = None
+    if hasattr(os, "waitid"): # Python 3.3+
+        if _retry(os.waitid, os.P_PID, pid,
+                  os.WEXITED | os.WNOWAIT | options) is None:
+            return None # Still running
+        read_bytes, write_bytes = read_proc_io(pid)
+    reaped_pid, status, rusage = _retry(os.wait4, pid, options)
+    if reaped_pid == 0:
+        return None # Still running
+    rss_unit = 1 if sys.platform == "darwin" else 1024 # Bytes or KiB
+    return status, ResourceUsage(user=rusage.ru_utime,
+                                 system=rusage.ru_stime,
+                                 max_rss=rusage.ru_maxrss * rss_unit,
+                                 read_bytes=read_bytes,
+                                 write_bytes=write_bytes)
@@ -3,6 +3,7 @@ import sys, os, contextlib
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from .compat import UNICODE
+from . import inotify, polling
 
 
 def to_unicode(path, errors="replace"):
@@ -21,17 +22,89 @@ class GeneralEventHandler(FileSystemEventHandler):
 
     def on_any_event(self, evt):
         evt.path = os.path.relpath(to_unicode(evt.src_path), self.path)
+        if getattr(evt, "dest_path", None): # Moved
+            evt.dest = os.path.relpath(to_unicode(evt.dest_path), self.path)
         if self.selector(evt):
             self.handler(evt)
 
 
 @contextlib.contextmanager
-def watcher(path, selector, handler):
+def watcher(path, selector, handler, skip_dir=None, poll=None,
+            poll_cpu_share=polling.CPU_SHARE, report=lambda stats: None):
+    """
+    Context manager watching the path recursively, where ``skip_dir``
+    tells which (relative) directory paths should not be watched at
+    all, when that's possible (inotify, see ``dose.inotify``). When
+    ``poll`` is given, the path is polled instead, with that interval
+    in seconds and with whole tree scans using up to ``poll_cpu_share``
+    of a core, calling ``report`` with the stats of each scan (see
+    ``dose.polling``).
+    """
     path = to_unicode(path)
-    observer = Observer()
     cls_handler = GeneralEventHandler(path, selector, handler)
-    observer.schedule(cls_handler, path, recursive=True)
+    if poll is not None:
+        observer = polling.PollingObserver(interval=poll,
+                                           cpu_share=poll_cpu_share)
+        observer.schedule(cls_handler, path, report=report,
+                          skip_dir=skip_dir or (lambda path: False))
+    elif skip_dir is not None and inotify.is_supported():
+        observer = inotify.InotifyObserver()
+        observer.schedule(cls_handler, path, skip_dir=skip_dir)
+    else:
+        observer = Observer()
+        observer.schedule(cls_handler, path, recursive=True)
     observer.start()
     yield observer
     observer.stop()
     observer.join()
+
+
+class SharedObserver(object):
+    """
+    Single watchdog observer (thread) for several watched directories,
+    each one with its own selector and handler (see ``watcher``). The
+    observers are started only when needed, for the polled trees when
+    ``poll`` is given, else for the inotify ones or the others.
+    """
+    def __init__(self, poll=None, poll_cpu_share=polling.CPU_SHARE):
+        self._observer = None # Created when needed
+        self._inotify = None
+        self._polling = None
+        if poll is not None:
+            self._polling = polling.PollingObserver(interval=poll,
+                                                    cpu_share=poll_cpu_share)
+            self._polling.start()
+
+    def schedule(self, path, selector, handler, skip_dir=None,
+                 report=lambda stats: None):
+        """Start watching the path, returning the watch to unschedule."""
+        path = to_unicode(path)
+        cls_handler = GeneralEventHandler(path, selector, handler)
+        if self._polling is not None:
+            return self._polling.schedule(cls_handler, path, report=report,
+                                          skip_dir=skip_dir or
+                                                   (lambda path: False))
+        if skip_dir is not None and inotify.is_supported():
+            if self._inotify is None:
+                self._inotify = inotify.InotifyObserver()
+                self._inotify.start()
+            return self._inotify.schedule(cls_handler, path,
+                                          skip_dir=skip_dir)
+        if self._observer is None:
+            self._observer = Observer()
+            self._observer.start()
+        return self._observer.schedule(cls_handler, path, recursive=True)
+
+    def unschedule(self, watch):
+        if isinstance(watch, inotify.Watch):
+            self._inotify.unschedule(watch)
+        elif isinstance(watch, polling.PolledTree):
+            self._polling.unschedule(watch)
+        else:
+            self._observer.unschedule(watch)
+
+    def stop(self):
+        for observer in [self._observer, self._inotify, self._polling]:
+            if observer is not None:
+                observer.stop()
+                observer.join()
@@ -0,0 +1,650 @@
+"""Dose GUI for TDD: watch/run logic, shared by the GUI and headless modes."""
+from __future__ import division, print_function, unicode_literals
+import os, threading, time
+from collections import OrderedDict
+from functools import partial
+from datetime import datetime
+
+from . import terminal
+from .artifacts import LEARN_CYCLES, ArtifactStore, SelfWriteTracker
+from .debounce import Debouncer
+from .ignore import (FILENAME_PATTERN_TO_IGNORE, GitIgnore, PatternMatcher,
+                     is_ignore_file)
+
+DURATIONS_SIZE = 5 # Past test job durations kept for the "grace" policy
+HEADER_CHANGES_SIZE = 10 # Changed paths listed in a coalesced header
+
+
+class DoseWatcher(object):
+    """
+    A class to watch the directory and run the test jobs, where
+    ``call_after(func, *args)`` calls the function later, from the
+    main thread event loop. Subclasses should override the state
+    callbacks: ``on_red``, ``on_yellow``, ``on_green``, ``on_partial``
+    (green so far, still running) and ``on_stop`` (with the exception
+    that stopped the watcher).
+    """
+    def __init__(self, call_after):
+        self.call_after = call_after
+        self.directory = os.path.curdir # Default directory
+        self.call_string = ""
+        self.skip_pattern = FILENAME_PATTERN_TO_IGNORE
+        self.gitignore = False # Also skip the files ignored by git
+        self.skip_unchanged = False # Neglect events without content changes
+        self.learn_artifacts = False # Persist the paths every test job writes
+        self.preload = [] # Modules for the warm fork server, if any
+        self.affected_first = False # Run the affected tests before all tests
+        self.shards = 0 # Number of concurrent test job shards (if 2+)
+        self.cache = False # Replay the results of already tested trees
+        self.cache_size = 64 * 1024 * 1024 # Bytes
+        self.history = False # Store the runs in a SQLite database
+        self.policy = "restart" # What to do with changes during a test job
+        self.direct = False # Avoid the shell for simple test commands
+        self.pipeline = [] # Next stage commands, run while everything passes
+        self.name = None # Project name in the terminal, for several projects
+        self.observer = None # Shared dose.watcher.SharedObserver, if any
+        self.scheduler = None # Shared dose.projects.JobScheduler, if any
+        self.grace_seconds = 10. # For the "grace" policy
+        self.grace_percent = None # Same, but relative to the past durations
+        self.debounce = .1 # Quiet period (seconds) ending an event burst
+        self.debounce_max = 1. # Longest wait (seconds) for a burst to settle
+        self.poll = None # Polling interval (seconds), instead of the events
+        self.poll_cpu_share = .02 # Of a core, for the whole tree scans
+        self.metrics = False # Latency histograms and counts of the events
+        self._watching = False
+        self._skip_matcher = PatternMatcher(self.skip_pattern)
+        self._gitignore = None
+
+    def configure(self, **options):
+        """Set the given watcher options (attributes)."""
+        for name, value in options.items():
+            if name.startswith("_") or not hasattr(self, name):
+                raise TypeError("Unknown option {0!r}".format(name))
+            setattr(self, name, value)
+
+    def on_red(self):
+        pass
+
+    def on_yellow(self):
+        pass
+
+    def on_green(self):
+        pass
+
+    def on_partial(self):
+        pass
+
+    def on_stop(self, exc=None):
+        pass
+
+    @property
+    def watching(self):
+        return self._watching
+
+    def has_call_string(self):
+        return len(self.call_string.strip()) > 0
+
+    def _is_skipped(self, path, is_dir=False):
+        """Whether the path matches the skip pattern or is git-ignored."""
+        matcher = self._skip_matcher
+        if matcher.skip_pattern != self.skip_pattern: # Compiled only once
+            matcher = self._skip_matcher = PatternMatcher(self.skip_pattern)
+        return matcher(path) or (self._gitignore is not None and
+                                 self._gitignore(path, is_dir=is_dir))
+
+    def _is_skipped_dir(self, path):
+        """Whether the directory shouldn't be watched at all."""
+        return self._is_skipped(path, is_dir=True)
+
+    def _end_callback(self, result):
+        if self._runner.killed:
+            if self._runner.spawned:
+                terminal.clog.magenta("*** Killed! ***")
+            return
+        if self._shards:
+            self._shard_planner.record(self._shards, self._runner.durations)
+        if self._runner.usage is not None:
+            self._print_usage(self._runner.usage, result)
+            self._durations.setdefault(self._stage_command, []) \
+                           .append(self._runner.usage.wall)
+            del self._durations[self._stage_command][:-DURATIONS_SIZE]
+            if self._history is not None:
+                self._history.record(directory=os.path.abspath(self.directory),
+                                     command=self._stage_command,
+                                     path=self._trigger,
+                                     returncode=result,
+                                     **self._runner.usage.to_dict())
+        if result == 0:
+            if self._stages and not self._evts and not self._deferred:
+                self.on_partial() # Green, go on to the next stage
+                self._run_stage()
+                return
+            self.on_green()
+            self._end_cycle()
+        else:
+            self.on_red()
+            self._end_cycle()
+
+    def _end_cycle(self):
+        self._self_writes.end()
+        self._last_fnames = {evt.path for evt in self._deferred}
+        self._changed_paths.clear()
+        self._changed_paths.update(self._last_fnames)
+        if self._deferred: # Changes while the test job was running
+            self._evts.append(self._deferred)
+            self.call_after(self._run_subprocess)
+            self._deferred = []
+
+    def _should_restart(self):
+        """
+        Scheduling policy: whether the running test job should be killed
+        and restarted due to a change, or whether it should finish before
+        testing the new changes (coalesced). With the "grace" policy, it's
+        killed only while younger than the ``grace_seconds``, or than the
+        ``grace_percent`` of its median duration (when that's known).
+        """
+        if self.policy == "restart" or not self._runner.is_alive():
+            return True
+        if self.policy == "finish":
+            return False
+        elapsed = time.time() - self._stage_start
+        if self.grace_percent is not None:
+            from .history import median
+            durations = self._durations.get(self._stage_command)
+            return not durations or \
+                   elapsed < median(durations) * self.grace_percent / 100
+        return elapsed < self.grace_seconds
+
+    def _seed_durations(self, durations):
+        """Prepend the durations from the run history to the known ones."""
+        for command, walls in durations.items():
+            walls = walls + self._durations.get(command, [])
+            self._durations[command] = walls[-DURATIONS_SIZE:]
+
+    def _exc_callback(self, exc_type, exc_value, traceback):
+        from traceback import format_exception
+        self.stop() # Watching no more
+        terminal.hr.red("=")
+        terminal.clog.red("[Dose] Error while trying to run the test job")
+        terminal.hr.red("=")
+        for line in format_exception(exc_type, exc_value, traceback):
+            terminal.log.magenta(line.rstrip())
+        terminal.hr.red("=")
+        self.on_stop(exc_value)
+
+    def _emit_end(self, result):
+        if self._cache_key is not None and not self._runner.killed:
+            try: # Still in the runner thread
+                self._run_cache.put(self._cache_key, result,
+                                    self._runner.output)
+            except (IOError, OSError) as exc:
+                terminal.log.magenta("[Dose] Can't store the result: {0}"
+                                     .format(exc))
+        self.call_after(self._end_callback, result)
+
+    def _emit_exc(self, exc_type, exc_value, traceback):
+        self.call_after(self._exc_callback, exc_type, exc_value, traceback)
+
+    def _before_spawn(self):
+        if self._metrics is not None: # Only the first stage of the pipeline
+            self._metrics.stamp(self._spawn_evts, "spawn")
+            self._spawn_evts = []
+        self._print_timestamp()
+
+    def print_metrics(self):
+        """Print the watcher pipeline metrics, if enabled."""
+        if self._metrics is None:
+            return
+        terminal.hr.cyan("-")
+        terminal.clog.cyan("[Dose] Watcher pipeline metrics" +
+                           ("" if self.name is None else " - " + self.name))
+        for line in self._metrics.report():
+            terminal.log.cyan(line)
+        terminal.hr.cyan("-")
+
+    def _print_timestamp(self):
+        timestamp = datetime.now()
+        terminal.terminal_size.retrieve_width() # Useful if there's no SIGWINCH
+        terminal.hr.yellow("=")
+        if self.name is None:
+            terminal.clog.yellow("[Dose] {0}".format(timestamp))
+        else:
+            terminal.clog.yellow("[Dose] {0} - {1}".format(timestamp,
+                                                           self.name))
+        if self._poll_stats is not None:
+            terminal.clog.yellow(self._format_poll(self._poll_stats))
+        terminal.hr.yellow("=")
+
+    def _learn_artifacts(self, paths):
+        """Persist the paths written by several consecutive test jobs."""
+        terminal.clog.magenta("*** Learned test job artifacts: {0} ***"
+                              .format(", ".join(paths)))
+        self._artifact_store.add(self.directory, paths)
+
+    def _poll_report(self, stats):
+        """Store the last polling scan stats, called by the observer."""
+        if self._poll_stats is None:
+            terminal.clog.cyan("*** {0} ***".format(self._format_poll(stats)))
+        self._poll_stats = stats
+
+    @staticmethod
+    def _format_poll(stats):
+        return ("Polled {files} files in {directories} directories in "
+                "{wall:.3f}s (CPU {cpu:.3f}s), next scan in {delay:.1f}s"
+                .format(**stats))
+
+    def _print_usage(self, usage, result):
+        """Footer with the resource usage of the finished test job."""
+        color = "green" if result == 0 else "red"
+        terminal.clog[color]("[Dose] {0}".format(usage))
+
+    def _print_regression(self, run, median, spread):
+        """Duration regression warning of a run in the history."""
+        terminal.clog.magenta(
+          "*** Slower than usual: {0:.2f}s, the median is {1:.2f}s "
+          "(+/- {2:.2f}s) ***".format(run["wall"], median, spread)
+        )
+
+    def _print_history_error(self, exc):
+        terminal.clog.magenta("*** Can't store the run in the history: "
+                              "{0} ***".format(exc))
+
+    def _print_header(self, evts=None):
+        """Header with the coalesced changes (the last event of each path)."""
+        if evts is None:
+            terminal.clog.cyan("*** First call ***")
+            return
+        latest = OrderedDict()
+        for evt in evts:
+            latest.pop(evt.path, None)
+            latest[evt.path] = evt
+        if len(latest) > 1:
+            terminal.clog.cyan("*** {0} changes ***".format(len(latest)))
+        for evt in list(latest.values())[:HEADER_CHANGES_SIZE]:
+            terminal.clog.cyan("*** {item} {event}: {path} ***".format(
+              item = "Directory" if evt.is_directory else "File",
+              event = evt.event_type,
+              path = evt.path,
+            ))
+        if len(latest) > HEADER_CHANGES_SIZE:
+            terminal.clog.cyan("*** ... and {0} more ***".format(
+              len(latest) - HEADER_CHANGES_SIZE
+            ))
+
+    def _runner_class(self, test_command):
+        """Test job class and its extra keyword arguments."""
+        if (self._fork_server is not None and
+                not isinstance(test_command, list)):
+            from .forkserver import ForkServerJob, parse_python_command
+            if parse_python_command(test_command) is not None:
+                return ForkServerJob, {
+                    "server": self._fork_server,
+                }
+            terminal.clog.magenta("*** Not a Python command, "
+                                  "using the shell ***")
+        from .core import Job # Shell test commands and shards
+        return Job, {"direct": self.direct}
+
+    def _test_stages(self):
+        """
+        List of ``(title, call_string, tests)`` triples to be run in order,
+        each one only if the previous one had passed, where ``tests`` is
+        either a list of test files or None for running the whole test
+        suite. The pipeline stages run only after the main call string.
+        """
+        stages = [(None, self.call_string, None)]
+        if self._import_graph is not None and self._changed_paths:
+            tests = self._import_graph.affected_tests(
+                sorted(self._changed_paths)
+            )
+            if tests:
+                stages = [("{0} affected test file(s)".format(len(tests)),
+                           self.call_string, tests),
+                          ("Full test suite", self.call_string, None)]
+        if self.pipeline:
+            count = len(self.pipeline) + 1
+            if stages[0][0] is None:
+                stages[0] = ("Stage 1/{0}: {1}".format(count,
+                                                       self.call_string),
+                             self.call_string, None)
+            stages.extend(("Stage {0}/{1}: {2}".format(idx, count, command),
+                           command, None)
+                          for idx, command in enumerate(self.pipeline, 2))
+        return stages
+
+    def _scan_test_files(self):
+        """Find the test files in the watched directory, in background."""
+        from .shards import find_test_files
+        self._all_test_files = find_test_files(self.directory,
+                                               skip=self._is_skipped)
+
+    def _tests_command(self, call_string, tests):
+        """Test command for the given test files (None for all tests)."""
+        from .imports import full_tests_command, selected_tests_command
+        if tests is None:
+            return full_tests_command(call_string)
+        return selected_tests_command(call_string, tests)
+
+    def _stage_test_command(self, call_string, tests):
+        """
+        Test command (a string) for the given test files (None for all),
+        or a list of test commands when it should be split in shards
+        (only for the main call string, not for the pipeline stages).
+        The whole test suite isn't split while its test files are still
+        being found.
+        """
+        from .imports import selected_tests_command
+        self._shards = None
+        tests_to_split = tests or self._all_test_files
+        if self.shards > 1 and call_string == self.call_string and \
+           tests_to_split is not None:
+            shards = self._shard_planner.split(tests_to_split, self.shards)
+            if len(shards) > 1:
+                self._shards = shards
+                return [selected_tests_command(call_string, shard)
+                        for shard in shards]
+        return self._tests_command(call_string, tests)
+
+    def _stage_cache_key(self):
+        """Cache key for the current tree state, None if it's unknown."""
+        if self._tree is None or self._tree.digest is None:
+            return None
+        return self._run_cache.key(self._tree.digest,
+                                   os.path.abspath(self.directory),
+                                   self._stage_command)
+
+    def _run_stage(self):
+        title, call_string, tests = self._stages.pop(0)
+        if title is not None:
+            terminal.clog.cyan("*** {0} ***".format(title))
+        self._stage_command = self._tests_command(call_string, tests)
+        self._stage_start = time.time()
+        self._cache_key = self._stage_cache_key()
+        entry = None if self._cache_key is None else \
+                self._run_cache.get(self._cache_key)
+        if entry is not None:
+            from .core import CachedJob
+            terminal.clog.cyan("*** Cached result ***")
+            test_command = self._stage_command
+            cls, kwargs = CachedJob, {"entry": entry}
+            self._cache_key = self._shards = None
+        else:
+            test_command = self._stage_test_command(call_string, tests)
+            if self._shards:
+                terminal.clog.cyan("*** {0} shards ***"
+                                   .format(len(self._shards)))
+            cls, kwargs = self._runner_class(test_command)
+            kwargs["capture"] = self._cache_key is not None
+        kwargs.update(test_command=test_command,
+                      work_dir=self.directory,
+                      before=self._before_spawn,
+                      after=self._emit_end,
+                      exception=self._emit_exc)
+        if self.scheduler is None:
+            self._runner = cls(**kwargs)
+        else: # Might wait for other projects test jobs
+            self._runner = self.scheduler.submit(self, cls, **kwargs)
+
+    def _run_subprocess(self):
+        if self.watching:
+            evts = self._evts.pop()
+            self._print_header(evts)
+            if not self._evts: # Multiple bursts at once, only the last runs
+                self._trigger = None if evts is None else evts[-1].path
+                self._spawn_evts = evts or []
+                self.on_yellow() # State changed: "waiting" for a test job
+                self._self_writes.begin()
+                self._neglected = set()
+                self._stages = self._test_stages()
+                self._run_stage()
+
+    def _register_change(self, evt):
+        self._last_fnames.add(evt.path)
+        if self._all_test_files is not None:
+            from .imports import is_test_file
+            if is_test_file(evt.path):
+                if os.path.isfile(os.path.join(self.directory, evt.path)):
+                    self._all_test_files.add(evt.path)
+                else:
+                    self._all_test_files.discard(evt.path)
+
+    def _burst_handler(self, evts):
+        """
+        Debouncer callback, neglecting the events without content changes
+        (when asked to) only after the burst had settled, as a file might
+        be, for example, truncated before being written again. The files
+        are hashed by the content index worker, not in this thread.
+        """
+        if self._metrics is not None:
+            self._metrics.stamp(evts, "debounce")
+        if self._contents is None:
+            self._content_handler(evts, [True] * len(evts))
+        else:
+            self._contents.check([evt.path for evt in evts],
+                                 partial(self._content_handler, evts))
+
+    def _content_handler(self, evts, changes):
+        """Forward the events whose file contents had changed."""
+        changed, unchanged = [], []
+        for evt, change in zip(evts, changes):
+            (changed if change else unchanged).append(evt)
+        if self._metrics is not None and unchanged:
+            self._metrics.reject(unchanged, "unchanged")
+        if changed:
+            self.call_after(self._watchdog_handler, changed)
+
+    def _watchdog_handler(self, evts):
+        """Handle a burst of events coalesced by the debouncer."""
+        if self._metrics is not None:
+            self._metrics.stamp(evts, "queue")
+        for evt in evts:
+            self._register_change(evt)
+        paths = list(OrderedDict.fromkeys(evt.path for evt in evts))
+        self._self_writes.killed_by(paths) # Changes made by the user
+        if self._deferred or not self._should_restart():
+            terminal.clog.cyan("*** {0} changed, waiting for the test job "
+                               "to finish ***".format(", ".join(paths)))
+            self._deferred.extend(evts)
+            return
+        self._changed_paths.update(paths)
+        self._runner.kill() # Triggers end/exception callback
+        self._evts.append(evts)
+        self.call_after(self._run_subprocess) # After the runner callbacks
+
+    def _rejection(self, evt):
+        """Why the event should be neglected, or None to accept it."""
+        self._update_indexes(evt)
+        if self._gitignore is not None and is_ignore_file(evt.path):
+            self._gitignore.load()
+        if evt.is_directory:
+            return "directory"
+        if evt.event_type not in ["created", "deleted", "modified"]:
+            return "event type"
+        path = evt.path
+        if self._is_skipped(path):
+            return "skipped"
+        if path in self._last_fnames: # Detected a "killing cycle"
+            return "cycle" # Not observed, as it might be the user saving
+        if self._self_writes.observe(path): # Written by the test job
+            if path not in self._neglected: # Once per test job
+                self._neglected.add(path)
+                terminal.clog.magenta("*** {0} written by the test job, "
+                                      "neglected ***".format(path))
+            return "self-write"
+        return None
+
+    def _update_indexes(self, evt):
+        """
+        Update the tree state hashes and the import graph with both
+        paths of a moved event, called by the watchdog thread.
+        """
+        paths = [evt.path]
+        if evt.event_type == "moved":
+            paths.append(evt.dest)
+        if self._tree is not None:
+            update = self._tree.update_directory if evt.is_directory \
+                                                 else self._tree.update
+            for path in paths:
+                update(path)
+        if self._import_graph is not None and not evt.is_directory:
+            self._import_graph.update(*paths)
+
+    def _selector(self, evt):
+        """Whether the event should be handled, from the watcher thread."""
+        if self._metrics is None:
+            return self._rejection(evt) is None
+        self._metrics.observe(evt)
+        reason = self._rejection(evt)
+        self._metrics.decide(evt, reason)
+        return reason is None
+
+    @staticmethod
+    def _background(func):
+        """Call the function in a daemon thread, e.g. an index scan."""
+        thread = threading.Thread(target=func)
+        thread.daemon = True
+        thread.start()
+
+    def _start_indexes(self):
+        """
+        Create the indexes of the watched directory required by the
+        options, scanning the directory in background.
+        """
+        # Import graph for finding the tests affected by the changes
+        self._import_graph = None
+        if self.affected_first:
+            from .imports import ImportGraph
+            self._import_graph = ImportGraph(self.directory,
+                                             skip=self._is_skipped)
+            self._background(self._import_graph.scan)
+
+        # Shards should be balanced by the test files durations
+        self._all_test_files = None
+        if self.shards > 1:
+            from .shards import ShardPlanner
+            self._shard_planner = ShardPlanner()
+            self._background(self._scan_test_files)
+
+        # Tree hashing for the test job result cache
+        self._tree = self._cache_key = None
+        if self.cache:
+            from .cache import TreeState, RunCache
+            self._tree = TreeState(self.directory, skip=self._is_skipped)
+            self._run_cache = RunCache(max_bytes=self.cache_size)
+            self._background(self._tree.scan)
+
+        # File contents index for neglecting the events without changes
+        self._contents = None
+        if self.skip_unchanged:
+            from .cache import ContentIndex
+            self._contents = ContentIndex(self.directory)
+
+    def _start_tracking(self):
+        """Create the trackers of the test jobs and of the events."""
+        # Run history with the duration regression warnings
+        self._history = None
+        if self.history:
+            from .history import RunHistory
+            self._history = RunHistory(
+                on_regression=partial(self.call_after, self._print_regression),
+                on_error=partial(self.call_after, self._print_history_error),
+            )
+
+        # Paths written by the test jobs themselves (e.g. coverage data)
+        self._self_writes = SelfWriteTracker()
+        if self.learn_artifacts:
+            self._artifact_store = ArtifactStore()
+            self._self_writes = SelfWriteTracker(
+                artifacts=self._artifact_store.load(self.directory),
+                learn_cycles=LEARN_CYCLES,
+                on_learn=self._learn_artifacts,
+            )
+
+        # Timestamps and counts of the events in every stage of this watcher
+        self._metrics = None
+        if self.metrics:
+            from .metrics import PipelineMetrics
+            self._metrics = PipelineMetrics()
+
+    def start(self):
+        """Starts watching the path and running the test jobs."""
+        assert not self.watching
+
+        # Rules from the .gitignore files, used by everything below
+        self._gitignore = GitIgnore(self.directory) if self.gitignore \
+                                                    else None
+
+        # Warm fork server (zygote) with the preloaded modules
+        self._fork_server = None
+        if self.preload:
+            from .forkserver import ForkServer
+            if ForkServer.is_supported():
+                self._fork_server = ForkServer(self.preload,
+                                               work_dir=self.directory)
+            else:
+                terminal.clog.magenta("*** No fork server in this "
+                                      "platform ***")
+
+        self._start_indexes()
+        self._start_tracking()
+
+        # Bursts of events (e.g. saving all files) should trigger a single run
+        self._debouncer = Debouncer(
+            self._burst_handler,
+            quiet=self.debounce,
+            max_wait=self.debounce_max,
+        )
+
+        # Force a first event
+        self._poll_stats = None
+        self._watching = True
+        self._last_fnames = set()
+        self._neglected = set() # Self-writes already shown
+        self._changed_paths = set()
+        self._deferred = [] # Events waiting for the test job to finish
+        self._durations = {} # {stage command: last wall durations}
+        if self._history is not None: # Past durations for "grace" policy
+            self._history.load_durations(
+                os.path.abspath(self.directory),
+                partial(self.call_after, self._seed_durations),
+                limit=DURATIONS_SIZE,
+            )
+        self._evts = [None]
+        self._run_subprocess()
+
+        # Starts the watchdog observer
+        if self.observer is None:
+            from .watcher import watcher
+            self._watcher = watcher(path=self.directory,
+                                    selector=self._selector,
+                                    handler=self._debouncer.add,
+                                    skip_dir=self._is_skipped_dir,
+                                    poll=self.poll,
+                                    poll_cpu_share=self.poll_cpu_share,
+                                    report=self._poll_report)
+            self._watcher.__enter__() # Returns a started watchdog Observer
+        else:
+            self._watch = self.observer.schedule(
+                path=self.directory,
+                selector=self._selector,
+                handler=self._debouncer.add,
+                skip_dir=self._is_skipped_dir,
+                report=self._poll_report,
+            )
+
+    def stop(self):
+        if self.watching:
+            if self.observer is None:
+                self._watcher.__exit__(None, None, None)
+            else:
+                self.observer.unschedule(self._watch)
+            self._debouncer.cancel()
+            if self._contents is not None:
+                self._contents.close()
+            self._runner.kill()
+            if self._fork_server is not None:
+                self._fork_server.stop()
+            if self._history is not None:
+                self._history.close()
+            self.print_metrics()
+            self._watching = False
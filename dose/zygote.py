@@ -0,0 +1,190 @@
+"""
+Dose GUI for TDD: warm fork server ("zygote") process.
+
+This module is the ``__main__`` of the zygote process, called as::
+
+  python -m dose.zygote SOCKET_FD MODULE [MODULE ...]
+
+It imports the given modules, then waits for job requests on the
+inherited UNIX socket, forking a fresh child for each of them.
+"""
+import json, os, runpy, signal, socket, struct, sys, traceback
+from .usage import returncode, wait_exit, wait_usage
+
+# Be careful: this file is imported by the zygote process, it should
+# import nothing else than the standard library (and dose.usage)
+
+HEADER = struct.Struct("!I") # Message length
+MAX_FDS = 2 # Each request has the child stdout and stderr pipe endpoints
+
+
+def send_message(sock, obj, fds=()):
+    """Send a JSON message with some optional file descriptors."""
+    payload = json.dumps(obj).encode("utf-8")
+    ancillary = []
+    if fds:
+        fds_data = struct.pack("{0}i".format(len(fds)), *fds)
+        ancillary.append((socket.SOL_SOCKET, socket.SCM_RIGHTS, fds_data))
+    sock.sendmsg([HEADER.pack(len(payload))], ancillary)
+    sock.sendall(payload)
+
+
+def recv_exactly(sock, size):
+    """Receive ``size`` bytes, or raise EOFError if the socket closes."""
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    """
+    Receive a message written by ``send_message``, returning a pair
+    with the JSON object and the list of received file descriptors.
+    Raises EOFError when the socket is closed.
+    """
+    int_size = struct.calcsize("i")
+    header, ancillary, unused, unused = sock.recvmsg(
+        HEADER.size, socket.CMSG_SPACE(MAX_FDS * int_size),
+    )
+    if not header:
+        raise EOFError
+    fds = []
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            data = data[:len(data) - len(data) % int_size]
+            fds.extend(struct.unpack("{0}i".format(len(data) // int_size),
+                                     data))
+    header += recv_exactly(sock, HEADER.size - len(header))
+    payload = recv_exactly(sock, HEADER.unpack(header)[0])
+    return json.loads(payload.decode("utf-8")), fds
+
+
+def source_file(module):
+    """The source file name of the module, if there's one."""
+    fname = getattr(module, "__file__", None)
+    if not fname:
+        return None
+    if fname.endswith((".pyc", ".pyo")) and os.path.exists(fname[:-1]):
+        return fname[:-1]
+    return fname
+
+
+def preload(modules):
+    """
+    Import the given modules, returning a pair with the source file
+    names of every module imported (as they all should be watched)
+    and a boolean telling whether every import succeeded.
+    """
+    success = True
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception: # The zygote still serves the jobs
+            traceback.print_exc()
+            success = False
+    files = set(map(source_file, list(sys.modules.values())))
+    return sorted(fname for fname in files
+                  if fname and os.path.isfile(fname)), success
+
+
+def run_job(argv):
+    """
+    Run ``python ARGV`` in the current process, returning the exit
+    status that the interpreter would return.
+    """
+    try:
+        if argv[0] == "-m":
+            sys.argv = argv[1:]
+            sys.path[0] = os.getcwd()
+            runpy.run_module(argv[1], run_name="__main__", alter_sys=True)
+        else:
+            sys.argv = argv
+            sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+            runpy.run_path(argv[0], run_name="__main__")
+    except SystemExit as exc:
+        if exc.code is None:
+            return 0
+        if isinstance(exc.code, int):
+            return exc.code & 0xff
+        sys.stderr.write("{0}\n".format(exc.code))
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def child(sock, request, fds):
+    """Forked child process procedure, it never returns."""
+    status = 1
+    try:
+        sock.close()
+        os.setsid() # Its own process group, killed as a whole by Dose
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for fd, target in zip(fds, [1, 2]):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        status = run_job(request["argv"])
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        for stream in [sys.stdout, sys.stderr]:
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(status)
+
+
+def serve_job(sock):
+    """
+    Fork a child for the next job request and wait for it, telling
+    Dose when it finishes, but reaping it only after Dose acknowledges
+    that, so its process group can't be reused while Dose might still
+    signal it. Raises EOFError when the socket gets closed.
+    """
+    request, fds = recv_message(sock)
+    for stream in [sys.stdout, sys.stderr]:
+        stream.flush() # Nothing buffered should be written twice
+    pid = os.fork()
+    if pid == 0:
+        child(sock, request, fds)
+    for fd in fds:
+        os.close(fd)
+    send_message(sock, {"pid": pid})
+    wait_exit(pid)
+    send_message(sock, {"finished": True})
+    recv_message(sock) # Acknowledgement
+    status, usage = wait_usage(pid)
+    send_message(sock, {"returncode": returncode(status),
+                        "usage": usage.to_dict()})
+
+
+def serve(sock):
+    """Fork server loop, it returns when the socket gets closed."""
+    try:
+        while True:
+            serve_job(sock)
+    except EOFError:
+        return
+
+
+def main(fd, *modules):
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Dose handles it
+    sock = socket.fromfd(int(fd), socket.AF_UNIX, socket.SOCK_STREAM)
+    os.close(int(fd))
+    files, success = preload(modules)
+    send_message(sock, {"files": files, "success": success})
+    serve(sock)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,69 @@
+"""Dose GUI for TDD: test module for the test job artifacts tracking."""
+import json, time
+from dose.artifacts import ArtifactStore, SelfWriteTracker
+
+
+def test_self_writes_of_the_previous_window():
+    tracker = SelfWriteTracker(settle=.05)
+    assert not tracker.observe("a.py") # Before any test job
+    tracker.begin()
+    assert not tracker.observe(".coverage")
+    tracker.end()
+    tracker.begin()
+    assert tracker.observe(".coverage")
+    tracker.end()
+    time.sleep(.1)
+    assert not tracker.observe(".coverage") # After settling
+    assert not tracker.observe("a.py")
+    tracker.begin()
+    assert not tracker.observe("a.py") # The previous event was outside
+    assert tracker.observe(".coverage")
+
+
+def test_paths_killing_the_job_are_not_self_writes():
+    tracker = SelfWriteTracker()
+    tracker.begin()
+    assert not tracker.observe("a.py")
+    tracker.killed_by(["a.py"])
+    tracker.begin()
+    assert not tracker.observe("a.py")
+
+
+def test_learning_artifacts():
+    learned = []
+    tracker = SelfWriteTracker(settle=0, artifacts=["report.xml"],
+                               learn_cycles=2, on_learn=learned.append)
+    tracker.begin()
+    assert tracker.observe("report.xml")
+    tracker.observe("db.sqlite")
+    tracker.observe("a.py")
+    tracker.begin()
+    tracker.observe("db.sqlite")
+    tracker.begin()
+    assert learned == [["db.sqlite"]]
+    assert tracker.artifacts == {"report.xml", "db.sqlite"}
+    tracker.begin() # Not in the previous window, but an artifact
+    assert tracker.observe("db.sqlite")
+
+
+def test_paths_killing_the_jobs_are_never_learned():
+    learned = []
+    tracker = SelfWriteTracker(learn_cycles=3, on_learn=learned.append)
+    for unused in range(3):
+        tracker.begin()
+        tracker.observe("src/foo.py")
+        tracker.killed_by(["src/foo.py"])
+    tracker.begin()
+    assert learned == []
+    assert tracker._counts == {}
+
+
+def test_artifact_store_merges(tmpdir):
+    fname = str(tmpdir.join("artifacts.json"))
+    first, second = ArtifactStore(fname), ArtifactStore(fname)
+    assert first.load("proj") == []
+    first.add("proj", ["b", "a"])
+    second.add("proj", ["c"])
+    second.add("other", ["x"])
+    assert first.load("proj") == ["a", "b", "c"]
+    assert len(json.loads(tmpdir.join("artifacts.json").read())) == 2
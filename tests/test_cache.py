@@ -0,0 +1,119 @@
+"""Dose GUI for TDD: test module for the test job result cache."""
+import os, threading
+from dose.cache import ContentIndex, TreeState, RunCache
+
+
+class TestTreeState(object):
+
+    def test_digest_follows_contents(self, tmpdir):
+        tmpdir.join("a.py").write("a")
+        tmpdir.join("sub", "b.py").write("b", ensure=True)
+        tmpdir.join("skipped.pyc").write("c")
+        tree = TreeState(str(tmpdir), skip=lambda path: path.endswith("c"))
+        assert tree.digest is None # Not scanned
+        tree.scan()
+        initial = tree.digest
+        assert len(initial) == 40
+
+        tmpdir.join("a.py").write("changed")
+        tree.update("a.py")
+        assert tree.digest != initial
+        tmpdir.join("skipped.pyc").write("changed")
+        tree.update("skipped.pyc")
+        tmpdir.join("a.py").write("a")
+        tree.update("a.py")
+        assert tree.digest == initial
+
+        tmpdir.join("sub", "b.py").remove()
+        tree.update(os.path.join("sub", "b.py"))
+        assert tree.digest != initial
+        tmpdir.join("sub", "b.py").write("b")
+        tree.update(os.path.join("sub", "b.py"))
+        assert tree.digest == initial
+
+    def test_renamed_directory(self, tmpdir):
+        tmpdir.join("pkg", "mod.py").write("x", ensure=True)
+        tree = TreeState(str(tmpdir))
+        tree.scan()
+        initial = tree.digest
+        tmpdir.join("pkg").rename(tmpdir.join("lib"))
+        tree.update_directory("pkg")
+        tree.update_directory("lib")
+        assert tree.digest != initial
+        tmpdir.join("lib").rename(tmpdir.join("pkg"))
+        tree.update_directory("lib")
+        tree.update_directory("pkg")
+        assert tree.digest == initial
+
+
+class TestContentIndex(object):
+
+    def test_touch_and_rewrite_are_no_change(self, tmpdir):
+        fname = tmpdir.join("a.py")
+        fname.write("a")
+        index = ContentIndex(str(tmpdir))
+        assert index.changed("a.py") # Unknown
+        assert list(index._files) == ["a.py"]
+        assert not index.changed("a.py")
+        os.utime(str(fname), (1, 1))
+        assert not index.changed("a.py") # Hashed, same contents
+        fname.write("a")
+        assert not index.changed("a.py")
+        fname.write("b")
+        assert index.changed("a.py")
+        assert not index.changed("a.py")
+        fname.remove()
+        assert index.changed("a.py")
+        assert "a.py" not in index._files
+
+    def test_lazy_unknown_files(self, tmpdir):
+        tmpdir.join("old.py").write("x")
+        index = ContentIndex(str(tmpdir))
+        assert index._files == {} # Nothing is hashed beforehand
+        tmpdir.join("new.py").write("x")
+        assert index.changed("new.py")
+        os.utime(str(tmpdir.join("new.py")), (1, 1))
+        assert not index.changed("new.py")
+        assert list(index._files) == ["new.py"]
+
+    def test_check_in_the_worker_thread(self, tmpdir):
+        tmpdir.join("a.py").write("a")
+        index = ContentIndex(str(tmpdir))
+        results = []
+        done = threading.Event()
+
+        def callback(changes):
+            results.append((changes, threading.current_thread()))
+            if len(results) == 2:
+                done.set()
+
+        index.check(["a.py", "missing.py"], callback)
+        index.check(["a.py"], callback)
+        assert done.wait(10)
+        index.close()
+        assert [changes for changes, unused in results] \
+               == [[True, True], [False]]
+        assert results[0][1] is not threading.current_thread()
+
+
+class TestRunCache(object):
+
+    def test_put_and_get(self, tmpdir):
+        cache = RunCache(str(tmpdir.join("cache")))
+        key = cache.key("digest", "/path", "pytest")
+        assert key != cache.key("digest", "/path", "pytest -x")
+        assert cache.get(key) is None
+        cache.put(key, 1, [(1, "out\n"), (2, "err\n")])
+        assert cache.get(key) == {"returncode": 1,
+                                  "output": [[1, "out\n"], [2, "err\n"]]}
+
+    def test_evict_least_recently_used(self, tmpdir):
+        cache = RunCache(str(tmpdir), max_bytes=300) # 3 entries
+        output = [(1, "x" * 50)]
+        for idx, key in enumerate("abc"):
+            cache.put(key, 0, output)
+            os.utime(str(tmpdir.join(key + ".json")), (idx, idx))
+        assert cache.get("a") is not None # Now the most recently used
+        cache.put("d", 0, output)
+        assert sorted(os.listdir(str(tmpdir))) == ["a.json", "c.json",
+                                                   "d.json"]
@@ -0,0 +1,49 @@
+"""Dose GUI for TDD: test module for the configuration file persistence."""
+import json, threading, time
+from dose.config import ConfigWriter, load_json, merge_json
+
+
+def test_load_json_missing_or_invalid(tmpdir):
+    assert load_json(str(tmpdir.join("missing.json"))) == {}
+    tmpdir.join("invalid.json").write("{\"a\": ")
+    assert load_json(str(tmpdir.join("invalid.json"))) == {}
+    tmpdir.join("list.json").write("[1]")
+    assert load_json(str(tmpdir.join("list.json"))) == {}
+
+
+def test_merge_json_keeps_the_other_options(tmpdir):
+    fname = str(tmpdir.join("dose.conf"))
+    merge_json(fname, {"size": [100, 300], "opacity": 1})
+    merge_json(fname, {"opacity": 2, "flipped": True})
+    assert load_json(fname) == {"size": [100, 300], "opacity": 2,
+                                "flipped": True}
+    assert [path.basename for path in tmpdir.listdir()
+                          if not path.basename.endswith(".lock")] \
+           == ["dose.conf"] # No temporary file left behind
+
+
+def test_writer_coalesces_changes_in_a_single_thread(tmpdir, monkeypatch):
+    fname = str(tmpdir.join("dose.conf"))
+    writes = []
+    monkeypatch.setattr("dose.config.merge_json",
+                        lambda *args: writes.append(args))
+    writer = ConfigWriter(lag=.05, max_lag=10)
+    threads = threading.active_count()
+    for idx in range(20):
+        writer.update(fname, {"position": [idx, idx]})
+        time.sleep(.005)
+    assert threading.active_count() == threads + 1
+    time.sleep(.2)
+    assert writes == [(fname, {"position": [19, 19]})]
+
+
+def test_writer_max_lag_and_flush(tmpdir):
+    fname = str(tmpdir.join("dose.conf"))
+    writer = ConfigWriter(lag=10, max_lag=.05)
+    writer.update(fname, {"opacity": 1})
+    time.sleep(.2) # The lag is never reached
+    assert load_json(fname) == {"opacity": 1}
+    writer.update(fname, {"flipped": True})
+    writer.flush()
+    with open(fname) as json_file:
+        assert json.load(json_file) == {"opacity": 1, "flipped": True}
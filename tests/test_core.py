@@ -0,0 +1,191 @@
+"""Dose GUI for TDD: test module for the test job event loop core."""
+import os, signal, sys, threading, time, pytest
+from dose import core
+from dose.proctree import group_members
+
+
+@pytest.fixture
+def sigchld_wakeup():
+    with core.signal_wakeup() as reactor:
+        callback = lambda: None
+        if not reactor.add_signal_callback(core.SIGCHLD, callback):
+            pytest.skip("No SIGCHLD wakeup")
+        reactor.remove_signal_callback(core.SIGCHLD, callback)
+        yield reactor
+
+
+def test_signal_wakeup_restores_the_signals(sigchld_wakeup):
+    assert signal.getsignal(signal.SIGCHLD) is core._ignore_signal
+    with core.signal_wakeup([signal.SIGUSR1]): # Nested
+        assert signal.getsignal(signal.SIGUSR1) is core._ignore_signal
+    assert signal.getsignal(signal.SIGUSR1) is signal.SIG_DFL
+    assert signal.getsignal(signal.SIGCHLD) is signal.SIG_DFL
+    assert signal.set_wakeup_fd(-1) == -1
+    assert not sigchld_wakeup.add_signal_callback(core.SIGCHLD, id)
+
+
+def test_job_exit_without_pidfd_wakes_up_on_sigchld(sigchld_wakeup,
+                                                    monkeypatch):
+    monkeypatch.delattr(os, "pidfd_open", raising=False)
+    monkeypatch.setattr(core, "EXIT_POLLING_DELAY", 3600) # Never polls
+    results = []
+    job = core.Job("exit 3", after=results.append, reactor=sigchld_wakeup)
+    job.join(timeout=10)
+    assert results == [3]
+
+
+@pytest.fixture
+def reactor():
+    return core.get_reactor()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(.01)
+    return condition()
+
+
+def test_timers_order_and_cancel(reactor):
+    calls = []
+    done = threading.Event()
+    reactor.call_later(.06, calls.append, "late")
+    reactor.call_later(.02, calls.append, "early")
+    reactor.call_later(.04, calls.append, "cancelled").cancel()
+    reactor.call_soon(calls.append, "soon")
+    reactor.call_later(.1, done.set)
+    assert done.wait(10)
+    assert calls == ["soon", "early", "late"]
+
+
+def test_call_soon_from_other_threads(reactor):
+    calls = []
+    threads = [threading.Thread(target=reactor.call_soon, args=(
+                 lambda idx: calls.append((idx, reactor.in_reactor_thread())),
+                 idx,
+               )) for idx in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert wait_for(lambda: len(calls) == 5)
+    assert sorted(calls) == [(idx, True) for idx in range(5)]
+
+
+def test_callback_exception_doesnt_stop_the_loop(reactor, capsys):
+    done = threading.Event()
+    reactor.call_soon(lambda: 1 / 0)
+    reactor.call_soon(done.set)
+    assert done.wait(10)
+    assert "ZeroDivisionError" in capsys.readouterr().err
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="No pipe selector")
+def test_add_stream_chunks_and_eof(reactor):
+    read_fd, write_fd = os.pipe()
+    chunks = []
+    reactor.call_soon(reactor.add_stream, read_fd, chunks.append, 4)
+    os.write(write_fd, b"0123456789")
+    os.close(write_fd)
+    try:
+        assert wait_for(lambda: chunks and chunks[-1] == b"")
+        assert b"".join(chunks) == b"0123456789"
+        assert all(len(chunk) <= 4 for chunk in chunks)
+        assert read_fd not in reactor._readers
+    finally:
+        os.close(read_fd)
+
+
+def test_job_shards_with_line_prefixes(reactor):
+    results = []
+    job = core.Job(["echo a; echo b", "echo c; exit 2", "exit 0"],
+                   capture=True, after=results.append, reactor=reactor)
+    job.join(timeout=10)
+    assert results == [2] # The first non-zero return code
+    assert sorted(job.output) == [(1, "[1/3] a\n[1/3] b\n"),
+                                  (1, "[2/3] c\n")]
+    assert len(job.durations) == 3
+    assert job.usage.wall >= max(job.durations)
+    assert [process.returncode for process in job.processes] == [0, 2, 0]
+
+
+def test_job_exception_in_before(reactor):
+    results, errors = [], []
+    job = core.Job("echo never", before=lambda: 1 / 0, reactor=reactor,
+                   after=results.append,
+                   exception=lambda *exc_info: errors.append(exc_info[0]))
+    job.join(timeout=10)
+    assert not job.is_alive() and not job.spawned
+    assert results == []
+    assert errors == [ZeroDivisionError]
+
+
+def test_job_kill_before_spawning(reactor, monkeypatch):
+    monkeypatch.setattr(core, "PRE_SPAWN_DELAY", 3600)
+    results = []
+    job = core.Job("echo never", after=results.append, reactor=reactor)
+    job.kill()
+    assert job.killed and not job.spawned
+    assert results == [None]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="No process groups")
+def test_job_kill_terminates_the_process_group(reactor):
+    results = []
+    job = core.Job("sleep 30 & sleep 30", after=results.append,
+                   reactor=reactor)
+    assert wait_for(lambda: job.spawned)
+    pgid = job.processes[0].pid
+    assert wait_for(lambda: len(group_members(pgid)) == 3)
+    job.kill()
+    assert results == [-signal.SIGTERM]
+    assert wait_for(lambda: group_members(pgid) == [])
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="No process groups")
+def test_job_orphans_escalation_to_sigkill(reactor, monkeypatch, tmpdir):
+    monkeypatch.setattr(core, "REAP_TIMEOUT", .2)
+    results = []
+    job = core.Job("(trap '' TERM; touch ready; exec sleep 30) & "
+                   "while [ ! -e ready ]; do sleep .01; done",
+                   work_dir=str(tmpdir), after=results.append,
+                   reactor=reactor)
+    assert wait_for(lambda: job.spawned)
+    pgid = job.processes[0].pid
+    start = time.time()
+    job.join(timeout=10) # The orphan keeps the pipes open until killed
+    assert results == [0]
+    assert time.time() - start >= .2
+    assert [name for pid, name in job.processes[0].orphans] == ["sleep"]
+    assert group_members(pgid) == []
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Always polls")
+def test_job_exit_polling_without_pidfd_nor_wakeup(reactor, monkeypatch):
+    monkeypatch.delattr(os, "pidfd_open", raising=False)
+    monkeypatch.setattr(core, "EXIT_POLLING_DELAY", .01)
+    assert not reactor.add_signal_callback(core.SIGCHLD, id)
+    polls = []
+    wait_usage = core.wait_usage
+    monkeypatch.setattr(core, "wait_usage", lambda *args, **kwargs:
+                        polls.append(args) or wait_usage(*args, **kwargs))
+    results = []
+    job = core.Job("sleep .1; exit 3", after=results.append,
+                   reactor=reactor)
+    job.join(timeout=10)
+    assert results == [3]
+    assert len(polls) > 2
+    assert job.processes[0].exit_polling
+
+
+def test_cached_job_replays_the_output(reactor, capsys):
+    results = []
+    entry = {"output": [(1, "out\n"), (2, "err\n")], "returncode": 3}
+    job = core.CachedJob(entry, "never run", after=results.append,
+                         reactor=reactor)
+    job.join(timeout=10)
+    assert results == [3]
+    assert not job.spawned and job.usage is None
+    out, err = capsys.readouterr()
+    assert out == "out\n"
+    assert "err\n" in err
@@ -0,0 +1,70 @@
+"""Dose GUI for TDD: test module for the event burst coalescing."""
+import threading, time
+from dose.debounce import Debouncer
+
+
+class Collector(object):
+
+    def __init__(self):
+        self.calls = []
+        self.called = threading.Event()
+
+    def __call__(self, items):
+        self.calls.append((time.time(), items))
+        self.called.set()
+
+
+class TestDebouncer(object):
+
+    def test_burst_is_coalesced(self):
+        collector = Collector()
+        debouncer = Debouncer(collector, quiet=.1, max_wait=5.)
+        start = time.time()
+        for item in range(5):
+            debouncer.add(item)
+            time.sleep(.02)
+        assert collector.called.wait(2)
+        time.sleep(.15)
+        assert [items for unused, items in collector.calls] == \
+               [[0, 1, 2, 3, 4]]
+        assert collector.calls[0][0] - start >= .18 # Last add + quiet
+
+    def test_max_wait(self):
+        collector = Collector()
+        debouncer = Debouncer(collector, quiet=.1, max_wait=.2)
+        start = time.time()
+        while not collector.called.is_set() and time.time() - start < 2:
+            debouncer.add(None)
+            time.sleep(.02)
+        when, items = collector.calls[0]
+        assert .18 <= when - start < .5
+        assert 5 <= len(items) <= 15
+        debouncer.cancel()
+
+    def test_cancel(self):
+        collector = Collector()
+        debouncer = Debouncer(collector, quiet=.05)
+        debouncer.add("a")
+        debouncer.cancel()
+        debouncer.add("b")
+        assert collector.called.wait(2)
+        time.sleep(.1)
+        assert [items for unused, items in collector.calls] == [["b"]]
+
+    def test_no_thread_for_each_burst(self):
+        collector = Collector()
+        debouncer = Debouncer(collector, quiet=.01, max_wait=.05)
+        threads = threading.active_count()
+        for burst in range(3):
+            collector.called.clear()
+            debouncer.add(burst)
+            debouncer.add(burst)
+            assert threading.active_count() == threads
+            assert collector.called.wait(2)
+        assert [items for unused, items in collector.calls] == \
+               [[0, 0], [1, 1], [2, 2]]
+
+    def test_disabled(self):
+        collector = Collector()
+        Debouncer(collector, quiet=0).add("a")
+        assert [items for unused, items in collector.calls] == [["a"]]
@@ -0,0 +1,49 @@
+"""Dose GUI for TDD: test module for the shell-less test command parsing."""
+import os, sys, pytest
+from dose.direct import which, ExecutableCache, direct_argv
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32",
+                                reason="Always uses the shell")
+
+
+@pytest.fixture
+def bin_path(tmpdir, monkeypatch):
+    executable = tmpdir.join("mytool")
+    executable.write("#!/bin/sh\n")
+    executable.chmod(0o755)
+    tmpdir.join("data").write("")
+    monkeypatch.setenv("PATH", str(tmpdir))
+    return tmpdir
+
+
+def test_which(bin_path):
+    assert which("mytool") == str(bin_path.join("mytool"))
+    assert which("data") is None # Not executable
+    assert which("missing") is None
+    assert which("mytool", path=os.defpath) is None
+
+
+def test_executable_cache(bin_path):
+    cache = ExecutableCache()
+    fname = str(bin_path.join("mytool"))
+    assert cache.resolve("mytool") == fname
+    bin_path.join("mytool").chmod(0o644) # Invalidates the cached path
+    assert cache.resolve("mytool") is None
+    bin_path.join("mytool").chmod(0o755)
+    assert cache.resolve("mytool") == fname
+
+
+class TestDirectArgv(object):
+
+    def test_simple(self, bin_path):
+        fname = str(bin_path.join("mytool"))
+        assert direct_argv("mytool -x 'a b'") == [fname, "-x", "a b"]
+        assert direct_argv("./script.sh arg") == ["./script.sh", "arg"]
+
+    @pytest.mark.parametrize("command", [
+        "mytool | tee log", "mytool > log", "mytool && echo ok",
+        "mytool test_*.py", "mytool $HOME", "X=1 mytool", "cd dir",
+        "mytool 'unbalanced", "",
+    ])
+    def test_requires_shell(self, bin_path, command):
+        assert direct_argv(command) is None
@@ -0,0 +1,190 @@
+"""Dose GUI for TDD: test module for the warm fork server runner."""
+import os, signal, sys, time, pytest
+import dose
+from dose.forkserver import ForkServer, ForkServerJob, parse_python_command
+from dose.proctree import group_members
+
+supported = pytest.mark.skipif(not ForkServer.is_supported(),
+                               reason="No UNIX socket fd passing")
+
+
+class TestParsePythonCommand(object):
+
+    def test_module_and_script(self):
+        assert parse_python_command("python -m pytest -x") \
+               == ["-m", "pytest", "-x"]
+        assert parse_python_command("python3.9 tests.py 'a b'") \
+               == ["tests.py", "a b"]
+        assert parse_python_command(sys.executable + " t.py") == ["t.py"]
+
+    @pytest.mark.parametrize("command", [
+        "", "python", "python -m", "python -B -m pytest", "python -c 1",
+        "pytest -x", "py.test", "python t.py | tee log", "python t.py;ls",
+        "python t.py > log", "python '$HOME.py'", "python 'unbalanced",
+        "FOO=1 python t.py",
+    ])
+    def test_not_a_zygote_command(self, command):
+        assert parse_python_command(command) is None
+
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(dose.__file__)))
+    monkeypatch.setenv("PYTHONPATH", root) # For "python -m dose.zygote"
+    tmpdir.join("preloaded.py").write("VALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    server = ForkServer(["preloaded"], work_dir=str(tmpdir))
+    yield server
+    server.stop()
+
+
+def run(server, command, **kwargs):
+    results = []
+    runner = ForkServerJob(
+        server, command, work_dir=server.work_dir, capture=True,
+        after=results.append, **kwargs
+    )
+    return runner, results
+
+
+def output(runner, fd):
+    return "".join(text for text_fd, text in runner.output if text_fd == fd)
+
+
+@supported
+def test_output_and_exit_code_relay(tmpdir, server):
+    tmpdir.join("job.py").write("\n".join([
+        "import sys, preloaded",
+        "print(preloaded.VALUE, sys.argv[1:])",
+        "sys.stderr.write('error\\n')",
+        "sys.exit(3)",
+    ]))
+    runner, results = run(server, "python job.py a b")
+    runner.join()
+    assert results == [3]
+    assert output(runner, 1) == "42 ['a', 'b']\n"
+    assert output(runner, 2) == "error\n"
+    assert runner.usage.max_rss > 0
+    runner, results = run(server, "python -m job") # Same zygote
+    runner.join()
+    assert results == [3]
+    assert server._process.poll() is None
+
+
+@supported
+def test_kill_and_orphan_reaping(tmpdir, server):
+    tmpdir.join("job.py").write("\n".join([
+        "import subprocess, sys, time",
+        "orphan = subprocess.Popen(['sleep', '30'])",
+        "print(orphan.pid)",
+        "sys.stdout.flush()",
+        "time.sleep(30)",
+    ]))
+    runner, results = run(server, "python job.py")
+    deadline = time.time() + 10
+    while not runner.output and time.time() < deadline:
+        time.sleep(.01)
+    pgid = runner.processes[0].pid
+    assert len(group_members(pgid)) == 2
+    runner.kill()
+    assert results == [-signal.SIGTERM]
+    assert group_members(pgid) == []
+
+
+@supported
+def test_kill_while_preloading(tmpdir, server):
+    tmpdir.join("preloaded.py").write("import time\ntime.sleep(30)\n")
+    tmpdir.join("job.py").write("print('never')\n")
+    runner, results = run(server, "python job.py")
+    deadline = time.time() + 10
+    while not runner.spawned and time.time() < deadline:
+        time.sleep(.01)
+    assert not server.ready
+    start = time.time()
+    runner.kill()
+    assert time.time() - start < 10
+    assert results == [None]
+    assert runner.output == []
+    server._process.wait() # The zygote was terminated
+    assert server.stale
+
+
+@supported
+def test_zygote_death_fails_the_job(tmpdir, server):
+    tmpdir.join("job.py").write("print('started')\nimport time\n"
+                                "time.sleep(30)\n")
+    errors = []
+    runner, results = run(server, "python job.py",
+                          exception=lambda *exc_info: errors.append(exc_info))
+    deadline = time.time() + 10
+    while not runner.output and time.time() < deadline:
+        time.sleep(.01)
+    pid = runner.processes[0].pid
+    try:
+        os.kill(server._process.pid, signal.SIGKILL)
+        runner.join(10)
+        assert not runner.is_alive()
+        assert results == []
+        assert errors[0][0] is EOFError
+    finally:
+        os.killpg(pid, signal.SIGKILL)
+
+
+@supported
+def test_zygote_restarts(tmpdir, server):
+    tmpdir.join("job.py").write("import preloaded\n")
+    runner, results = run(server, "python job.py")
+    runner.join()
+    first_zygote = server._process
+    assert not server.stale
+    os.kill(first_zygote.pid, signal.SIGKILL) # Died
+    first_zygote.wait()
+    assert server.stale
+    runner, results = run(server, "python job.py")
+    runner.join()
+    assert results == [0]
+    second_zygote = server._process
+    assert second_zygote is not first_zygote
+    mtime = os.stat(str(tmpdir.join("preloaded.py"))).st_mtime
+    os.utime(str(tmpdir.join("preloaded.py")), (mtime + 5, mtime + 5))
+    assert server.stale # A preloaded module had changed
+    runner, results = run(server, "python job.py")
+    runner.join()
+    assert results == [0]
+    assert server._process not in [first_zygote, second_zygote]
+
+
+@supported
+def test_zygote_messages_with_fds():
+    import socket
+    from dose.zygote import recv_message, send_message
+    left, right = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    read_fd, write_fd = os.pipe()
+    try:
+        send_message(left, {"argv": ["x"] * 10000}, fds=[write_fd])
+        message, fds = recv_message(right)
+        assert message == {"argv": ["x"] * 10000}
+        assert len(fds) == 1
+        os.write(fds[0], b"ok")
+        os.close(fds[0])
+        assert os.read(read_fd, 2) == b"ok"
+        left.close()
+        with pytest.raises(EOFError):
+            recv_message(right)
+    finally:
+        right.close()
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+@pytest.mark.parametrize("code, status", [
+    ("pass", 0), ("raise SystemExit", 0), ("raise SystemExit(258)", 2),
+    ("raise SystemExit('msg')", 1), ("1 / 0", 1),
+])
+def test_zygote_run_job_exit_status(tmpdir, monkeypatch, capsys, code,
+                                    status):
+    from dose.zygote import run_job
+    monkeypatch.setattr(sys, "argv", list(sys.argv))
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    tmpdir.join("job.py").write(code)
+    assert run_job([str(tmpdir.join("job.py"))]) == status
@@ -0,0 +1,114 @@
+"""Dose GUI for TDD: test module for the headless mode."""
+import io, subprocess, sys, time
+from dose.headless import HeadlessWatcher, MainLoop, set_title
+
+
+class TTY(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+def test_neither_wx_nor_docutils_are_imported():
+    code = "\n".join([
+        "import sys, dose.__main__, dose.headless",
+        "print(sorted(name for name in sys.modules",
+        "             if name.split('.')[0] in ['wx', 'docutils']))",
+    ])
+    assert subprocess.check_output([sys.executable, "-c", code]).strip() \
+           == b"[]"
+
+
+def test_set_title_only_on_terminals():
+    stream, tty = io.StringIO(), TTY()
+    set_title(u"Dose", stream)
+    set_title(u"Dose", tty)
+    assert stream.getvalue() == u""
+    assert tty.getvalue() == u"\033]0;Dose\007"
+
+
+def test_main_loop_runs_the_calls_while_running():
+    loop, calls = MainLoop(), []
+    loop.call_after(calls.append, 1)
+    loop.call_after(calls.append, 2)
+    loop.run(lambda: len(calls) < 2)
+    assert calls == [1, 2]
+
+
+def test_headless_watcher_runs_the_test_job(tmpdir):
+    states = []
+
+    class Watcher(HeadlessWatcher):
+
+        def on_yellow(self):
+            states.append("yellow")
+
+        def on_red(self):
+            states.append("red")
+            self.stop()
+
+    loop = MainLoop()
+    watcher = Watcher(loop)
+    watcher.configure(directory=str(tmpdir), call_string="exit 1",
+                      debounce=0)
+    watcher.start()
+    loop.run(lambda: watcher.watching)
+    assert states == ["yellow", "red"]
+
+
+def test_deferred_changes_are_not_self_writes(tmpdir):
+    class Watcher(HeadlessWatcher):
+
+        def on_yellow(self):
+            self.loop.call_after(tmpdir.join("a.py").write, "x")
+
+    loop = MainLoop()
+    watcher = Watcher(loop)
+    watcher.configure(directory=str(tmpdir), call_string="sleep 5",
+                      policy="finish", debounce=0)
+    watcher.start()
+    deadline = time.time() + 5
+    try:
+        loop.run(lambda: not watcher._deferred and time.time() < deadline)
+        assert [evt.path for evt in watcher._deferred] == ["a.py"]
+        assert watcher._self_writes._killers == {"a.py"}
+    finally:
+        watcher.stop()
+
+
+def test_cycle_rejected_saves_are_not_self_writes(tmpdir):
+    reasons = []
+
+    class Watcher(HeadlessWatcher):
+
+        def _rejection(self, evt):
+            reason = super(Watcher, self)._rejection(evt)
+            reasons.append((evt.path, reason))
+            return reason
+
+    def run_until(condition):
+        deadline = time.time() + 5
+        loop.run(lambda: not condition() and time.time() < deadline)
+        assert condition()
+
+    def save_and_run_until(path, condition):
+        tmpdir.join(path).write("x")
+        run_until(condition)
+
+    loop = MainLoop()
+    watcher = Watcher(loop)
+    watcher.configure(directory=str(tmpdir), call_string="sleep 5",
+                      debounce=0)
+    watcher.start()
+    try:
+        run_until(lambda: watcher._runner.spawned)
+        save_and_run_until("a.py", lambda: watcher._trigger == "a.py" and
+                                           watcher._runner.spawned)
+        save_and_run_until("a.py", lambda: ("a.py", "cycle") in reasons)
+        save_and_run_until("b.py", lambda: watcher._trigger == "b.py" and
+                                           watcher._runner.spawned)
+        del reasons[:]
+        save_and_run_until("a.py", lambda: reasons) # In the next window
+        assert "self-write" not in [reason for unused, reason in reasons]
+    finally:
+        watcher.stop()
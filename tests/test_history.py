@@ -0,0 +1,93 @@
+"""Dose GUI for TDD: test module for the persistent run history."""
+import pytest
+from dose.history import median, percentile, regression, RunHistory, report
+
+
+def test_median_and_percentile():
+    assert median([3, 1, 2]) == 2
+    assert median([4, 1, 3, 2]) == 2.5
+    assert percentile([1, 2, 3, 4, 5], .5) == 3
+    assert percentile([1, 2, 3, 4, 5], .9) == pytest.approx(4.6)
+    assert percentile([7], .99) == 7
+
+
+class TestRegression(object):
+
+    def test_small_baseline(self):
+        assert regression(100., [1., 1., 1., 1.]) is None
+
+    def test_slower(self):
+        baseline = [1., 1.1, .9, 1., 1.05, .95]
+        center, spread = regression(2., baseline)
+        assert center == 1.
+        assert spread == pytest.approx(.05 * 1.4826)
+        assert regression(1.15, baseline) is None
+
+    def test_constant_baseline(self):
+        baseline = [2.] * 5 # The MAD is zero
+        assert regression(2.2, baseline) is None
+        assert regression(2.4, baseline) == (2., pytest.approx(.1))
+
+
+def test_run_history_and_report(tmpdir):
+    fname = str(tmpdir.join("history.sqlite3"))
+    regressions = []
+    history = RunHistory(fname, on_regression=lambda run, center, spread:
+                                                regressions.append(run))
+    for idx, wall in enumerate([1., 1.1, .9, 1., 1., 5., 9.]):
+        history.record(timestamp=idx, directory="/project", command="pytest",
+                       path="a.py", returncode=int(wall == 9.), wall=wall)
+    history.close()
+    assert [run["wall"] for run in regressions] == [5.]
+
+    lines = report(fname).splitlines()
+    assert lines[0] == "/project $ pytest"
+    assert lines[1].startswith("  7 run(s), 6 passing in the last 7, ")
+    assert lines[2] == "  duration p50 1.00s, p90 3.05s, p99 4.81s, " \
+                       "max 5.00s"
+    assert report(str(tmpdir.join("missing"))).startswith("No history")
+
+
+def test_run_history_errors_dont_stop_it(tmpdir):
+    errors = []
+    history = RunHistory(str(tmpdir), on_error=errors.append) # A directory
+    for idx in range(2):
+        history.record(directory="/project", command="pytest",
+                       returncode=0, wall=1.)
+    history.close()
+    assert len(errors) == 2
+
+    fname = str(tmpdir.join("history.sqlite3"))
+    history = RunHistory(fname, on_error=errors.append)
+    history.record(directory="/project", command="pytest",
+                   returncode=None) # Violates a NOT NULL constraint
+    history.record(directory="/project", command="pytest",
+                   returncode=0, wall=1.)
+    history.close()
+    assert len(errors) == 3
+    assert report(fname).splitlines()[1].startswith("  1 run(s)")
+
+
+def test_load_durations(tmpdir):
+    fname = str(tmpdir.join("history.sqlite3"))
+    history = RunHistory(fname)
+    for wall, returncode, directory in [(1., 0, "/a"), (2., 0, "/a"),
+                                        (3., 1, "/a"), (4., 0, "/a"),
+                                        (5., 0, "/b")]:
+        history.record(directory=directory, command="pytest",
+                       returncode=returncode, wall=wall)
+    history.close()
+    loaded = []
+    history = RunHistory(fname)
+    history.load_durations("/a", loaded.append, limit=2)
+    history.load_durations("/c", loaded.append)
+    history.close()
+    assert loaded == [{"pytest": [2., 4.]}, {}]
+
+
+def test_history_report_option(tmpdir, capsys):
+    from dose.__main__ import main, parse_args
+    fname = str(tmpdir.join("missing.sqlite3"))
+    main("--history-report", "--history-file", fname)
+    assert capsys.readouterr().out == "No history in {0}\n".format(fname)
+    assert parse_args(["history"])["test_command"] == "history"
@@ -0,0 +1,114 @@
+"""Dose GUI for TDD: test module for the skip patterns and git ignores."""
+import os, fnmatch
+import pytest
+from dose import ignore
+from dose.ignore import PatternMatcher, GitIgnore, glob_regex, is_ignore_file
+
+SKIP_PATTERN = "*.pyc; .git/*; __pycache__/*; *__pycache__/*; .*; *~; a[!b]c"
+PATHS = ["mod.py", "mod.pyc", os.path.join("pkg", "mod.pyc"),
+         os.path.join(".git", "HEAD"), ".hidden", "backup~", "abc", "axc",
+         os.path.join("pkg", "__pycache__", "mod.cpython-37.pyc"),
+         "[x", "a.pyc.py"]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_pattern_matcher_is_fnmatch(path):
+    matcher = PatternMatcher(SKIP_PATTERN)
+    assert matcher.skip_pattern == SKIP_PATTERN
+    assert matcher(path) == any(fnmatch.fnmatch(path, pattern.strip())
+                                for pattern in SKIP_PATTERN.split(";"))
+
+
+@pytest.mark.parametrize("pattern", ["[x", "a[]]b", "[!]]", "x?y*z", "a.b"])
+def test_glob_regex_like_fnmatch_translate(pattern):
+    import re
+    regex = re.compile("(?:{0})\\Z".format(glob_regex(pattern)), re.DOTALL)
+    for name in ["[x", "a]b", "x", "xay/z", "a.b", "axb", "]"]:
+        assert bool(regex.match(name)) == fnmatch.fnmatchcase(name, pattern)
+
+
+class TestGitIgnore(object):
+
+    def ignored(self, tmpdir, *paths):
+        gitignore = GitIgnore(str(tmpdir))
+        return [path for path in paths
+                     if gitignore(path.replace("/", os.sep))]
+
+    def test_unanchored_anchored_and_directories(self, tmpdir):
+        tmpdir.join(".gitignore").write("\n".join([
+            "# Comment",
+            "*.log",
+            "/root.txt",
+            "build/",
+            "docs/*.html",
+            "",
+        ]))
+        assert self.ignored(tmpdir,
+            "a.log", "sub/b.log", "root.txt", "sub/root.txt",
+            "build/x.py", "sub/build/y.py", "build", "docs/index.html",
+            "docs/sub/index.html", "sub/docs/index.html", "main.py",
+        ) == ["a.log", "sub/b.log", "root.txt", "build/x.py",
+              "sub/build/y.py", "docs/index.html"]
+
+    def test_double_asterisk(self, tmpdir):
+        tmpdir.join(".gitignore").write("**/logs\na/**/b\ncache/**\n")
+        assert self.ignored(tmpdir,
+            "logs", "x/y/logs", "x/logs/z", "a/b", "a/x/y/b", "b",
+            "cache", "cache/x/y",
+        ) == ["logs", "x/y/logs", "x/logs/z", "a/b", "a/x/y/b", "cache/x/y"]
+
+    def test_precedence(self, tmpdir):
+        tmpdir.join(".git", "info", "exclude").write("*.txt\n!keep.md\n",
+                                                     ensure=True)
+        tmpdir.join(".gitignore").write("*.md\n!important.txt\nout/\n")
+        tmpdir.join("sub", ".gitignore").write("!*.md\n", ensure=True)
+        tmpdir.join("out", ".gitignore").write("!*\n", ensure=True)
+        assert self.ignored(tmpdir,
+            "a.txt", "important.txt", "keep.md", "sub/x.md", "sub/y.txt",
+            "out/z.py",
+        ) == ["a.txt", "keep.md", "sub/y.txt", "out/z.py"]
+
+    def test_more_rules_than_regex_groups(self, tmpdir):
+        size = 2 * ignore.MAX_REGEX_GROUPS + 50
+        tmpdir.join(".gitignore").write("\n".join(
+            ["*.log"] + ["file{0}.txt".format(idx) for idx in range(size)]
+            + ["!keep.log", "!file7.txt"]
+        ))
+        assert self.ignored(tmpdir,
+            "a.log", "keep.log", "file0.txt", "file7.txt", "sub/file100.txt",
+            "file{0}.txt".format(size - 1), "file{0}.txt".format(size),
+        ) == ["a.log", "file0.txt", "sub/file100.txt",
+              "file{0}.txt".format(size - 1)]
+        assert len(GitIgnore(str(tmpdir))._state[0]) == 3
+
+    def test_load_compiles_every_file_once(self, tmpdir, monkeypatch):
+        for idx in range(10):
+            tmpdir.join("d{0}".format(idx), ".gitignore").write(
+                "*.tmp{0}\n".format(idx), ensure=True,
+            )
+        tmpdir.join("d3", "ignored", ".gitignore").write("!*.tmp3\n",
+                                                         ensure=True)
+        tmpdir.join("d3", ".gitignore").write("*.tmp3\nignored/\n")
+        compiled = []
+        regex_chunks = ignore.regex_chunks
+        monkeypatch.setattr(ignore, "regex_chunks", lambda rules:
+                            compiled.extend(rules) or regex_chunks(rules))
+        gitignore = GitIgnore(str(tmpdir))
+        assert len(compiled) == 2 * (10 + 11) # When found, then at the end
+        assert len(gitignore._state[1]) == 1
+        assert gitignore(os.path.join("d3", "ignored", "a.tmp3"))
+        assert not gitignore(os.path.join("d4", "a.tmp3"))
+
+    def test_reload(self, tmpdir):
+        gitignore = GitIgnore(str(tmpdir))
+        assert not gitignore("a.log")
+        tmpdir.join(".gitignore").write("*.log\n")
+        gitignore.load()
+        assert gitignore("a.log")
+
+
+def test_is_ignore_file():
+    assert is_ignore_file(".gitignore")
+    assert is_ignore_file(os.path.join("sub", ".gitignore"))
+    assert is_ignore_file(os.path.join(".git", "info", "exclude"))
+    assert not is_ignore_file("exclude")
@@ -0,0 +1,118 @@
+"""Dose GUI for TDD: test module for the static import graph."""
+import os, pytest
+from dose.imports import (is_test_file, imported_names, ImportGraph,
+                          selected_tests_command, full_tests_command)
+
+
+def test_is_test_file():
+    assert is_test_file("test_this.py")
+    assert is_test_file(os.path.join("tests", "that_test.py"))
+    assert not is_test_file("testing.py")
+    assert not is_test_file(os.path.join("test_dir", "conftest.py"))
+
+
+class TestImportedNames(object):
+
+    def test_absolute(self):
+        source = b"import os.path, json as j\nfrom a.b import c, d\n"
+        assert imported_names(source) == {"os", "os.path", "json",
+                                          "a", "a.b", "a.b.c", "a.b.d"}
+
+    def test_relative(self):
+        source = b"from . import x\nfrom ..y import z\nfrom .. import *\n"
+        assert imported_names(source, "pkg.sub") == {
+            "pkg", "pkg.sub", "pkg.sub.x", "pkg.y", "pkg.y.z",
+        }
+        assert imported_names(source) == set() # Unknown package
+
+    def test_relative_beyond_the_top_level_package(self):
+        source = b"from ...x import y\nfrom .... import z\n"
+        assert imported_names(source, "pkg.sub") == set()
+        assert imported_names(source, "a.b.c") == {"a", "a.x", "a.x.y"}
+
+    def test_nested_in_function(self):
+        source = b"def f():\n    import late\n"
+        assert imported_names(source) == {"late"}
+
+
+class TestImportGraph(object):
+
+    @pytest.fixture
+    def tree(self, tmpdir):
+        files = {
+          "pkg/__init__.py": "",
+          "pkg/core.py": "X = 1\n",
+          "pkg/api.py": "from .core import X\n",
+          "pkg/extra.py": "",
+          "tests/test_api.py": "from pkg import api\n",
+          "tests/test_core.py": "import pkg.core\n",
+          "tests/test_other.py": "import json\n",
+          "skipped/test_skipped.py": "import pkg.core\n",
+        }
+        for name, contents in files.items():
+            tmpdir.join(*name.split("/")).write(contents, ensure=True)
+        graph = ImportGraph(str(tmpdir),
+                            skip=lambda path: path.startswith("skipped"))
+        graph.scan()
+        yield tmpdir, graph
+
+    def test_transitive(self, tree):
+        tmpdir, graph = tree
+        core = os.path.join("pkg", "core.py")
+        assert graph.affected_tests([core]) == [
+            os.path.join("tests", "test_api.py"),
+            os.path.join("tests", "test_core.py"),
+        ]
+
+    def test_test_file_itself_and_unknown_file(self, tree):
+        tmpdir, graph = tree
+        other = os.path.join("tests", "test_other.py")
+        assert graph.affected_tests([other]) == [other]
+        assert graph.affected_tests([os.path.join("pkg", "extra.py")]) == []
+        assert graph.affected_tests(["data.json"]) is None
+
+    def test_incremental_update(self, tree):
+        tmpdir, graph = tree
+        extra = os.path.join("pkg", "extra.py")
+        other = os.path.join("tests", "test_other.py")
+        tmpdir.join("tests", "test_other.py").write("from pkg import extra\n")
+        graph.update(other)
+        assert graph.affected_tests([extra]) == [other]
+
+        api = os.path.join("pkg", "api.py")
+        tmpdir.join("pkg", "api.py").remove()
+        graph.update(api)
+        assert graph.affected_tests([api]) == [
+            os.path.join("tests", "test_api.py"),
+        ]
+        assert graph.affected_tests([os.path.join("pkg", "core.py")]) == [
+            os.path.join("tests", "test_core.py"),
+        ]
+
+    def test_moved(self, tree):
+        tmpdir, graph = tree
+        core, moved = os.path.join("pkg", "core.py"), "test_moved.py"
+        tmpdir.join("tests", "test_core.py").move(tmpdir.join(moved))
+        graph.update(os.path.join("tests", "test_core.py"), moved)
+        assert graph.affected_tests([core]) == [
+            moved, os.path.join("tests", "test_api.py"),
+        ]
+
+
+def test_import_graph_queries_and_updates_never_wait_for_the_scan(tmpdir):
+    tmpdir.join("test_it.py").write("import mod\n")
+    graph = ImportGraph(str(tmpdir))
+    graph.update("mod.py")
+    assert graph.affected_tests(["mod.py"]) is None # Unknown, not blocking
+    graph.scan()
+    assert graph.affected_tests(["mod.py"]) == ["test_it.py"]
+
+
+def test_selected_and_full_tests_command():
+    tests = ["test_a.py", "my tests/test_b.py"]
+    assert selected_tests_command("pytest -x", tests) \
+           == "pytest -x test_a.py 'my tests/test_b.py'"
+    assert selected_tests_command("tox -- {tests} -x", tests[:1]) \
+           == "tox -- test_a.py -x"
+    assert full_tests_command("tox -- {tests} -x") == "tox --  -x"
+    assert full_tests_command("pytest -x") == "pytest -x"
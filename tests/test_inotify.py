@@ -0,0 +1,127 @@
+"""Dose GUI for TDD: test module for the inotify watcher."""
+import os, threading, time
+import pytest
+from dose import inotify
+from dose.watcher import SharedObserver
+
+pytestmark = pytest.mark.skipif(not inotify.is_supported(),
+                                reason="inotify is unavailable")
+
+
+class Handler(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.events = []
+        self.changed = threading.Condition()
+
+    def on_any_event(self, evt):
+        with self.changed:
+            self.events.append((
+                evt.event_type,
+                os.path.relpath(evt.src_path, self.directory),
+                os.path.relpath(evt.dest_path, self.directory)
+                  if evt.dest_path else None,
+            ))
+            self.changed.notify_all()
+
+    def wait_for(self, *event, **kwargs):
+        deadline = time.time() + kwargs.get("timeout", 5)
+        with self.changed:
+            while event not in self.events and time.time() < deadline:
+                self.changed.wait(.05)
+            return event in self.events
+
+
+@pytest.fixture
+def observed(tmpdir):
+    tmpdir.join("pkg", "mod.py").write("", ensure=True)
+    tmpdir.join("node_modules", "lib", "index.js").write("", ensure=True)
+    handler = Handler(str(tmpdir))
+    observer = inotify.InotifyObserver()
+    watch = observer.schedule(handler, str(tmpdir), skip_dir=lambda path:
+                              os.path.basename(path) == "node_modules")
+    observer.start()
+    yield observer, watch, handler
+    observer.stop()
+    observer.join()
+
+
+def watched(observer):
+    return sorted(os.path.relpath(inotify._decode(path), watch.path)
+                  for watch, path in observer._wds)
+
+
+def test_skipped_directories_are_not_watched(tmpdir, observed):
+    observer, watch, handler = observed
+    assert watched(observer) == [".", "pkg"]
+    tmpdir.join("node_modules", "lib", "index.js").write("x")
+    tmpdir.join("pkg", "mod.py").write("x")
+    assert handler.wait_for("modified", os.path.join("pkg", "mod.py"), None)
+    assert not [evt for evt in handler.events if "lib" in evt[1]]
+
+
+def test_new_moved_and_deleted_directories(tmpdir, observed):
+    observer, watch, handler = observed
+    tmpdir.join("new", "sub").ensure(dir=True)
+    assert handler.wait_for("created", os.path.join("new", "sub"), None)
+    tmpdir.join("new", "sub", "test.py").write("x")
+    assert handler.wait_for("created",
+                            os.path.join("new", "sub", "test.py"), None)
+    assert watched(observer) == [".", "new", os.path.join("new", "sub"),
+                                 "pkg"]
+
+    tmpdir.join("new").rename(tmpdir.join("moved"))
+    assert handler.wait_for("moved", "new", "moved")
+    assert watched(observer) == [".", "moved",
+                                 os.path.join("moved", "sub"), "pkg"]
+
+    tmpdir.join("moved").remove()
+    assert handler.wait_for("deleted", "moved", None)
+    deadline = time.time() + 5
+    while len(watched(observer)) > 2 and time.time() < deadline:
+        time.sleep(.05)
+    assert watched(observer) == [".", "pkg"]
+
+
+def test_unschedule(observed):
+    observer, watch, handler = observed
+    observer.unschedule(watch)
+    assert watched(observer) == []
+
+
+def test_queue_overflow_dirties_everything(observed):
+    observer, watch, handler = observed
+    with observer._lock:
+        observer._process(inotify.EVENT_HEADER.pack(
+            -1, inotify.IN_Q_OVERFLOW, 0, 0,
+        ))
+    assert ("modified", os.path.join("pkg", "mod.py"), None) \
+           in handler.events
+    assert ("modified", "pkg", None) in handler.events
+    assert not [evt for evt in handler.events if "lib" in evt[1]]
+    assert watched(observer) == [".", "pkg"]
+
+
+def test_move_split_across_reads(observed):
+    observer, watch, handler = observed
+    wd = observer._wds[watch, watch.root]
+    def event(mask, name):
+        name = name.ljust(16, b"\0")
+        return inotify.EVENT_HEADER.pack(wd, mask, 7, len(name)) + name
+    with observer._lock:
+        observer._process(event(inotify.IN_MOVED_FROM, b"a.py"), more=True)
+        observer._process(event(inotify.IN_MOVED_TO, b"b.py"))
+    assert handler.events == [("moved", "a.py", "b.py")]
+
+
+def test_shared_observer_starts_no_idle_watchdog_observer(tmpdir):
+    shared = SharedObserver()
+    try:
+        watch = shared.schedule(str(tmpdir), lambda evt: True,
+                                lambda evt: None,
+                                skip_dir=lambda path: False)
+        assert isinstance(watch, inotify.Watch)
+        assert shared._observer is None
+    finally:
+        shared.stop()
@@ -0,0 +1,91 @@
+"""Dose GUI for TDD: test module for the legacy GUI module."""
+import importlib, sys, types, pytest
+import dose
+from dose import compat
+
+
+@pytest.fixture
+def legacy(monkeypatch):
+    """The legacy module imported with a stub wxPython module."""
+    wx = types.ModuleType("wx")
+    wx.PlatformInfo = ("phoenix",)
+    wx.Frame = wx.Menu = object
+    wx.mouse_position = 0, 0
+    wx.GetMousePosition = lambda: wx.mouse_position
+    monkeypatch.setitem(sys.modules, "wx", wx)
+    monkeypatch.setattr(compat, "wx", compat.LazyWx("wx"))
+    monkeypatch.delitem(sys.modules, "dose._legacy", raising=False)
+    monkeypatch.delattr(dose, "_legacy", raising=False)
+    return importlib.import_module("dose._legacy")
+
+
+class Event(object):
+
+    def __init__(self, ctrl=False, shift=False):
+        self.ctrl, self.shift = ctrl, shift
+
+    def ControlDown(self):
+        return self.ctrl
+
+    def ShiftDown(self):
+        return self.shift
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.starts = []
+        self.running = False
+
+    def Start(self, milliseconds, one_shot):
+        self.starts.append((milliseconds, one_shot))
+        self.running = True
+
+    def IsRunning(self):
+        return self.running
+
+    def Stop(self):
+        self.running = False
+
+
+def stub_frame(legacy):
+    """Interactive semaphore without a window, logging its changes."""
+
+    class Frame(legacy.DoseInteractiveSemaphore):
+        pos = size = opacity = None # Shadows the window properties
+
+        def __init__(self):
+            self.changes = []
+            self._key_state = self._pending = None
+            self._timer = Timer()
+            self.pos, self.size, self.opacity = (100, 100), (100, 300), 0x9f
+            del self.changes[:]
+
+        def __setattr__(self, name, value):
+            if name in ["pos", "size", "opacity"]:
+                self.changes.append((name, value))
+            super(Frame, self).__setattr__(name, value)
+
+    return Frame()
+
+
+@pytest.mark.parametrize("ctrl, shift, changes", [
+    (False, False, [("pos", (120, 130))]),
+    (True, False, [("size", (60, 240)), ("pos", (120, 130))]),
+    (False, True, [("opacity", 0x9f - 30)]),
+])
+def test_drag_burst_applies_a_single_geometry(legacy, ctrl, shift, changes):
+    frame = stub_frame(legacy)
+    wx = sys.modules["wx"]
+    wx.mouse_position = 110, 110
+    frame._drag(Event(ctrl, shift)) # Click
+    for idx in range(1, 21): # Burst of motion events
+        wx.mouse_position = 110 + idx, 110 + idx * 3 // 2
+        frame._drag(Event(ctrl, shift))
+    assert frame.changes == []
+    assert frame._timer.starts == [(legacy.DRAG_FRAME_INTERVAL, True)]
+    frame.on_timer(None)
+    assert frame.changes == changes
+    frame._timer.Stop()
+    frame._end_drag() # Nothing else pending
+    assert frame.changes == changes
@@ -0,0 +1,82 @@
+"""Dose GUI for TDD: test module for the watcher pipeline metrics."""
+import os, signal, sys, threading, time
+import pytest
+from dose.core import get_reactor
+from dose.metrics import (Histogram, PipelineMetrics, format_seconds,
+                          on_dump_signal)
+
+
+class Event(object):
+    pass
+
+
+def test_format_seconds():
+    assert format_seconds(.0123) == "12.3ms"
+    assert format_seconds(2.5) == "2.50s"
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    assert str(histogram) == "no samples"
+    for value in [.001] * 90 + [.1] * 10:
+        histogram.add(value)
+    assert histogram.count == 100
+    assert .001 <= histogram.percentile(.5) < .002
+    assert histogram.percentile(.99) == histogram.maximum == .1
+    assert str(histogram).startswith("100 samples, mean 10.9ms, p50 ")
+
+
+def test_pipeline_stages_and_decisions():
+    metrics = PipelineMetrics()
+    accepted, rejected, unchanged = Event(), Event(), Event()
+    for evt in [accepted, rejected, unchanged]:
+        metrics.observe(evt)
+    metrics.decide(accepted, None)
+    metrics.decide(rejected, "skipped")
+    metrics.decide(unchanged, None)
+    metrics.reject([unchanged], "unchanged")
+    time.sleep(.01)
+    metrics.stamp([accepted], "debounce")
+    metrics.stamp([accepted, Event()], "spawn") # Without stamps
+    assert metrics.decisions == {"accepted": 1, "skipped": 1,
+                                 "unchanged": 1}
+    assert metrics.peak_rate >= 2
+    assert metrics.histograms["selector"].count == 3
+    assert metrics.histograms["debounce"].maximum >= .01
+    assert metrics.histograms["queue"].count == 0
+    assert metrics.histograms["spawn"].count == 1
+    assert metrics.histograms["reaction"].maximum >= .01
+    report = metrics.report()
+    assert report[0].startswith("Events: 3 in ")
+    assert "  skipped: 1 (33.3%)" in report
+    assert "  queue: no samples" in report
+
+
+@pytest.fixture
+def restored_signals():
+    """Restore the SIGUSR1 handler and the signal wakeup fd afterwards."""
+    handler = signal.getsignal(signal.SIGUSR1)
+    wakeup_fd = signal.set_wakeup_fd(-1)
+    signal.set_wakeup_fd(wakeup_fd)
+    try:
+        yield
+    finally:
+        get_reactor().restore_signals()
+        signal.signal(signal.SIGUSR1, handler)
+        signal.set_wakeup_fd(wakeup_fd)
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="No SIGUSR1")
+def test_dump_signal_calls_back_from_another_thread(restored_signals):
+    called = threading.Event()
+    threads = []
+
+    def callback():
+        threads.append(threading.current_thread())
+        called.set()
+
+    assert on_dump_signal(callback)
+    os.kill(os.getpid(), signal.SIGUSR1)
+    assert called.wait(5) # The main thread is idle in C meanwhile
+    if sys.version_info >= (3, 4): # From the reactor thread
+        assert threads[0] is not threading.current_thread()
@@ -1,7 +1,8 @@
 """Dose GUI for TDD: test module for the miscellaneous functions."""
 import itertools, pytest
 from dose.misc import (not_eq, tail, snake2ucamel, attr_item_call_auto_cache,
-                       ucamel_method, LazyAccess, kw_map, read_plain_text)
+                       ucamel_method, LazyAccess, kw_map, lru_cache,
+                       read_plain_text)
 from dose.compat import PY2
 
 
@@ -188,6 +189,21 @@ class TestKwMap(object):
         assert params_as_tuple(2, 3, one=4) == (2, 3, 4, None)
 
 
+def test_lru_cache():
+    calls = []
+
+    @lru_cache(2)
+    def double(value):
+        calls.append(value)
+        return value * 2
+
+    assert [double(1), double(2), double(1)] == [2, 4, 2]
+    assert double(3) == 6 # Discards 2, the least recently used
+    assert [double(1), double(2)] == [2, 4]
+    assert calls == [1, 2, 3, 2]
+    assert list(double.cache) == [(1,), (2,)]
+
+
 class TestReadPlainText(object):
 
     def test_file_not_found(self):
@@ -0,0 +1,135 @@
+"""Dose GUI for TDD: test module for the stat polling watcher."""
+import os, threading, time
+import pytest
+from dose.polling import DIRECTORY, PollingObserver, list_directory
+
+
+class Handler(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.events = []
+        self.changed = threading.Condition()
+
+    def on_any_event(self, evt):
+        with self.changed:
+            self.events.append((
+                evt.event_type,
+                os.path.relpath(evt.src_path, self.directory),
+            ))
+            self.changed.notify_all()
+
+    def wait_for(self, *event, **kwargs):
+        deadline = time.time() + kwargs.get("timeout", 5)
+        with self.changed:
+            while event not in self.events and time.time() < deadline:
+                self.changed.wait(.05)
+            return event in self.events
+
+
+@pytest.fixture
+def polled(tmpdir):
+    tmpdir.join("pkg", "mod.py").write("", ensure=True)
+    tmpdir.join("node_modules", "index.js").write("", ensure=True)
+    handler = Handler(str(tmpdir))
+    reports = []
+    observer = PollingObserver(interval=.02, workers=2)
+    observer.schedule(handler, str(tmpdir), report=reports.append,
+                      skip_dir=lambda path: path == "node_modules")
+    observer.start()
+    while not reports:
+        time.sleep(.01)
+    yield observer, handler, reports
+    observer.stop()
+    observer.join()
+
+
+def test_list_directory(tmpdir):
+    tmpdir.join("sub").ensure(dir=True)
+    tmpdir.join("a.py").write("abc")
+    entries = list_directory(str(tmpdir))
+    assert entries["sub"] == DIRECTORY
+    assert entries["a.py"][::2] == (False, 3)
+
+
+def test_changes_and_pruning(tmpdir, polled):
+    observer, handler, reports = polled
+    assert reports[0]["files"] == 1
+    assert reports[0]["directories"] == 2 # The root and pkg
+    tmpdir.join("node_modules", "index.js").write("x")
+    tmpdir.join("pkg", "new.py").write("x")
+    assert handler.wait_for("created", os.path.join("pkg", "new.py"))
+    os.utime(str(tmpdir.join("pkg", "mod.py")), (1, 1))
+    assert handler.wait_for("modified", os.path.join("pkg", "mod.py"))
+    tmpdir.join("pkg").remove()
+    assert handler.wait_for("deleted", os.path.join("pkg", "mod.py"))
+    assert handler.wait_for("deleted", "pkg")
+    assert not [evt for evt in handler.events if "index" in evt[1]]
+
+
+def test_scans_within_the_cpu_share(tmpdir):
+    for idx in range(200):
+        tmpdir.join("dir{0}".format(idx % 10), str(idx)).write("",
+                                                               ensure=True)
+    reports = []
+    observer = PollingObserver(interval=0, cpu_share=.5)
+    observer.schedule(Handler(str(tmpdir)), str(tmpdir),
+                      report=reports.append)
+    observer.start()
+    time.sleep(.3)
+    observer.stop()
+    observer.join()
+    assert reports[0]["files"] == 200
+    for report in reports:
+        assert report["delay"] >= report["cpu"] * .99 # Half of the CPU
+
+
+def test_schedule_keeps_the_pool_and_the_other_trees_schedule(tmpdir):
+    tmpdir.join("a", "a.py").write("", ensure=True)
+    tmpdir.join("b", "b.py").write("", ensure=True)
+    reports_a, reports_b = [], []
+    observer = PollingObserver(interval=5, workers=2)
+    tree_a = observer.schedule(Handler(str(tmpdir.join("a"))),
+                               str(tmpdir.join("a")), report=reports_a.append)
+    observer.start()
+    while not reports_a:
+        time.sleep(.01)
+    pool = list(observer._pool)
+    next_scan = tree_a.next_scan
+    handler_b = Handler(str(tmpdir.join("b")))
+    observer.schedule(handler_b, str(tmpdir.join("b")),
+                      report=reports_b.append)
+    time.sleep(.1)
+    observer.stop()
+    observer.join()
+    assert len(reports_a) == len(reports_b) == 1
+    assert tree_a.next_scan == next_scan
+    assert observer._pool == pool and len(pool) == 2
+    assert not [thread for thread in pool if thread.is_alive()]
+
+
+def test_first_listing_in_the_observer_thread(tmpdir):
+    tmpdir.join("a.py").write("")
+    threads = []
+    observer = PollingObserver(interval=30)
+    observer.start() # Waiting for the interval, as there are no trees
+    time.sleep(.05)
+    observer.schedule(Handler(str(tmpdir)), str(tmpdir),
+                      report=lambda stats: threads.append(
+                          threading.current_thread()
+                      ))
+    deadline = time.time() + 5
+    while not threads and time.time() < deadline:
+        time.sleep(.01)
+    observer.stop()
+    observer.join()
+    assert threads == [observer._thread] # Woken up by the schedule call
+
+
+def test_poll_cpu_share_option():
+    from dose.__main__ import parse_args
+    assert parse_args(["--poll", "1", "--poll-cpu-share", "5", "cmd"]
+                     )["poll_cpu_share"] == .05
+    assert parse_args(["cmd"])["poll_cpu_share"] == .02
+    with pytest.raises(SystemExit):
+        parse_args(["--poll-cpu-share", "0", "cmd"])
@@ -0,0 +1,49 @@
+"""Dose GUI for TDD: test module for the process tree handling."""
+import os, subprocess, sys, time, pytest
+from dose.proctree import new_group_kwargs, group_members, terminate_tree
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32",
+                                reason="POSIX process groups")
+
+
+def spawn_group(command):
+    return subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                            **new_group_kwargs())
+
+
+def test_terminate_tree_with_orphans():
+    process = spawn_group("sleep 30 & echo $!")
+    orphan_pid = int(process.stdout.readline()) # Might not be "sleep" yet
+    process.wait()
+    orphans = terminate_tree(process, timeout=5)
+    assert [pid for pid, name in orphans] == [orphan_pid]
+    assert group_members(process.pid) == []
+    process.stdout.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "pidfd_open"), reason="pidfd")
+def test_terminate_tree_waits_for_the_orphans_to_finish():
+    process = spawn_group("sleep 30 & echo $!")
+    process.stdout.readline()
+    process.wait()
+    start = time.time()
+    assert len(terminate_tree(process, timeout=5)) == 1
+    assert time.time() - start < 2 # Way before the timeout
+    process.stdout.close()
+
+
+def test_terminate_tree_running_leader():
+    process = spawn_group("exec sleep 30")
+    assert [pid for pid, name in group_members(process.pid)] \
+           == [process.pid]
+    assert terminate_tree(process, timeout=5) == []
+    assert process.wait() != 0
+    assert group_members(process.pid) == []
+    process.stdout.close()
+
+
+def test_terminate_tree_finished():
+    process = spawn_group("true")
+    process.wait()
+    assert terminate_tree(process) == []
+    process.stdout.close()
@@ -0,0 +1,104 @@
+"""Dose GUI for TDD: test module for the multi-project job scheduler."""
+import functools, threading, time, pytest
+from dose.projects import JobScheduler
+
+
+class FakeJob(object):
+    started = []
+
+    def __init__(self, name, after, exception):
+        self.name = name
+        self.after = after
+        self.killed = False
+        FakeJob.started.append(name)
+
+    def kill(self):
+        self.killed = True
+
+    after = exception = staticmethod(lambda *args: None)
+
+
+class TestJobScheduler(object):
+
+    def setup_method(self, method):
+        FakeJob.started = []
+
+    def test_concurrency_cap_and_round_robin(self):
+        scheduler = JobScheduler(max_jobs=2)
+        results = []
+        jobs = [scheduler.submit(owner, FakeJob, name=name,
+                                 after=results.append)
+                for owner, name in [("a", "a1"), ("a", "a2"), ("a", "a3"),
+                                    ("b", "b1"), ("c", "c1")]]
+        assert FakeJob.started == ["a1", "a2"]
+        assert not jobs[2].spawned # Waiting, from the default attributes
+        jobs[0].job.after(0)
+        assert results == [0]
+        assert FakeJob.started == ["a1", "a2", "b1"] # Not a3
+        jobs[1].job.after(1)
+        assert FakeJob.started == ["a1", "a2", "b1", "c1"]
+        jobs[3].job.after(0)
+        assert FakeJob.started == ["a1", "a2", "b1", "c1", "a3"]
+
+    def test_kill(self):
+        scheduler = JobScheduler(max_jobs=1)
+        running = scheduler.submit("a", FakeJob, name="a1")
+        waiting = scheduler.submit("b", FakeJob, name="b1")
+        waiting.kill()
+        assert waiting.killed and not waiting.is_alive()
+        running.kill()
+        assert running.killed and running.job.killed
+        running.job.after(-15)
+        assert FakeJob.started == ["a1"] # b1 was cancelled
+
+    def test_start_failure_frees_the_slot(self):
+        scheduler = JobScheduler(max_jobs=1)
+        with pytest.raises(TypeError):
+            scheduler.submit("a", FakeJob, unknown=None)
+        assert scheduler.submit("a", FakeJob, name="a1").job is not None
+
+    def test_synchronous_job_releases_its_slot(self):
+        scheduler = JobScheduler(max_jobs=1)
+        done = scheduler.submit("a", ImmediateJob, name="a1")
+        assert not done.is_alive()
+        assert scheduler.submit("b", FakeJob, name="b1").job is not None
+
+
+class ImmediateJob(FakeJob):
+    """Finishes (calling after) while it's being started."""
+    def __init__(self, name, after, exception):
+        super(ImmediateJob, self).__init__(name, after, exception)
+        after(0)
+
+    def is_alive(self):
+        return False
+
+
+def test_real_jobs_concurrency_cap_and_fairness():
+    from dose.core import Job
+    scheduler = JobScheduler(max_jobs=2)
+    lock = threading.Lock()
+    running, starts, peaks = [0], [], []
+
+    def before(name):
+        with lock:
+            running[0] += 1
+            peaks.append(running[0])
+            starts.append(name)
+
+    def after(result):
+        with lock:
+            running[0] -= 1
+
+    jobs = [scheduler.submit(owner, Job, test_command="sleep .1",
+                             before=functools.partial(before, name),
+                             after=after)
+            for owner, name in [("a", "a1"), ("a", "a2"), ("a", "a3"),
+                                ("b", "b1"), ("c", "c1")]]
+    deadline = time.time() + 10
+    while any(job.is_alive() for job in jobs) and time.time() < deadline:
+        time.sleep(.01)
+    assert sorted(starts[:2]) == ["a1", "a2"]
+    assert starts[2:] == ["b1", "c1", "a3"]
+    assert max(peaks) == 2
+    assert running == [0]
@@ -0,0 +1,35 @@
+"""Dose GUI for TDD: test module for the threaded test job runner."""
+import os, signal, sys, threading, time, pytest
+from dose.runner import RunnerThreadCallback, spawn, wait_with_usage
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "waitid"),
+                                reason="POSIX waitid")
+
+
+def test_wait_with_usage_reaps_holding_the_lock():
+    process = spawn("exit 3")
+    lock = threading.Lock()
+    with lock:
+        thread = threading.Thread(target=wait_with_usage,
+                                  args=(process, lock))
+        thread.start()
+        time.sleep(.2) # It finishes meanwhile, but it isn't reaped
+        assert process.returncode is None
+        os.killpg(process.pid, 0) # Its process group still exists
+    thread.join()
+    assert process.returncode == 3
+    assert process.usage.user is not None
+
+
+def test_runner_thread_callback_kill():
+    results = []
+    runner = RunnerThreadCallback(
+        "{0} -c 'import time; time.sleep(30)'".format(sys.executable),
+        after=results.append,
+    )
+    deadline = time.time() + 5
+    while not runner.spawned and time.time() < deadline:
+        time.sleep(.01)
+    runner.kill()
+    assert runner.killed
+    assert results == [-signal.SIGTERM]
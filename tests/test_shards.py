@@ -0,0 +1,39 @@
+"""Dose GUI for TDD: test module for the test set splitting in shards."""
+import os
+from dose.shards import find_test_files, ShardPlanner
+
+
+def test_find_test_files(tmpdir):
+    for name in ["test_a.py", "b_test.py", "c.py", "sub/test_d.py",
+                 "skipped/test_e.py", "sub/test_f.txt"]:
+        tmpdir.join(*name.split("/")).write("", ensure=True)
+    result = find_test_files(str(tmpdir), skip=lambda path: "skip" in path)
+    assert result == {"test_a.py", "b_test.py",
+                      os.path.join("sub", "test_d.py")}
+
+
+class TestShardPlanner(object):
+
+    def test_round_robin_without_durations(self):
+        planner = ShardPlanner()
+        tests = ["test_{0}.py".format(idx) for idx in range(5)]
+        assert planner.split(tests, 2) == [
+            ["test_0.py", "test_2.py", "test_4.py"],
+            ["test_1.py", "test_3.py"],
+        ]
+        assert planner.split(tests[:2], 4) == [["test_0.py"], ["test_1.py"]]
+
+    def test_balanced_by_durations(self):
+        planner = ShardPlanner()
+        planner.durations.update({"a": 8., "b": 4., "c": 3., "d": 2.})
+        shards = planner.split(["a", "b", "c", "d", "e"], 2)
+        assert shards == [["a", "c"], ["b", "d", "e"]] # "e" is the median
+
+    def test_record(self):
+        planner = ShardPlanner()
+        planner.record([["a", "b"], ["c"]], [4., 1.])
+        assert planner.durations == {"a": 2., "b": 2., "c": 1.}
+        planner.record([["a", "b", "d"]], [12.])
+        assert planner.durations == {"a": 4., "b": 4., "c": 1., "d": 4.}
+        planner.record([["a", "c"]], [10.])
+        assert planner.durations == {"a": 8., "b": 4., "c": 2., "d": 4.}
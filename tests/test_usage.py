@@ -0,0 +1,42 @@
+"""Dose GUI for TDD: test module for the resource usage accounting."""
+import subprocess, sys, pytest
+from dose.usage import ResourceUsage, returncode, wait_usage
+
+
+class TestResourceUsage(object):
+
+    def test_str(self):
+        usage = ResourceUsage(wall=1.5, user=1., system=.25,
+                              max_rss=3 * 1024 ** 2, write_bytes=512)
+        assert str(usage) == "wall 1.50s | user 1.00s | sys 0.25s | " \
+                             "peak RSS 3.0MiB | written 512.0B"
+        assert str(ResourceUsage(wall=.1)) == "wall 0.10s"
+
+    def test_combine(self):
+        usage = ResourceUsage.combine([
+            ResourceUsage(wall=2., user=1., system=.5, max_rss=10,
+                          read_bytes=5),
+            ResourceUsage(wall=3., user=2., system=.5, max_rss=20),
+        ])
+        assert usage.to_dict() == {
+          "wall": 3., "user": 3., "system": 1., "max_rss": 20,
+          "read_bytes": 5, "write_bytes": None,
+        }
+
+    def test_unknown_field(self):
+        with pytest.raises(TypeError):
+            ResourceUsage(cpu=1.)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX wait4")
+def test_wait_usage_includes_descendants():
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import subprocess, sys; sys.exit("
+         "subprocess.call([sys.executable, '-c', 'x = bytearray(2 ** 26)'])"
+         " + 3)"],
+    )
+    status, usage = wait_usage(process.pid)
+    assert returncode(status) == 3
+    assert usage.max_rss >= 2 ** 26
+    assert usage.user + usage.system > 0
+    process.returncode = 3 # Already reaped